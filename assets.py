@@ -0,0 +1,301 @@
+import gzip
+import hashlib
+import io
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+import anyio
+from dotenv import load_dotenv
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Scope
+from logging_config import get_logger
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip siblings are always written
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it raster images get no WebP/AVIF variants
+    Image = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+STATIC_DIR = "static"
+ASSET_BUILD_DIR = os.getenv("ASSET_BUILD_DIR", os.path.join(STATIC_DIR, "build"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Fingerprinted names look like name.<12 hex chars>.ext
+_FINGERPRINT = re.compile(r"\.[0-9a-f]{12}\.[A-Za-z0-9]+$")
+
+# Preferred first; each maps to the sibling file suffix
+_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Raster formats offered by Accept, with the Pillow format name and save options
+_IMAGE_VARIANTS = (
+    ("image/avif", ".avif", "AVIF", {"quality": 60}),
+    ("image/webp", ".webp", "WEBP", {"quality": 85, "method": 6}),
+)
+_RASTER_SUFFIXES = (".png", ".jpg", ".jpeg")
+_COMPRESSIBLE_SUFFIXES = (".css", ".js", ".svg", ".json", ".txt", ".html")
+
+# Source name (relative to STATIC_DIR) -> fingerprinted URL
+_manifest: Dict[str, str] = {}
+
+
+def minify_css(css: str) -> str:
+    """
+    Strip comments and redundant whitespace from a stylesheet.
+
+    Only whitespace next to punctuation that never needs it is removed, so
+    selectors such as ``a :hover`` keep their meaning.
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}")
+    return css.strip()
+
+
+def minify_svg(svg: str) -> str:
+    """
+    Shrink an SVG without changing how it renders at display size.
+
+    Drops comments and the XML prolog, collapses whitespace between tags, removes
+    the spaces around path commands and rounds coordinates to three decimals.
+    """
+    svg = re.sub(r"<\?xml.*?\?>|<!--.*?-->", "", svg, flags=re.S)
+    svg = re.sub(r">\s+<", "><", svg)
+    svg = re.sub(
+        r'(\sd=")([^"]*)"',
+        lambda m: m.group(1) + re.sub(r"\s*([MLHVCSQTAZmlhvcsqtaz])\s*", r"\1", m.group(2)).strip() + '"',
+        svg,
+    )
+    svg = re.sub(r"(?<![\w.#])(-?\d*\.\d{4,})", lambda m: _round(m.group(1)), svg)
+    return svg.strip()
+
+
+def _round(number: str) -> str:
+    rounded = f"{float(number):.3f}".rstrip("0").rstrip(".")
+    return rounded if rounded not in ("", "-0") else "0"
+
+
+def fingerprint(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def write_image_variants(path: str, data: bytes) -> None:
+    """Write WebP and AVIF siblings of a raster image, keeping only those smaller than the original."""
+    if Image is None:
+        return
+    for _, suffix, image_format, options in _IMAGE_VARIANTS:
+        variant_path = path + suffix
+        if os.path.exists(variant_path):
+            continue
+        try:
+            with Image.open(path) as image:
+                buffer = io.BytesIO()
+                image.save(buffer, format=image_format, **options)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning("Could not build %s variant of %s: %s", image_format, path, e)
+            continue
+        if buffer.tell() < len(data):
+            write_atomic(variant_path, buffer.getvalue())
+            logger.info("Built %s (%s -> %s bytes)", os.path.basename(variant_path), len(data), buffer.tell())
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write ``data`` to ``path`` via a temporary file, so other workers never serve a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_compressed(path: str, data: bytes) -> None:
+    """Write ``data`` to ``path`` with ``.gz`` and, if available, ``.br`` siblings."""
+    # Siblings go first: a worker that sees ``path`` treats the asset as built
+    write_atomic(f"{path}.gz", gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        write_atomic(f"{path}.br", brotli.compress(data, quality=11))
+    write_atomic(path, data)
+
+
+def build_stylesheet(css: str, name: str = "styles", build_dir: str = ASSET_BUILD_DIR) -> str:
+    """
+    Write a minified, content-hashed copy of a stylesheet under the static mount.
+
+    Args:
+        css: The stylesheet source
+        name: Base name of the output file
+        build_dir: Directory inside STATIC_DIR to write to
+
+    Returns:
+        The URL the stylesheet is served from
+    """
+    data = minify_css(css).encode("utf-8")
+    filename = f"{name}.{fingerprint(data)}.css"
+    os.makedirs(build_dir, exist_ok=True)
+    path = os.path.join(build_dir, filename)
+    if not os.path.exists(path):
+        write_compressed(path, data)
+        logger.info("Built stylesheet %s (%s -> %s bytes)", filename, len(css), len(data))
+    _manifest[f"{name}.css"] = static_url(path)
+    return _manifest[f"{name}.css"]
+
+
+def build_static_assets(static_dir: str = STATIC_DIR, build_dir: str = ASSET_BUILD_DIR) -> Dict[str, str]:
+    """
+    Fingerprint every file at the top of ``static_dir`` into ``build_dir``.
+
+    SVGs are minified first. Text formats get ``.gz``/``.br`` siblings and raster
+    images get WebP/AVIF siblings, so CachedStaticFiles can negotiate per request.
+    Outputs are content addressed, so an unchanged file is not rebuilt on restart.
+
+    Args:
+        static_dir: Directory holding the source assets
+        build_dir: Directory inside STATIC_DIR to write to
+
+    Returns:
+        A mapping of source file name to fingerprinted URL
+    """
+    os.makedirs(build_dir, exist_ok=True)
+    for entry in sorted(os.scandir(static_dir), key=lambda e: e.name):
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        stem, ext = os.path.splitext(entry.name)
+        with open(entry.path, "rb") as f:
+            data = f.read()
+        if ext == ".svg":
+            data = minify_svg(data.decode("utf-8")).encode("utf-8")
+        path = os.path.join(build_dir, f"{stem}.{fingerprint(data)}{ext}")
+        if not os.path.exists(path):
+            if ext in _COMPRESSIBLE_SUFFIXES:
+                write_compressed(path, data)
+            else:
+                write_atomic(path, data)
+            logger.info("Built %s (%s -> %s bytes)", os.path.basename(path), entry.stat().st_size, len(data))
+        if ext in _RASTER_SUFFIXES:
+            write_image_variants(path, data)
+        _manifest[entry.name] = static_url(path)
+    return dict(_manifest)
+
+
+def asset_url(name: str) -> str:
+    """Return the fingerprinted URL of a static asset, or its plain URL if it was not built."""
+    return _manifest.get(name, f"/static/{name}")
+
+
+def static_url(path: str) -> str:
+    """Map a file path inside STATIC_DIR to its URL under the /static mount."""
+    return "/static/" + os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that serves precompressed or re-encoded siblings and caches fingerprinted files forever.
+
+    When the client accepts it and ``file.br`` or ``file.gz`` exists next to the
+    requested file, that sibling is sent with the matching Content-Encoding. Raster
+    images are likewise swapped for ``file.avif`` or ``file.webp`` based on Accept.
+    """
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if path.endswith(_RASTER_SUFFIXES):
+            vary = "Accept"
+            response = await self._variant_response(path, scope)
+        else:
+            vary = "Accept-Encoding"
+            response = await self._encoded_response(path, scope)
+        if response is None:
+            response = await super().get_response(path, scope)
+        if _FINGERPRINT.search(path) and response.status_code in (200, 304):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+            response.headers["Vary"] = vary
+        return response
+
+    async def _sibling_response(self, path: str, suffix: str, scope: Scope) -> Optional[Response]:
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+        if stat_result is None:
+            return None
+        return self.file_response(full_path, stat_result, scope)
+
+    async def _variant_response(self, path: str, scope: Scope) -> Optional[Response]:
+        accept = _accepted(_header(scope, b"accept"))
+        for media_type, suffix, _, _ in _IMAGE_VARIANTS:
+            if accept.get(media_type, 0) <= 0:
+                continue
+            response = await self._sibling_response(path, suffix, scope)
+            if response is not None:
+                response.headers["Content-Type"] = media_type
+                return response
+        return None
+
+    async def _encoded_response(self, path: str, scope: Scope) -> Optional[Response]:
+        accept_encoding = _accepted(_header(scope, b"accept-encoding"))
+        for encoding, suffix in _ENCODINGS:
+            if accept_encoding.get(encoding, accept_encoding.get("*", 0)) <= 0:
+                continue
+            response = await self._sibling_response(path, suffix, scope)
+            if response is None:
+                continue
+            media_type = self._media_type(path)
+            if media_type:
+                response.headers["Content-Type"] = media_type
+            response.headers["Content-Encoding"] = encoding
+            return response
+        return None
+
+    @staticmethod
+    def _media_type(path: str) -> Optional[str]:
+        media_type, _ = mimetypes.guess_type(path)
+        if media_type and media_type.startswith("text/"):
+            media_type += "; charset=utf-8"
+        return media_type
+
+
+def _header(scope: Scope, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1").lower()
+    return ""
+
+
+def _accepted(header: str) -> Dict[str, float]:
+    """
+    Parse an Accept-style header into each listed token's q-value.
+
+    ``gzip, br;q=0`` gives ``{"gzip": 1.0, "br": 0.0}``; a q of 0 means the client
+    refuses that token. A malformed q-value counts as a refusal.
+    """
+    accepted = {}
+    for item in header.split(","):
+        token, *params = [part.strip() for part in item.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[token] = q
+    return accepted
+
+
+if __name__ == "__main__":
+    # Build ahead of time (e.g. in the Docker image) so workers start with warm assets
+    from static import css_styles
+
+    build_static_assets()
+    build_stylesheet(css_styles)
@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import os
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from logging_config import get_logger
+from avatar_cache import avatar_url
+from mad_scientist import render_avatar
+from model_registry import registry
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Batch items generated at once; they also queue behind interactive calls in the upstream scheduler
+AVATAR_BATCH_CONCURRENCY = int(os.getenv("AVATAR_BATCH_CONCURRENCY", "4"))
+# Largest prompts x models x seeds product accepted in one batch
+AVATAR_BATCH_MAX_ITEMS = int(os.getenv("AVATAR_BATCH_MAX_ITEMS", "1000"))
+
+
+class AvatarBatch(BaseModel):
+    """Every combination of ``prompts``, ``models`` and ``seeds`` is rendered once."""
+
+    prompts: List[str] = Field(min_length=1)
+    # Model names; empty means every image model in the registry
+    models: List[str] = []
+    # None lets the model pick a seed, so only one image per prompt and model is kept
+    seeds: List[Optional[int]] = [None]
+    # Generation parameters for every item, checked against each model's bounds
+    params: Dict[str, Any] = {}
+    # Render at preview quality, e.g. to warm the cache for the avatar page's first render
+    preview: bool = False
+    regenerate: bool = False
+
+    def items(self) -> List[Tuple[str, str, Optional[int]]]:
+        """
+        Expand the batch into (prompt, model, seed) items.
+
+        Raises:
+            HTTPException: If a model is unknown (404), a parameter is invalid for
+                one of the models (422) or the batch is too large (413)
+        """
+        models = self.models or [ai.model for ai in registry.by_usage("art")]
+        seeds = self.seeds or [None]
+        # Reject oversized batches before any per-item work
+        count = len(self.prompts) * len(models) * len(seeds)
+        if count > AVATAR_BATCH_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"Batch of {count} items is over the {AVATAR_BATCH_MAX_ITEMS} item limit")
+        unknown = [model for model in models if registry.get_by_model(model.strip()) is None]
+        if unknown:
+            raise HTTPException(status_code=404, detail=f"Model not found: {', '.join(unknown)}")
+        for model, seed in itertools.product(models, seeds):
+            try:
+                registry.get_by_model(model.strip()).generation_params({**self.params, "seed": seed})
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        return list(itertools.product(self.prompts, models, seeds))
+
+
+async def _render_item(
+    index: int, prompt: str, model: str, seed: Optional[int], batch: AvatarBatch, limit: asyncio.Semaphore
+) -> Dict[str, Any]:
+    async with limit:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"index": index, "prompt": prompt, "model": model, "seed": seed}
+        params = {**batch.params, "seed": seed} if seed is not None else batch.params
+        try:
+            avatar_id, cached = await render_avatar(model, prompt, params, batch.preview, bypass_cache=batch.regenerate)
+            result.update(status="cached" if cached else "generated", avatar_url=avatar_url(avatar_id))
+        except HTTPException as e:
+            result.update(status="failed", error=str(e.detail), status_code=e.status_code)
+        except Exception as e:
+            logger.error("Batch item %s failed: %s", index, e)
+            result.update(status="failed", error="Failed to generate avatar", status_code=500)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run_batch(batch: AvatarBatch, concurrency: int = AVATAR_BATCH_CONCURRENCY) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Render batch items with bounded concurrency, yielding each result as it completes.
+
+    Items already in the avatar store are reported as ``cached`` without an
+    upstream call, so a batch that was interrupted can simply be sent again.
+    The last value yielded is ``{"summary": ...}`` with counts and latency
+    percentiles of the generated items. Closing the generator early cancels the
+    items that have not finished.
+
+    Args:
+        batch: The batch to render
+        concurrency: Items rendered at once
+    """
+    items = batch.items()
+    started = time.perf_counter()
+    limit = asyncio.Semaphore(concurrency)
+    tasks = [
+        asyncio.create_task(_render_item(index, prompt, model, seed, batch, limit))
+        for index, (prompt, model, seed) in enumerate(items)
+    ]
+    counts = {"generated": 0, "cached": 0, "failed": 0}
+    latencies = []
+    logger.info("Rendering avatar batch of %s items, %s at a time", len(items), concurrency)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            counts[result["status"]] += 1
+            if result["status"] == "generated":
+                latencies.append(result["seconds"])
+            yield result
+    finally:
+        for task in tasks:
+            task.cancel()
+    elapsed = time.perf_counter() - started
+    logger.info("Avatar batch finished in %.1fs: %s", elapsed, counts)
+    yield {"summary": {
+        "items": len(items),
+        **counts,
+        "seconds": round(elapsed, 3),
+        "p50_seconds": round(_percentile(latencies, 0.50), 3),
+        "p95_seconds": round(_percentile(latencies, 0.95), 3),
+    }}
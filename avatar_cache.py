@@ -0,0 +1,274 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+AVATAR_CACHE_MEMORY_BYTES = int(os.getenv("AVATAR_CACHE_MEMORY_BYTES", str(64 * 1024 * 1024)))
+AVATAR_CACHE_MEMORY_ITEMS = int(os.getenv("AVATAR_CACHE_MEMORY_ITEMS", "256"))
+AVATAR_CACHE_DIR = os.getenv("AVATAR_CACHE_DIR", "cache/avatars")
+AVATAR_CACHE_DISK_BYTES = int(os.getenv("AVATAR_CACHE_DISK_BYTES", str(1024 * 1024 * 1024)))
+# Request fingerprints only map to avatar ids, so their tier stays small
+AVATAR_CACHE_REF_ITEMS = int(os.getenv("AVATAR_CACHE_REF_ITEMS", "10000"))
+AVATAR_CACHE_REF_DISK_BYTES = int(os.getenv("AVATAR_CACHE_REF_DISK_BYTES", str(16 * 1024 * 1024)))
+
+AVATAR_ID_LENGTH = 32
+
+
+def cache_key(mid: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a content-addressed key for an image generation request.
+
+    Args:
+        mid: The image model id
+        prompt: The prompt text
+        params: Any extra generation parameters sent to the model
+
+    Returns:
+        A hex SHA-256 digest of the canonical request
+    """
+    canonical = json.dumps({"mid": mid, "prompt": prompt, "params": params or {}}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """Bounded in-memory LRU of byte strings, limited by entry count and total size."""
+
+    def __init__(self, max_bytes: int, max_items: int):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.size = 0
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+        return data
+
+    def set(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        self.pop(key)
+        self._entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes or len(self._entries) > self.max_items:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def pop(self, key: str) -> Optional[bytes]:
+        data = self._entries.pop(key, None)
+        if data is not None:
+            self.size -= len(data)
+        return data
+
+
+class DiskCache:
+    """
+    Directory of byte blobs with size-based eviction of the least recently used files.
+
+    File access times are tracked through mtime, which is refreshed on every read.
+    All methods block and are meant to be run in a worker thread.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, suffix: str = ".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.size = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(suffix):
+                self.size += entry.stat().st_size
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def contains(self, key: str) -> bool:
+        """Check that a blob is stored without reading it; counts as a use for eviction."""
+        try:
+            os.utime(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def set(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            try:
+                self.size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.size += len(data)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        self.size = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in files:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+                self.size -= size
+            except FileNotFoundError:
+                pass
+        logger.debug("Disk cache %s evicted down to %s bytes", self.directory, self.size)
+
+
+class TieredCache:
+    """Two-tier byte cache: a bounded memory LRU in front of an optional disk store."""
+
+    def __init__(self, memory: MemoryLRU, disk: Optional[DiskCache] = None):
+        self.memory = memory
+        self.disk = disk
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory_hits += 1
+            return data
+        if self.disk is not None:
+            data = await asyncio.to_thread(self.disk.get, key)
+            if data is not None:
+                self.disk_hits += 1
+                self.memory.set(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    async def contains(self, key: str) -> bool:
+        """Check either tier for ``key`` without loading its bytes."""
+        if key in self.memory:
+            return True
+        return self.disk is not None and await asyncio.to_thread(self.disk.contains, key)
+
+    async def set(self, key: str, data: bytes) -> None:
+        self.memory.set(key, data)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, data)
+            except OSError as e:
+                logger.error("Failed to write %s to disk cache: %s", key, e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_items": len(self.memory),
+            "memory_bytes": self.memory.size,
+            "disk_bytes": self.disk.size if self.disk is not None else 0,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+
+def _build_tier(subdir: str, suffix: str, memory: MemoryLRU, disk_bytes: int) -> TieredCache:
+    disk = None
+    if AVATAR_CACHE_DIR:
+        directory = os.path.join(AVATAR_CACHE_DIR, subdir)
+        try:
+            disk = DiskCache(directory, disk_bytes, suffix=suffix)
+        except OSError as e:
+            logger.error("Avatar disk cache unavailable at %s: %s", directory, e)
+    return TieredCache(memory, disk)
+
+
+# Generated images, addressed by a hash of their bytes
+avatar_store = _build_tier(
+    "images", ".png", MemoryLRU(AVATAR_CACHE_MEMORY_BYTES, AVATAR_CACHE_MEMORY_ITEMS), AVATAR_CACHE_DISK_BYTES
+)
+# Generation request fingerprint -> avatar id
+avatar_cache = _build_tier(
+    "requests", ".ref", MemoryLRU(AVATAR_CACHE_REF_ITEMS * 128, AVATAR_CACHE_REF_ITEMS), AVATAR_CACHE_REF_DISK_BYTES
+)
+
+
+def is_avatar_id(avatar_id: str) -> bool:
+    """Check that a string has the shape of an avatar id before it touches the filesystem."""
+    return len(avatar_id) == AVATAR_ID_LENGTH and all(c in "0123456789abcdef" for c in avatar_id)
+
+
+def avatar_url(avatar_id: str) -> str:
+    """Return the public URL an avatar is served from."""
+    return f"/avatars/{avatar_id}.png"
+
+
+async def store_avatar(image_data: bytes) -> str:
+    """
+    Store a generated image once, keyed by its content.
+
+    Args:
+        image_data: The PNG bytes returned by the image model
+
+    Returns:
+        The avatar id, which doubles as a strong ETag
+    """
+    avatar_id = hashlib.sha256(image_data).hexdigest()[:AVATAR_ID_LENGTH]
+    if avatar_store.memory.get(avatar_id) is None:
+        await avatar_store.set(avatar_id, image_data)
+    return avatar_id
+
+
+async def load_avatar(avatar_id: str) -> Optional[bytes]:
+    """Fetch a stored avatar's bytes, or None if it was never stored or has been evicted."""
+    if not is_avatar_id(avatar_id):
+        return None
+    return await avatar_store.get(avatar_id)
+
+
+async def get_cached_avatar_id(key: str) -> Optional[str]:
+    """Resolve a generation request fingerprint to a still-stored avatar id."""
+    ref = await avatar_cache.get(key)
+    if ref is None:
+        return None
+    avatar_id = ref.decode("ascii")
+    if not await avatar_store.contains(avatar_id):
+        return None
+    return avatar_id
+
+
+async def cache_avatar_id(key: str, avatar_id: str) -> None:
+    """Remember which avatar a generation request produced."""
+    await avatar_cache.set(key, avatar_id.encode("ascii"))
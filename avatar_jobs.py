@@ -0,0 +1,220 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from logging_config import get_logger
+from avatar_cache import avatar_url
+from tracing import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Jobs run at once per worker process; each still waits for an upstream image slot
+AVATAR_JOB_WORKERS = int(os.getenv("AVATAR_JOB_WORKERS", "4"))
+# Jobs waiting for a runner before new ones are turned away
+AVATAR_JOB_QUEUE_SIZE = int(os.getenv("AVATAR_JOB_QUEUE_SIZE", "256"))
+# Seconds a finished job's result stays available for polling, and how many are kept
+AVATAR_JOB_TTL = float(os.getenv("AVATAR_JOB_TTL", "3600"))
+AVATAR_JOB_MAX_TRACKED = int(os.getenv("AVATAR_JOB_MAX_TRACKED", "10000"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Raised when the avatar job queue has no room for another job."""
+
+
+class AvatarJob:
+    """
+    One avatar generation, from being queued until its image is in the avatar store.
+
+    Args:
+        key: Generation request fingerprint (avatar_cache.cache_key); jobs are deduplicated on it
+        mid: The image model id
+        prompt: The prompt text
+        run: Coroutine function that generates the image and returns its avatar id
+    """
+
+    __slots__ = ("id", "key", "mid", "prompt", "run", "status", "avatar_id", "error", "created", "started", "finished", "_done")
+
+    def __init__(self, key: str, mid: str, prompt: str, run: Optional[Callable[[], Awaitable[str]]]):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.mid = mid
+        self.prompt = prompt
+        self.run = run
+        self.status = QUEUED
+        self.avatar_id: Optional[str] = None
+        self.error: Optional[str] = None
+        self.created = time.monotonic()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._done = asyncio.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def succeed(self, avatar_id: str) -> None:
+        self.status = DONE
+        self.avatar_id = avatar_id
+        self._finish()
+
+    def fail(self, error: str) -> None:
+        self.status = FAILED
+        self.error = error
+        self._finish()
+
+    def _finish(self) -> None:
+        self.finished = time.monotonic()
+        self.run = None
+        self._done.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait up to ``timeout`` seconds for the job to finish; returns whether it has."""
+        if not self.done and timeout > 0:
+            try:
+                await asyncio.wait_for(self._done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.done
+
+    def to_dict(self) -> Dict[str, Any]:
+        started = self.started or self.finished
+        return {
+            "id": self.id,
+            "status": self.status,
+            "avatar_url": avatar_url(self.avatar_id) if self.avatar_id else None,
+            "error": self.error,
+            "queued_seconds": round((started or time.monotonic()) - self.created, 3),
+            "run_seconds": round((self.finished or time.monotonic()) - started, 3) if started else None,
+        }
+
+
+class AvatarJobQueue:
+    """
+    Run avatar generations in the background on a fixed pool of runners.
+
+    Submitting returns at once with a job the browser can poll or follow over
+    server-sent events. While a job for a request fingerprint is queued or
+    running, submitting the same fingerprint returns that job instead of a new
+    one. Jobs live in the memory of the worker process that accepted them.
+    """
+
+    def __init__(
+        self,
+        workers: int = AVATAR_JOB_WORKERS,
+        queue_size: int = AVATAR_JOB_QUEUE_SIZE,
+        ttl: float = AVATAR_JOB_TTL,
+        max_tracked: int = AVATAR_JOB_MAX_TRACKED,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.ttl = ttl
+        self.max_tracked = max_tracked
+        self.submitted = 0
+        self.deduplicated = 0
+        self.failed = 0
+        self._jobs: "OrderedDict[str, AvatarJob]" = OrderedDict()
+        self._active: Dict[str, AvatarJob] = {}
+        self._queue: Optional["asyncio.Queue[AvatarJob]"] = None
+        self._runners: List["asyncio.Task[None]"] = []
+
+    def start(self) -> None:
+        """Start the runners; called once the event loop is running."""
+        self._queue = asyncio.Queue(self.queue_size)
+        self._runners = [asyncio.create_task(self._runner()) for _ in range(self.workers)]
+
+    async def close(self) -> None:
+        for runner in self._runners:
+            runner.cancel()
+        await asyncio.gather(*self._runners, return_exceptions=True)
+        self._runners = []
+
+    def submit(self, key: str, mid: str, prompt: str, run: Callable[[], Awaitable[str]]) -> AvatarJob:
+        """
+        Queue a generation, or return the unfinished job already generating the same request.
+
+        Raises:
+            JobQueueFull: If the queue is full
+        """
+        self._prune()
+        job = self._active.get(key)
+        if job is not None:
+            self.deduplicated += 1
+            logger.debug("Joined avatar job %s for %s", job.id, key[:12])
+            return job
+        if self._queue is None:
+            raise RuntimeError("Avatar job queue is not started")
+        job = AvatarJob(key, mid, prompt, run)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Avatar job queue is full ({self.queue_size} waiting)")
+        self.submitted += 1
+        self._jobs[job.id] = job
+        self._active[key] = job
+        logger.info("Queued avatar job %s (%s waiting)", job.id, self._queue.qsize())
+        return job
+
+    def get(self, job_id: str) -> Optional[AvatarJob]:
+        return self._jobs.get(job_id)
+
+    async def _runner(self) -> None:
+        assert self._queue is not None
+        while True:
+            job = await self._queue.get()
+            job.status = RUNNING
+            job.started = time.monotonic()
+            try:
+                # Runners serve no request, so each job starts its own trace
+                with span("avatar.job", **{"avatar.job_id": job.id, "upstream.model": job.mid}):
+                    avatar_id = await job.run()
+                job.succeed(avatar_id)
+                logger.info("Avatar job %s done in %.2fs", job.id, job.finished - job.created)
+            except HTTPException as e:
+                self.failed += 1
+                logger.warning("Avatar job %s failed: %s", job.id, e.detail)
+                job.fail(str(e.detail))
+            except Exception as e:
+                self.failed += 1
+                logger.error("Avatar job %s failed: %s", job.id, e)
+                job.fail("Failed to generate avatar")
+            finally:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+                self._queue.task_done()
+
+    def _prune(self) -> None:
+        # Jobs are kept in submission order, so expired ones are at the front
+        cutoff = time.monotonic() - self.ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if not job.done or (job.created > cutoff and len(self._jobs) <= self.max_tracked):
+                break
+            self._jobs.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": sum(1 for job in self._active.values() if job.status == RUNNING),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "tracked": len(self._jobs),
+        }
+
+
+avatar_jobs = AvatarJobQueue()
@@ -0,0 +1,120 @@
+# Pre-render avatars through a running app's batch endpoint.
+#
+# Sends every prompt x model x seed combination to /admin/avatars/batch, prints
+# progress as items finish and writes one JSON line per item, with its avatar URL
+# or error and how long it took. Cached items cost nothing, so an interrupted
+# batch can simply be run again:
+#
+#     python batch_avatars.py prompts.txt --seeds 1 2 3 --output gallery.jsonl
+#     python batch_avatars.py prompts.txt --preview --param guidance=2   # warm the avatar page's previews
+#     cat prompts.txt | python batch_avatars.py - --model "Dreamshaper-8 LCM" --url https://lab.example.com
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+
+def read_prompts(path: str) -> List[str]:
+    """One prompt per line; blank lines and lines starting with # are skipped."""
+    f = sys.stdin if path == "-" else open(path)
+    try:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def run(url: str, token: str, batch: Dict[str, Any], output: Optional[str]) -> Dict[str, Any]:
+    """
+    Stream a batch through the app, reporting each item on stderr as it finishes.
+
+    Returns:
+        The summary line sent after the last item
+
+    Raises:
+        SystemExit: If the app rejects the batch
+    """
+    summary: Dict[str, Any] = {}
+    out = open(output, "w") if output else None
+    try:
+        with httpx.stream(
+            "POST", f"{url.rstrip('/')}/admin/avatars/batch", json=batch,
+            headers={"Authorization": f"Bearer {token}"}, timeout=httpx.Timeout(30, read=None),
+        ) as response:
+            if response.status_code != 200:
+                response.read()
+                raise SystemExit(f"Batch rejected with {response.status_code}: {response.text}")
+            finished = 0
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                if "summary" in result:
+                    summary = result["summary"]
+                    continue
+                finished += 1
+                if out is not None:
+                    out.write(line + "\n")
+                seed = "" if result["seed"] is None else f", seed {result['seed']}"
+                detail = result.get("avatar_url") or result.get("error")
+                print(
+                    f"[{finished}] {result['status']:<9} {result['seconds']:>7.2f}s  "
+                    f"{result['prompt'][:60]} ({result['model']}{seed}) {detail}",
+                    file=sys.stderr,
+                )
+    finally:
+        if out is not None:
+            out.close()
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Pre-render avatars for a list of prompts")
+    parser.add_argument("prompts", help="File with one prompt per line, or - for stdin")
+    parser.add_argument("--model", action="append", default=[], help="Image model, repeatable; default every image model")
+    parser.add_argument("--seeds", type=int, nargs="*", default=[], help="Seeds to render each prompt with")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE", help="Generation parameter, e.g. num_steps=8; repeatable")
+    parser.add_argument("--preview", action="store_true", help="Render fast previews, as the avatar page first shows them")
+    parser.add_argument("--regenerate", action="store_true", help="Render again even if cached")
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the running app")
+    parser.add_argument("--token", default=os.getenv("ADMIN_TOKEN", ""), help="Admin token; defaults to ADMIN_TOKEN")
+    parser.add_argument("--output", help="Write one JSON line per item here")
+    args = parser.parse_args()
+
+    prompts = read_prompts(args.prompts)
+    if not prompts:
+        parser.error("no prompts given")
+    if not args.token:
+        parser.error("an admin token is required (--token or ADMIN_TOKEN)")
+    params = {}
+    for param in args.param:
+        name, sep, value = param.partition("=")
+        if not sep:
+            parser.error(f"--param {param} is not NAME=VALUE")
+        params[name.strip()] = value.strip()
+    batch = {
+        "prompts": prompts,
+        "models": args.model,
+        "seeds": args.seeds or [None],
+        "params": params,
+        "preview": args.preview,
+        "regenerate": args.regenerate,
+    }
+
+    summary = run(args.url, args.token, batch, args.output)
+    if not summary:
+        print("The batch ended before its summary; run it again to finish the remaining items", file=sys.stderr)
+        return 1
+    print(
+        f"{summary['items']} items in {summary['seconds']}s: {summary['generated']} generated, "
+        f"{summary['cached']} cached, {summary['failed']} failed; "
+        f"generation p50 {summary['p50_seconds']}s, p95 {summary['p95_seconds']}s"
+    )
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
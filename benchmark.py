@@ -0,0 +1,339 @@
+# End-to-end benchmark of the chat and avatar flows.
+#
+# Starts mock_upstream and the real app as separate uvicorn processes, drives the
+# app with simulated visitors at a fixed concurrency, and reports throughput,
+# latency percentiles, response sizes, event-loop lag and RSS growth per scenario:
+#
+#     python benchmark.py --concurrency 20 --duration 30
+#     python benchmark.py --baseline benchmarks/baseline.json   # exit 1 on regression
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BRAIN_MODEL = "Mistral-7b Instruct"
+IMAGE_MODEL = "Dreamshaper-8 LCM"
+# Few enough avatar prompts that the avatar cache sees repeats, as in production
+AVATAR_PROMPTS = ["A Mad Scientist", "A Mad Scientist in a lab coat", "A robot chemist", "A cat with goggles"]
+CHAT_PROMPTS = [
+    "Why is the sky blue?",
+    "What is quantum entanglement?",
+    "How do black holes form?",
+    "Is light a wave or a particle?",
+    "What does entropy measure?",
+]
+# Fixed upstream behaviour, so runs are comparable
+MOCK_ENV = {
+    "MOCK_LATENCY_DISTRIBUTION": "fixed",
+    "MOCK_LATENCY_MS": "150",
+    "MOCK_IMAGE_LATENCY_MS": "600",
+    "MOCK_TOKEN_DELAY_MS": "5",
+    "MOCK_SEED": "7",
+}
+
+# A relative increase above this in p95 latency, or decrease in throughput, is a regression
+DEFAULT_TOLERANCE = 0.25
+# p95 changes smaller than this are scheduling noise, whatever the ratio
+DEFAULT_MIN_DELTA_MS = 50.0
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    # Linux only; other platforms report no memory figures
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Recorder:
+    """Latencies, sizes and failures per scenario."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.sizes: Dict[str, List[int]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, scenario: str, seconds: float, size: int, ok: bool) -> None:
+        self.samples.setdefault(scenario, []).append(seconds)
+        self.sizes.setdefault(scenario, []).append(size)
+        if not ok:
+            self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        scenarios = {}
+        for scenario, samples in sorted(self.samples.items()):
+            sizes = self.sizes[scenario]
+            scenarios[scenario] = {
+                "requests": len(samples),
+                "errors": self.errors.get(scenario, 0),
+                "throughput_rps": round(len(samples) / elapsed, 2),
+                "p50_ms": round(_percentile(samples, 0.50) * 1000, 1),
+                "p95_ms": round(_percentile(samples, 0.95) * 1000, 1),
+                "p99_ms": round(_percentile(samples, 0.99) * 1000, 1),
+                "mean_bytes": round(sum(sizes) / len(sizes)),
+            }
+        return scenarios
+
+
+async def _timed(recorder: Recorder, scenario: str, request) -> Optional[httpx.Response]:
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError:
+        recorder.record(scenario, time.perf_counter() - started, 0, ok=False)
+        return None
+    recorder.record(scenario, time.perf_counter() - started, len(response.content), ok=response.status_code < 400)
+    return response
+
+
+async def _generate_avatar(client: httpx.AsyncClient, prompt: str) -> httpx.Response:
+    # The page returns at once for uncached prompts; the avatar is ready when its job finishes
+    page = await client.get(
+        "/generate-avatar/",
+        params={"brain_model": BRAIN_MODEL, "image_model": IMAGE_MODEL, "prompt": prompt},
+    )
+    match = re.search(r'avatarJobId = "([0-9a-f]+)"', page.text)
+    while match is not None:
+        status = await client.get(f"/avatar-jobs/{match.group(1)}", params={"wait": 30})
+        job = status.json()
+        if job["status"] == "failed":
+            raise httpx.HTTPError(f"Avatar job failed: {job['error']}")
+        if job["status"] == "done":
+            break
+    return page
+
+
+async def visitor(base_url: str, recorder: Recorder, deadline: float, number: int) -> None:
+    """
+    Walk one simulated visitor through the site until the deadline.
+
+    Each round is a fresh session: landing page, avatar, intro chat, two chat
+    messages, the demo page and its static assets.
+    """
+    round_number = 0
+    while time.monotonic() < deadline:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            prompt = AVATAR_PROMPTS[(number + round_number) % len(AVATAR_PROMPTS)]
+            await _timed(recorder, "root", client.get("/"))
+            await _timed(recorder, "generate_avatar", _generate_avatar(client, prompt))
+            await _timed(recorder, "chat_intro", client.get(
+                "/mad-scientist/", params={"brain_model": BRAIN_MODEL, "image_model": IMAGE_MODEL},
+            ))
+            for i in range(2):
+                message = CHAT_PROMPTS[(number + round_number + i) % len(CHAT_PROMPTS)]
+                await _timed(recorder, "chat_post", client.post(
+                    "/mad-scientist/", data={"prompt": message, "brain_model": BRAIN_MODEL}, follow_redirects=True,
+                ))
+            demo = await _timed(recorder, "demo", client.get("/demo"))
+            if demo is not None:
+                for path in sorted(set(re.findall(r'(/static/[^"\')\s]+)', demo.text))):
+                    await _timed(recorder, "static", client.get(path, headers={"Accept-Encoding": "br, gzip"}))
+        round_number += 1
+
+
+async def probe_loop_lag(base_url: str, deadline: float, interval: float = 0.05) -> List[float]:
+    """
+    Time a trivial request at a steady rate while the load runs.
+
+    /health does no I/O, so its latency above the idle baseline is time spent
+    waiting for the app's event loop.
+    """
+    lags = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=30) as client:
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                await client.get("/health")
+                lags.append(time.perf_counter() - started)
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(interval)
+    return lags
+
+
+async def _wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+def _start(module: str, port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", f"{module}:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL,
+    )
+
+
+async def run_benchmark(concurrency: int, duration: float, warmup: float) -> Dict[str, Any]:
+    mock_port, app_port = _free_port(), _free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+    with tempfile.TemporaryDirectory() as scratch:
+        app_env = {
+            "API_BASE_URL": f"http://127.0.0.1:{mock_port}/run/",
+            "SECRET_KEY": os.getenv("SECRET_KEY", "benchmark-secret"),
+            "AUTH_TOKEN": "benchmark",
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+            # Start from cold caches every run
+            "AVATAR_CACHE_DIR": os.path.join(scratch, "avatars"),
+            "SESSION_DB_PATH": os.path.join(scratch, "sessions.db"),
+        }
+        mock = _start("mock_upstream", mock_port, MOCK_ENV)
+        app = _start("main", app_port, app_env)
+        try:
+            await _wait_ready(f"http://127.0.0.1:{mock_port}/mock/config")
+            await _wait_ready(f"{base_url}/health")
+
+            if warmup > 0:
+                await asyncio.gather(*(visitor(base_url, Recorder(), time.monotonic() + warmup, n) for n in range(concurrency)))
+            idle_lag = await probe_loop_lag(base_url, time.monotonic() + 1)
+            rss_start = _rss_bytes(app.pid)
+
+            recorder = Recorder()
+            started = time.monotonic()
+            deadline = started + duration
+            results = await asyncio.gather(
+                probe_loop_lag(base_url, deadline),
+                *(visitor(base_url, recorder, deadline, n) for n in range(concurrency)),
+            )
+            elapsed = time.monotonic() - started
+            rss_end = _rss_bytes(app.pid)
+        finally:
+            for process in (app, mock):
+                process.terminate()
+                process.wait(timeout=10)
+
+    lags = results[0]
+    idle = _percentile(idle_lag, 0.50)
+    scenarios = recorder.summary(elapsed)
+    total = sum(s["requests"] for s in scenarios.values())
+    return {
+        "config": {"concurrency": concurrency, "duration_s": duration, "warmup_s": warmup, "mock": MOCK_ENV},
+        "environment": {"python": platform.python_version(), "platform": platform.platform()},
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(s["errors"] for s in scenarios.values()),
+        "throughput_rps": round(total / elapsed, 2),
+        "loop_lag_ms": {
+            "p50": round(max(_percentile(lags, 0.50) - idle, 0) * 1000, 1),
+            "p99": round(max(_percentile(lags, 0.99) - idle, 0) * 1000, 1),
+            "max": round(max(max(lags, default=0) - idle, 0) * 1000, 1),
+        },
+        "rss_bytes": {
+            "start": rss_start,
+            "end": rss_end,
+            "growth": rss_end - rss_start if rss_start is not None and rss_end is not None else None,
+        },
+        "scenarios": scenarios,
+    }
+
+
+def compare(
+    result: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE,
+    min_delta_ms: float = DEFAULT_MIN_DELTA_MS,
+) -> List[str]:
+    """
+    List the regressions of a run against a baseline run.
+
+    A scenario regresses if its p95 latency grew, or its throughput fell, by more
+    than ``tolerance`` (a fraction), or if it had errors the baseline did not.
+    Latency growth under ``min_delta_ms`` is ignored.
+    """
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        current = result["scenarios"].get(name)
+        if current is None:
+            regressions.append(f"{name}: missing from this run")
+            continue
+        slower = current["p95_ms"] - base["p95_ms"]
+        if slower > min_delta_ms and current["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {current['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {current['throughput_rps']} req/s vs baseline {base['throughput_rps']} req/s")
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{name}: {current['errors']} errors vs baseline {base['errors']}")
+    return regressions
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{'scenario':<16}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'bytes':>10}")
+    for name, s in result["scenarios"].items():
+        print(
+            f"{name:<16}{s['requests']:>7}{s['errors']:>5}{s['throughput_rps']:>9}"
+            f"{s['p50_ms']:>9}{s['p95_ms']:>9}{s['p99_ms']:>9}{s['mean_bytes']:>10}"
+        )
+    lag, rss = result["loop_lag_ms"], result["rss_bytes"]
+    print(f"total {result['requests']} requests, {result['throughput_rps']} req/s, {result['errors']} errors")
+    print(f"event-loop lag p50 {lag['p50']}ms, p99 {lag['p99']}ms, max {lag['max']}ms")
+    if rss["growth"] is not None:
+        print(f"RSS {rss['start'] / 2 ** 20:.1f} MiB -> {rss['end'] / 2 ** 20:.1f} MiB")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Mad Scientist app against the mock upstream")
+    parser.add_argument("--concurrency", type=int, default=10, help="Simulated visitors")
+    parser.add_argument("--duration", type=float, default=20, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="Unmeasured seconds before the run")
+    parser.add_argument("--output", default="benchmarks/results/latest.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Baseline results to compare against; exits 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="Allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=DEFAULT_MIN_DELTA_MS, help="Ignored p95 growth in ms")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args.concurrency, args.duration, args.warmup))
+    print_report(result)
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Prompt token budget for the messages sent upstream, excluding the reply
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "true").lower() in ("1", "true", "yes")
+CONTEXT_SUMMARY_CHARS = int(os.getenv("CONTEXT_SUMMARY_CHARS", "120"))
+
+# Chat templates add a few tokens of framing around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def approx_tokens(text: str) -> int:
+    """
+    Estimate the token count of a text without loading a tokenizer.
+
+    Words count one token per four characters (BPE vocabularies split long words)
+    and every punctuation mark counts as one. This slightly overestimates for
+    English prose, which keeps the prompt safely inside the model's window.
+    """
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PATTERN.findall(text))
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return approx_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _user_text(user: Any) -> Optional[str]:
+    # The introduction turn records the whole intro message list as the user input
+    if isinstance(user, list):
+        contents = [m.get("content") for m in user if m.get("role") == "user"]
+        return contents[-1] if contents else None
+    return user
+
+
+def _turn_messages(turn: Dict[str, Any]) -> List[Dict[str, str]]:
+    messages = []
+    user = _user_text(turn.get("user"))
+    if user:
+        messages.append({"role": "user", "content": user})
+    if turn.get("ai"):
+        messages.append({"role": "assistant", "content": turn["ai"]})
+    return messages
+
+
+def is_standalone(messages: List[Dict[str, str]], base_messages: List[Dict[str, str]]) -> bool:
+    """
+    Whether a built context carries nothing the user said before the new message.
+
+    True when everything before the new message comes from ``base_messages``: the
+    system prompt, the fixed introduction prompt and the model's reply to it. The
+    reply then depends on the new message alone, whichever session sent it. A
+    summary of dropped turns counts as history.
+    """
+    previous = None
+    for message in messages[:-1]:
+        # The introduction reply answers a fixed prompt, so it is the same kind of text in every session
+        intro_reply = message["role"] == "assistant" and previous is not None and previous["role"] == "user"
+        if message not in base_messages and not intro_reply:
+            return False
+        previous = message
+    return True
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    sentence = _SENTENCE_END.split(text.strip(), maxsplit=1)[0]
+    if len(sentence) > limit:
+        sentence = sentence[:limit].rsplit(" ", 1)[0] + "..."
+    return sentence
+
+
+def summarize_turns(turns: List[Dict[str, Any]], limit: int = CONTEXT_SUMMARY_CHARS) -> str:
+    """
+    Compress older turns into a short extractive summary.
+
+    Keeps the first sentence of each question and answer, so the model still knows
+    which topics were covered without paying for the full text.
+    """
+    lines = []
+    for turn in turns:
+        user = _user_text(turn.get("user"))
+        if user:
+            lines.append(f"- User asked: {_first_sentence(user, limit)}")
+        if turn.get("ai"):
+            lines.append(f"  You answered: {_first_sentence(turn['ai'], limit)}")
+    return "Summary of earlier conversation:\n" + "\n".join(lines)
+
+
+def _truncate_to_tokens(text: str, budget: int) -> str:
+    # Work back from the character estimate, then trim until it fits
+    text = text[:budget * 4]
+    while text and approx_tokens(text) > budget:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+def build_context(
+    base_messages: List[Dict[str, str]],
+    turns: List[Dict[str, Any]],
+    message: str,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+    summarize: bool = CONTEXT_SUMMARIZE,
+) -> List[Dict[str, str]]:
+    """
+    Assemble the messages for a chat call under a token budget.
+
+    The system prompt from ``base_messages`` and the new user message are always
+    sent. The most recent turns are added newest first while they fit; older turns
+    are dropped, or folded into a summary if ``summarize`` is set and room remains.
+
+    Args:
+        base_messages: The fixed prompt, e.g. ``inputs``; only system messages are used
+        turns: The session's conversation turns, oldest first
+        message: The new user message
+        budget: Maximum approximate prompt tokens
+        summarize: Whether to summarize turns that do not fit
+
+    Returns:
+        The message list to send upstream
+    """
+    system = [m for m in base_messages if m["role"] == "system"]
+    current = {"role": "user", "content": message}
+    remaining = budget - sum(message_tokens(m) for m in system) - message_tokens(current)
+    if remaining < 0:
+        # An oversized message still goes out, cut down to what the budget allows
+        current["content"] = _truncate_to_tokens(message, max(budget - sum(message_tokens(m) for m in system), 1))
+        return system + [current]
+
+    history: List[Dict[str, str]] = []
+    kept = 0
+    for turn in reversed(turns):
+        turn_messages = _turn_messages(turn)
+        cost = sum(message_tokens(m) for m in turn_messages)
+        if cost > remaining:
+            break
+        history[:0] = turn_messages
+        remaining -= cost
+        kept += 1
+
+    dropped = turns[:len(turns) - kept]
+    if dropped and summarize and remaining > MESSAGE_OVERHEAD_TOKENS * 4:
+        summary = _truncate_to_tokens(summarize_turns(dropped), remaining - MESSAGE_OVERHEAD_TOKENS)
+        system = system + [{"role": "system", "content": summary}]
+        remaining -= approx_tokens(summary) + MESSAGE_OVERHEAD_TOKENS
+
+    logger.debug("Built context with %s of %s turns, %s of %s tokens", kept, len(turns), budget - remaining, budget)
+    return system + history + [current]
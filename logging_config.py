@@ -1,95 +1,229 @@
+import atexit
+import copy
+import json
 import logging
 import logging.config
+import logging.handlers
 import os
-from typing import Dict, Any
+import queue
+import sys
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
 
-def setup_logging(log_level: str = "INFO") -> None:
+# Root of every application logger name; metrics use the same prefix
+LOGGER_NAMESPACE = "mad_scientist"
+
+# Attributes every LogRecord has; anything else arrived through ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# Id of the request being served, set by tracing.TracingMiddleware; "-" outside requests
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Records travel from the logging call to the handlers through this queue
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format each record as one JSON object per line.
+
+    Fields passed with ``extra=`` become top-level keys, and tracebacks are kept
+    as a single escaped string, so every line parses whatever the message contains.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request id, while still on the thread that logged it."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DebugSampler(logging.Filter):
+    """
+    Let through at most ``limit`` DEBUG records per second from each call site.
+
+    Occasional debug lines all pass; one inside a hot path is thinned out. The
+    next record from a throttled site carries ``suppressed``, the number dropped.
+    Records above DEBUG are never sampled.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        # (pathname, lineno) -> [second, passed in that second, suppressed since last pass]
+        self._sites: Dict[Tuple[str, int], List[int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.limit <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        second = int(record.created)
+        with self._lock:
+            window = self._sites.get(site)
+            if window is None:
+                window = self._sites[site] = [second, 0, 0]
+            elif window[0] != second:
+                window[0], window[1] = second, 0
+            if window[1] >= self.limit:
+                window[2] += 1
+                return False
+            window[1] += 1
+            if window[2]:
+                record.suppressed = window[2]
+                window[2] = 0
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, while they still hold the values being logged, but
+        # leave exc_info in place so the listener's formatters render the traceback
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def _queue_handler(debug_rate_limit: int) -> logging.Handler:
+    handler = _QueueHandler(_log_queue)
+    handler.addFilter(DebugSampler(debug_rate_limit))
+    handler.addFilter(RequestIdFilter())
+    return handler
+
+
+def _stop_listener() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logging(log_level: str = "INFO", log_format: Optional[str] = None, debug_rate_limit: Optional[int] = None) -> None:
     """
     Configure logging for the Mad Scientist application.
-    
+
+    Loggers only put records on an in-memory queue; a background listener thread
+    formats them and does the console and file I/O, so logging never blocks the
+    event loop on a write.
+
     Args:
         log_level: The minimum log level to capture (DEBUG, INFO, WARNING, ERROR, CRITICAL)
+        log_format: "text" or "json"; defaults to LOG_FORMAT
+        debug_rate_limit: DEBUG records allowed per second from each call site, 0 for
+            all; defaults to LOG_DEBUG_RATE_LIMIT
     """
-    
+    global _listener
+    if log_format is None:
+        log_format = os.getenv("LOG_FORMAT", "text")
+    if debug_rate_limit is None:
+        debug_rate_limit = int(os.getenv("LOG_DEBUG_RATE_LIMIT", "50"))
+
     # Create logs directory if it doesn't exist
     log_dir = "logs"
     if not os.path.exists(log_dir):
         os.makedirs(log_dir)
-    
+
+    if log_format == "json":
+        console_formatter = file_formatter = JsonFormatter(datefmt='%Y-%m-%dT%H:%M:%S%z')
+    else:
+        console_formatter = logging.Formatter('%(asctime)s [%(levelname)s] [%(request_id)s] %(name)s: %(message)s', '%Y-%m-%d %H:%M:%S')
+        file_formatter = logging.Formatter(
+            '%(asctime)s [%(levelname)s] [%(request_id)s] %(name)s:%(lineno)d - %(funcName)s(): %(message)s', '%Y-%m-%d %H:%M:%S'
+        )
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setLevel(logging.INFO)
+    console.setFormatter(console_formatter)
+    log_file = logging.handlers.RotatingFileHandler(
+        f'{log_dir}/mad_scientist.log',
+        maxBytes=10485760,  # 10MB
+        backupCount=5,
+    )
+    log_file.setLevel(logging.DEBUG)
+    log_file.setFormatter(file_formatter)
+    error_file = logging.handlers.RotatingFileHandler(
+        f'{log_dir}/mad_scientist_errors.log',
+        maxBytes=10485760,  # 10MB
+        backupCount=3,
+    )
+    error_file.setLevel(logging.ERROR)
+    error_file.setFormatter(file_formatter)
+    # Only application errors go to the error log, as before the queue was added
+    error_file.addFilter(logging.Filter(LOGGER_NAMESPACE))
+
     logging_config: Dict[str, Any] = {
         'version': 1,
         'disable_existing_loggers': False,
-        'formatters': {
-            'standard': {
-                'format': '%(asctime)s [%(levelname)s] %(name)s: %(message)s',
-                'datefmt': '%Y-%m-%d %H:%M:%S'
-            },
-            'detailed': {
-                'format': '%(asctime)s [%(levelname)s] %(name)s:%(lineno)d - %(funcName)s(): %(message)s',
-                'datefmt': '%Y-%m-%d %H:%M:%S'
-            },
-            'json': {
-                'format': '{"timestamp": "%(asctime)s", "level": "%(levelname)s", "logger": "%(name)s", "message": "%(message)s"}',
-                'datefmt': '%Y-%m-%d %H:%M:%S'
-            }
-        },
         'handlers': {
-            'console': {
-                'class': 'logging.StreamHandler',
-                'level': 'INFO',
-                'formatter': 'standard',
-                'stream': 'ext://sys.stdout'
-            },
-            'file': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'level': 'DEBUG',
-                'formatter': 'detailed',
-                'filename': f'{log_dir}/mad_scientist.log',
-                'maxBytes': 10485760,  # 10MB
-                'backupCount': 5
-            },
-            'error_file': {
-                'class': 'logging.handlers.RotatingFileHandler',
-                'level': 'ERROR',
-                'formatter': 'detailed',
-                'filename': f'{log_dir}/mad_scientist_errors.log',
-                'maxBytes': 10485760,  # 10MB
-                'backupCount': 3
+            'queue': {
+                '()': _queue_handler,
+                'debug_rate_limit': debug_rate_limit,
             }
         },
         'loggers': {
-            'mad_scientist': {
+            LOGGER_NAMESPACE: {
                 'level': log_level,
-                'handlers': ['console', 'file', 'error_file'],
+                'handlers': ['queue'],
                 'propagate': False
             },
             'uvicorn': {
                 'level': 'INFO',
-                'handlers': ['console', 'file'],
+                'handlers': ['queue'],
                 'propagate': False
             },
             'fastapi': {
-                'level': 'INFO', 
-                'handlers': ['console', 'file'],
+                'level': 'INFO',
+                'handlers': ['queue'],
                 'propagate': False
             }
         },
         'root': {
             'level': log_level,
-            'handlers': ['console', 'file']
+            'handlers': ['queue']
         }
     }
-    
+
+    _stop_listener()
     logging.config.dictConfig(logging_config)
+    _listener = logging.handlers.QueueListener(_log_queue, console, log_file, error_file, respect_handler_level=True)
+    _listener.start()
+
+
+# Flush queued records before the interpreter exits
+atexit.register(_stop_listener)
+
 
 def get_logger(name: str) -> logging.Logger:
     """
     Get a logger instance for a specific module.
-    
+
     Args:
         name: The name of the logger (typically __name__)
-    
+
     Returns:
         A configured logger instance
     """
-    return logging.getLogger(f"mad_scientist.{name}")
+    return logging.getLogger(f"{LOGGER_NAMESPACE}.{name}")
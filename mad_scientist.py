@@ -1,14 +1,28 @@
 from fastapi import HTTPException, Request, Query
 from starlette.responses import RedirectResponse
 from pydantic import BaseModel
-import base64
+import hashlib
 import os 
+import secrets
+import uuid
 from dotenv import load_dotenv
 # from settings import ACCOUNT_ID, AUTH_TOKEN, API_BASE_URL, SECRET_KEY
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, Union
 # from mad_sci_mistral_instruct import tokenizer
-import requests
+import httpx
 from logging_config import get_logger
+from upstream import run_model, stream_model
+from session_store import session_store
+from context_builder import build_context, is_standalone
+from avatar_cache import avatar_url, cache_avatar_id, cache_key, get_cached_avatar_id, store_avatar
+from avatar_jobs import AvatarJob, JobQueueFull, avatar_jobs
+from model_registry import AI, models, registry
+from response_cache import response_cache, response_key
+from semantic_cache import semantic_cache
+from singleflight import avatar_flight, chat_flight
+from scheduler import PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_IMAGE, SchedulerFull, upstream_scheduler
+from resilience import CircuitOpen, resilience
+from tracing import annotate, span, traced
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,50 +36,11 @@ ACCOUNT_ID = os.getenv("ACCOUNT_ID")
 AUTH_TOKEN = os.getenv("AUTH_TOKEN")
 GTAG = os.getenv("GTAG")
 
-headers = {"Authorization": f"Bearer {AUTH_TOKEN}"}
-
-# Data for AI models
-models = [
-     {
-        "model": "Mad Sci Mistral-7B Instruct",
-        "description": "Mad Sci is a fine-tuned version of the Mistral-7b Instruct generative text model with 7 billion parameters",
-        "mid": "SavantofIllusions/mad_sci_mistral_instruct",
-        "name": "mad_sci_mistral_instruct",
-        "usage": "text"
-    },
-    {
-        "model": "Mistral-7b Instruct",
-        "description": "Instruct fine-tuned version of the Mistral-7b generative text model with 7 billion parameters",
-        "mid": "@cf/mistral/mistral-7b-instruct-v0.1",
-        "name": "mistral_7b_instruct",
-        "usage": "mad-sci-text"
-    },
-    {
-        "model": "Hermes 2 Pro on Mistral 7B",
-        "description": "Hermes 2 Pro on Mistral 7B is the new flagship 7B Hermes! Hermes 2 Pro is an upgraded, retrained version of Nous Hermes 2, consisting of an updated and cleaned version of the OpenHermes 2.5 Dataset, as well as a newly introduced Function Calling and JSON Mode dataset developed in-house",
-        "mid": "@hf/nousresearch/hermes-2-pro-mistral-7b",
-        "name": "hermes_2_pro_on_mistral_7b",
-        "usage": "text"
-    },
-    {
-        "model": "Dreamshaper-8 LCM",
-        "description": "Stable Diffusion model that has been fine-tuned to be better at photorealism without sacrificing range",
-        "mid": "@cf/lykon/dreamshaper-8-lcm",
-        "name": "dreamshaper_8_lcm",
-        "usage": "art"
-    }
-]
-
-
-
-brain_options = ""
-art_options = ""
-for model in models:
-    option = f"<option value='{model['model']}'>{model['model']}</option>"
-    if model['usage'] == 'mad-sci-text':
-        brain_options += option
-    elif model['usage'] == 'art':
-        art_options += option
+# Per-call upstream timeouts in seconds
+CHAT_TIMEOUT = float(os.getenv("CHAT_TIMEOUT", "60"))
+IMAGE_TIMEOUT = float(os.getenv("IMAGE_TIMEOUT", "120"))
+# The avatar page first renders a fast preview; full quality is rendered once the avatar is saved
+AVATAR_PREVIEW = os.getenv("AVATAR_PREVIEW", "true").lower() in ("1", "true", "yes")
 
 inputs = [
     { "role": "system", "content": """You are a scientist who is very meticulous about word and phrase ambiguation.
@@ -77,156 +52,397 @@ inputs = [
     { "role": "user", "content": """You are the Mad Scientist AI, my new assistant. Introduce us as such."""}
 ]
 
-class AI(BaseModel):
-    model: str
-    description: str
-    mid: str
-    name: str
-    usage: str
-
 class Token(BaseModel):
     access_token: str
     token_type: str
 
-async def get_avatar_data_url(request: Request, img_model: str, prompt_text: str):
-    logger.info(f"Generating avatar image with model: {img_model}, prompt: '{prompt_text}'")
+def upstream_busy(e: SchedulerFull) -> HTTPException:
+    """Turn a scheduler rejection into the 429 sent to the browser."""
+    logger.warning("Upstream call rejected: %s", e)
+    return HTTPException(status_code=429, detail="The lab is busy, please try again shortly", headers={"Retry-After": "5"})
+
+def upstream_unavailable(e: CircuitOpen) -> HTTPException:
+    """Turn an open circuit into a fast 503, so pages can fall back to demo content."""
+    logger.warning("Upstream call failed fast: %s", e)
+    return HTTPException(status_code=503, detail="The lab is temporarily unavailable", headers={"Retry-After": str(int(e.retry_after) + 1)})
+
+def _avatar_request(
+    img_model: str, prompt_text: str, params: Optional[Dict[str, Any]] = None, preview: bool = False, fresh_seed: bool = False
+) -> Tuple[str, Dict[str, Any], str]:
+    """
+    Resolve the image model and build the upstream payload and its cache key.
+
+    Previews always carry a seed, so the full-quality refinement can reuse it. Without
+    one requested it is derived from the prompt, so repeat prompts still hit the cache,
+    or is random with ``fresh_seed``.
+
+    Raises:
+        HTTPException: If the model is unknown (404) or a parameter is invalid (422)
+    """
+    ai = registry.get_by_model(img_model.strip())
+    if ai is None:
+        raise HTTPException(status_code=404, detail=f"Model not found: {img_model}")
+    logger.debug("Resolved model ID: %s", ai.mid)
+
+    params = dict(params or {})
+    if preview and "seed" in ai.params and params.get("seed") in (None, ""):
+        seeds = int(ai.params["seed"].max) + 1
+        if fresh_seed:
+            params["seed"] = secrets.randbelow(seeds)
+        else:
+            params["seed"] = int.from_bytes(hashlib.sha256(prompt_text.encode("utf-8")).digest()[:8], "big") % seeds
+    try:
+        generation_params = ai.generation_params(params, preview)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    json_payload = {"prompt": prompt_text, **generation_params}
+    key = cache_key(ai.mid, prompt_text, generation_params)
+    return ai.mid, json_payload, key
+
+@traced("get_avatar_url")
+async def get_avatar_url(request: Request, img_model: str, prompt_text: str, bypass_cache: bool = False) -> str:
+    logger.info("Generating avatar image with model: %s, prompt: '%s'", img_model, prompt_text)
     try:
-        mad_sci = MadScientist(request)
-        model_name_response = await mad_sci.get_model_name_by_model(request, model=img_model)
-        model_name = model_name_response.strip()  # Remove leading/trailing whitespace
-        logger.debug(f"Resolved model name: {model_name}")
-        
-        mid_response = await mad_sci.get_mid_by_model_name(request, model=model_name)
-        mid = mid_response.strip()  # Remove leading/trailing whitespace
-        logger.debug(f"Resolved model ID: {mid}")
-        
-        # Prepare the JSON payload according to the input schema
-        json_payload = {
-            "prompt": prompt_text,
-                # Add other fields if necessary
-                # "num_steps": 20,
-                # "strength": 1,
-                # "guidance": 7.5,
-        }
-        
-        logger.debug(f"Making API call to: {API_BASE_URL}{mid}")
-        # Make the API call
-        response = requests.post(
-            f"{API_BASE_URL}{mid}",
-            headers=headers,
-            json=json_payload
-        )
-        
-        if response.status_code == 200:
-            # Assuming the response.content is the binary image data
-            image_data = response.content
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            data_url = f"data:image/png;base64,{image_base64}"
-            logger.info("Avatar image generated successfully")
-            return data_url
+        mid, json_payload, key = _avatar_request(img_model, prompt_text)
+
+        # Serve repeat prompts from the cache unless a fresh image was requested
+        avatar_id = None if bypass_cache else await get_cached_avatar_id(key)
+        annotate(**{"cache.hit": avatar_id is not None})
+        if avatar_id is not None:
+            logger.info("Avatar image served from cache")
         else:
-            logger.error(f"API call failed with status {response.status_code}: {response.text}")
-            raise HTTPException(status_code=response.status_code, detail="Failed to generate image")
+            # Concurrent requests for the same image share one upstream call
+            session = request.session.get("sid") if request is not None else None
+            avatar_id = await avatar_flight.do(key, lambda: _generate_avatar(mid, json_payload, key, session))
+
+        return avatar_url(avatar_id)
     except Exception as e:
-        logger.error(f"Error in get_avatar_data_url: {str(e)}")
+        logger.error("Error in get_avatar_url: %s", e)
         raise
 
+@traced("submit_avatar_job")
+async def submit_avatar_job(
+    request: Request,
+    img_model: str,
+    prompt_text: str,
+    params: Optional[Dict[str, Any]] = None,
+    preview: bool = False,
+    bypass_cache: bool = False,
+) -> Tuple[Union[str, AvatarJob], Dict[str, Any]]:
+    """
+    Start generating an avatar without waiting for the image.
+
+    Args:
+        request: The request asking for the avatar, used for fair sharing of upstream slots
+        img_model: The image model name
+        prompt_text: The prompt text
+        params: Requested generation parameters; the model's defaults fill the rest
+        preview: Render a fast, smaller preview instead of the full-quality image
+        bypass_cache: Generate a fresh image even if this prompt was rendered before
+
+    Returns:
+        The avatar URL when the image is already cached, otherwise the job generating
+        it, and the generation parameters sent to the model
+
+    Raises:
+        HTTPException: If the model is unknown (404), a parameter is invalid (422)
+            or the job queue is full (429)
+    """
+    logger.info("Queueing avatar image with model: %s, prompt: '%s', preview: %s", img_model, prompt_text, preview)
+    mid, json_payload, key = _avatar_request(img_model, prompt_text, params, preview, fresh_seed=bypass_cache)
+    generation_params = {k: v for k, v in json_payload.items() if k != "prompt"}
+    avatar_id = None if bypass_cache else await get_cached_avatar_id(key)
+    annotate(**{"cache.hit": avatar_id is not None, "avatar.preview": preview})
+    if avatar_id is not None:
+        logger.info("Avatar image served from cache")
+        return avatar_url(avatar_id), generation_params
+
+    session = request.session.get("sid") if request is not None else None
+
+    async def run() -> str:
+        # A blocking get_avatar_url call for the same image shares the upstream call
+        return await avatar_flight.do(key, lambda: _generate_avatar(mid, json_payload, key, session))
+
+    try:
+        return avatar_jobs.submit(key, mid, prompt_text, run), generation_params
+    except JobQueueFull as e:
+        logger.warning("Avatar job rejected: %s", e)
+        raise HTTPException(status_code=429, detail="The lab is busy, please try again shortly", headers={"Retry-After": "5"})
+
+@traced("render_avatar")
+async def render_avatar(
+    img_model: str, prompt_text: str, params: Optional[Dict[str, Any]] = None, preview: bool = False, bypass_cache: bool = False
+) -> Tuple[str, bool]:
+    """
+    Make sure an avatar for a prompt is in the avatar store, for batch pre-rendering.
+
+    Upstream calls wait behind interactive chat and avatar requests.
+
+    Args:
+        img_model: The image model name
+        prompt_text: The prompt text
+        params: Requested generation parameters, e.g. a fixed seed so variants are reproducible
+        preview: Render at preview quality, as the avatar page first shows it
+        bypass_cache: Generate a fresh image even if this request was rendered before
+
+    Returns:
+        The avatar id and whether it was already cached
+
+    Raises:
+        HTTPException: If the model is unknown, a parameter is invalid or the generation fails
+    """
+    mid, json_payload, key = _avatar_request(img_model, prompt_text, params, preview, fresh_seed=bypass_cache)
+    avatar_id = None if bypass_cache else await get_cached_avatar_id(key)
+    annotate(**{"cache.hit": avatar_id is not None})
+    if avatar_id is not None:
+        return avatar_id, True
+    avatar_id = await avatar_flight.do(key, lambda: _generate_avatar(mid, json_payload, key, None, PRIORITY_BACKGROUND))
+    return avatar_id, False
+
+async def _generate_avatar(mid: str, json_payload: dict, key: str, session: Optional[str], priority: int = PRIORITY_IMAGE) -> str:
+    # Make the API call once a slot is free; chat calls are served first
+    try:
+        async with upstream_scheduler.slot(mid, priority, session):
+            # Image generations are too costly to hedge, but safe to retry
+            response = await resilience.call(mid, lambda: run_model(mid, json_payload, timeout=IMAGE_TIMEOUT))
+    except SchedulerFull as e:
+        raise upstream_busy(e)
+    except CircuitOpen as e:
+        raise upstream_unavailable(e)
+
+    if response.status_code != 200:
+        logger.error("API call failed with status %s: %s", response.status_code, response.text)
+        raise HTTPException(status_code=response.status_code, detail="Failed to generate image")
+    # Assuming the response.content is the binary image data
+    avatar_id = await store_avatar(response.content)
+    await cache_avatar_id(key, avatar_id)
+    logger.info("Avatar image generated successfully")
+    return avatar_id
+
 class MadScientist:
     def __init__(self, request: Request):
         self.request = request
         self.image_generated = False
         self.auth = False
 
-    async def set_session(self, request: Request, variable: str, data: Any):
-        if self.request.session is not None:
-            self.request.session[variable] = data
-        else:
+    def session_id(self, create: bool = True) -> Optional[str]:
+        """Return the id of this browser's server-side session, the only value kept in the cookie."""
+        if self.request.session is None:
             raise HTTPException(status_code=500, detail="Session not initialized")
+        sid = self.request.session.get("sid")
+        if sid is None and create:
+            sid = uuid.uuid4().hex
+            self.request.session["sid"] = sid
+        return sid
 
+    @traced("session.set")
+    async def set_session(self, request: Request, variable: str, data: Any):
+        await session_store.set(self.session_id(), variable, data)
+
+    @traced("session.get")
     async def get_session(self, request: Request, variable: str) -> Any:
-        if self.request.session is not None and variable in self.request.session:
-            return self.request.session[variable]
-        return None
+        sid = self.session_id(create=False)
+        if sid is None:
+            return None
+        return await session_store.get(sid, variable)
+
+    @traced("session.get_turns")
+    async def get_messages(self, request: Request) -> list:
+        sid = self.session_id(create=False)
+        if sid is None:
+            return []
+        return await session_store.get_turns(sid)
+
+    @traced("session.append_turn")
+    async def add_message(self, request: Request, user_message: Any, ai_response: str):
+        await session_store.append_turn(self.session_id(), {"user": user_message, "ai": ai_response})
+
+    async def clear_messages(self, request: Request):
+        sid = self.session_id(create=False)
+        if sid is not None:
+            await session_store.clear_turns(sid)
 
     async def clear_session(self, request: Request):
+        sid = self.session_id(create=False)
+        if sid is not None:
+            await session_store.clear(sid)
         request.session.clear()  # Clear the session
         return {"message": "Session cleared"}
 
     async def get_models(self, request: Request):
-        return [AI(**mod) for mod in models]
+        return list(registry)
 
     async def get_model_by_name(self, request: Request, model: str):
-        for mod in models:
-            if mod["name"] == model:
-                return AI(**mod)
+        ai = registry.get_by_name(model)
+        if ai is not None:
+            return ai
         return {"model": model, "description": "Model Not Found", "_id": "model_not_found", "name": model} 
 
     async def get_mid_by_model_name(self, request: Request, model: str):
-        for mod in models:
-            if mod["name"] == model:
-                return mod["mid"]
+        ai = registry.get_by_name(model)
+        return ai.mid if ai is not None else None
 
     async def get_model_name_by_model(self, request: Request, model: str):
-        for mod in models:
-            if mod["model"] == model:
-                return mod["name"]
+        ai = registry.get_by_model(model)
+        return ai.name if ai is not None else None
             
 
-    async def chat(self, request: Request, mod_id: str, user_message: str) -> dict:
-        logger.info(f"Starting chat with model {mod_id}")
-        logger.debug(f"User message type: {type(user_message)}, content preview: {str(user_message)[:100] if isinstance(user_message, str) else 'List of messages'}")
+    def fair_share_key(self) -> Optional[str]:
+        """The session id the upstream scheduler shares capacity by, without creating a session."""
+        return self.request.session.get("sid") if self.request is not None else None
+
+    async def complete(self, mod_id: str, messages: list, priority: int = PRIORITY_CHAT) -> str:
+        """
+        Send messages to a chat model and return its reply, without touching the session.
+
+        Concurrent calls with the same model and messages share one upstream request.
+
+        Raises:
+            HTTPException: If the call fails, the reply is malformed, or the
+                scheduler turns the call away (429)
+        """
+        session = self.fair_share_key()
+        return await chat_flight.do(response_key(mod_id, messages), lambda: self._complete(mod_id, messages, priority, session))
+
+    async def _complete(self, mod_id: str, messages: list, priority: int, session: Optional[str]) -> str:
+        payload = {
+            "messages": messages
+        }
+        try:
+            # Send the request to the AI model
+            async with upstream_scheduler.slot(mod_id, priority, session):
+                response = await resilience.call(
+                    mod_id, lambda: run_model(mod_id, payload, timeout=CHAT_TIMEOUT), hedge=True
+                )
+        except SchedulerFull as e:
+            raise upstream_busy(e)
+        except CircuitOpen as e:
+            raise upstream_unavailable(e)
+        except httpx.RequestError as e:
+            logger.error("Network error during API call: %s", e)
+            raise HTTPException(status_code=503, detail="Network error communicating with AI model")
+
+        logger.debug("API response status: %s", response.status_code)
+        # Check for a successful response and extract the reply
+        if response.status_code != 200:
+            logger.error("API call failed with status %s: %s", response.status_code, response.text)
+            raise HTTPException(status_code=response.status_code, detail="Failed to call AI model")
+        result = response.json()
+        if 'result' in result and 'response' in result['result']:
+            ai_response = result['result']['response']
+            logger.info("Received AI response, length: %s", len(ai_response))
+            return ai_response
+        logger.error("Unexpected API response format: %s", result)
+        raise HTTPException(status_code=500, detail="Invalid API response format")
+
+    @traced("chat")
+    async def chat(self, request: Request, mod_id: str, user_message: str, context: Optional[list] = None, cache: bool = False, semantic: bool = False) -> dict:
+        """
+        Get the model's reply to a message and record the turn in the session.
+
+        Args:
+            mod_id: The chat model id
+            user_message: The user's message, or a full message list
+            context: Messages to send instead of ``user_message``, e.g. from build_context
+            cache: Serve and store the reply in the response cache; only for prompts
+                whose reply does not depend on the session
+            semantic: Also answer near duplicates of earlier single-message prompts
+                from the semantic cache, when it is enabled; ignored if the context
+                carries turns beyond the introduction
+        """
+        logger.info("Starting chat with model %s", mod_id)
+        logger.debug("User message type: %s, content preview: %.100s", type(user_message), user_message if isinstance(user_message, str) else 'List of messages')
         
         try:
             # Update the user's message within the inputs structure
-            if type(user_message) is list:
+            if context is not None:
+                updated_inputs = context
+            elif type(user_message) is list:
                 updated_inputs = user_message
             else:
                 updated_inputs = [{"role": "user", "content": user_message}]
-            
-            payload = {
-                "messages": updated_inputs
-            }  # Use the updated inputs with the user's message
-            
-            logger.debug(f"Making API call to {API_BASE_URL}{mod_id}")
-            # Send the request to the AI model
-            response = requests.post(
-                f"{API_BASE_URL}{mod_id}",
-                headers=headers,
-                json=payload
-            )
-            
-            logger.debug(f"API response status: {response.status_code}")
-            result = response.json()
-            
-            # Check for a successful response and extract the reply
-            if response.status_code == 200:
-                if 'result' in result and 'response' in result['result']:
-                    ai_response = result['result']['response']
-                    logger.info(f"Received AI response, length: {len(ai_response)}")
-                    
-                    # Append the user message and AI response to the session messages
-                    messages = await self.get_session(request, "messages") or []
-                    messages.append({
-                        "user": user_message,
-                        "ai": ai_response
-                    })
-                    await self.set_session(request=request, variable="messages", data=messages)
-                    logger.debug(f"Session updated with {len(messages)} total messages")
-                    return ai_response
-                else:
-                    logger.error(f"Unexpected API response format: {result}")
-                    raise HTTPException(status_code=500, detail="Invalid API response format")
-            else:
-                logger.error(f"API call failed with status {response.status_code}: {response.text}")
-                raise HTTPException(status_code=response.status_code, detail="Failed to call AI model")
-        except requests.RequestException as e:
-            logger.error(f"Network error during API call: {str(e)}")
-            raise HTTPException(status_code=503, detail="Network error communicating with AI model")
+
+            key = response_key(mod_id, updated_inputs) if cache else None
+            use_semantic = self._use_semantic(semantic, user_message, updated_inputs)
+            ai_response = response_cache.get(key) if key else None
+            if ai_response is not None:
+                logger.info("Chat response served from cache")
+                annotate(**{"cache.result": "response"})
+                response_cache.maybe_refresh(key, lambda: self.complete(mod_id, updated_inputs, PRIORITY_BACKGROUND))
+            elif use_semantic:
+                ai_response = await semantic_cache.get(mod_id, user_message)
+                if ai_response is not None:
+                    annotate(**{"cache.result": "semantic"})
+            if ai_response is None:
+                annotate(**{"cache.result": "miss"})
+                ai_response = await self.complete(mod_id, updated_inputs)
+                if key:
+                    response_cache.set(key, ai_response)
+                if use_semantic:
+                    await semantic_cache.add(mod_id, user_message, ai_response)
+
+            # Append the user message and AI response to the session messages
+            await self.add_message(request, user_message, ai_response)
+            logger.debug("Session conversation updated")
+            return ai_response
         except Exception as e:
-            logger.error(f"Unexpected error in chat method: {str(e)}")
+            logger.error("Unexpected error in chat method: %s", e)
             raise
 
 
+    @staticmethod
+    def _use_semantic(semantic: bool, user_message: Any, updated_inputs: list) -> bool:
+        # The semantic cache is keyed on the message text alone, so a reply that
+        # drew on earlier turns must never be served to, or stored from, another session
+        return (
+            semantic
+            and semantic_cache is not None
+            and isinstance(user_message, str)
+            and is_standalone(updated_inputs, inputs)
+        )
+
+    async def chat_stream(self, request: Request, mod_id: str, user_message: str, context: Optional[list] = None, semantic: bool = False) -> AsyncIterator[str]:
+        logger.info("Starting streaming chat with model %s", mod_id)
+        if context is not None:
+            updated_inputs = context
+        elif type(user_message) is list:
+            updated_inputs = user_message
+        else:
+            updated_inputs = [{"role": "user", "content": user_message}]
+        use_semantic = self._use_semantic(semantic, user_message, updated_inputs)
+        if use_semantic:
+            cached = await semantic_cache.get(mod_id, user_message)
+            if cached is not None:
+                yield cached
+                await self.add_message(request, user_message, cached)
+                return
+
+        tokens = []
+        try:
+            async with upstream_scheduler.slot(mod_id, PRIORITY_CHAT, self.fair_share_key()):
+                # Tokens may already be on screen, so streams are never retried
+                async with resilience.guard(mod_id):
+                    async for token in stream_model(mod_id, {"messages": updated_inputs}, timeout=CHAT_TIMEOUT):
+                        tokens.append(token)
+                        yield token
+        except SchedulerFull as e:
+            raise upstream_busy(e)
+        except CircuitOpen as e:
+            raise upstream_unavailable(e)
+        except httpx.HTTPStatusError as e:
+            logger.error("Streaming API call failed with status %s: %s", e.response.status_code, e.response.text)
+            raise HTTPException(status_code=e.response.status_code, detail="Failed to call AI model")
+        except httpx.RequestError as e:
+            logger.error("Network error during streaming API call: %s", e)
+            raise HTTPException(status_code=503, detail="Network error communicating with AI model")
+
+        ai_response = "".join(tokens)
+        logger.info("Streamed AI response, length: %s", len(ai_response))
+        if use_semantic:
+            await semantic_cache.add(mod_id, user_message, ai_response)
+        await self.add_message(request, user_message, ai_response)
+
     async def finetuned_chat(self, request: Request, mod_id: str, user_message: str) -> dict:
         # Update the user's message within the inputs structure
         if isinstance(user_message, list):
@@ -245,43 +461,68 @@ class MadScientist:
         return ai_response
 
         
-    async def chat_message(self, request: Request, brain_model: str, message: str) -> str:
-        logger.info(f"Processing chat message with brain model: {brain_model}")
-        logger.debug(f"Message preview: {str(message)[:100] if isinstance(message, str) else str(message)[:100]}")
+    async def build_context(self, request: Request, message: str) -> list:
+        """Combine the system prompt, recent turns and the new message under the token budget."""
+        turns = await self.get_messages(request)
+        return build_context(inputs, turns, message)
+
+    @traced("chat_message")
+    async def chat_message(self, request: Request, brain_model: str, message: str, cache: bool = False) -> str:
+        logger.info("Processing chat message with brain model: %s", brain_model)
+        logger.debug("Message preview: %.100s", message)
         
-        try:
-            # Call the /models/{model} route to get the model name
-            model_name_response = await self.get_model_name_by_model(request, brain_model)
-            model_name = model_name_response.strip()  # Remove leading/trailing whitespace
-            logger.debug(f"Resolved brain model name: {model_name}")
-        except HTTPException as e:
-            logger.error(f"Failed to get model name for {brain_model}: {e}")
+        with span("model.resolve", **{"model.name": brain_model}):
+            mid = registry.resolve_mid(brain_model.strip())
+        if mid is None:
+            logger.error("Failed to resolve model id for %s", brain_model)
             raise HTTPException(status_code=404, detail=f"Model not found: {brain_model}")
-            
+        logger.debug("Resolved brain model ID: %s", mid)
+
         try:
-            mid_response = await self.get_mid_by_model_name(request, model_name)
-            mid = mid_response.strip()  # Remove leading/trailing whitespace
-            logger.debug(f"Resolved brain model ID: {mid}")
-            
             chat = await self.get_session(request=request, variable="chat")
-            logger.debug(f"Chat session status: {chat}")
+            logger.debug("Chat session status: %s", chat)
             
             if chat is False:
                 logger.info("Starting new chat session with introduction")
-                reply = await self.chat(request, mid, inputs)
+                reply = await self.chat(request, mid, inputs, cache=cache)
                 await self.set_session(request=request, variable="chat", data=True)
             else:
                 logger.info("Continuing existing chat session")
-                reply = await self.chat(request, mid, message)
+                context = await self.build_context(request, message)
+                # Only a message with nothing but the introduction before it may share semantic cache entries
+                reply = await self.chat(request, mid, message, context=context, semantic=is_standalone(context, inputs))
                 
         except HTTPException as e:
-            logger.error(f"Failed to get model id for {model_name}: {e}")
+            if e.status_code in (429, 503):
+                raise
+            logger.error("Chat call failed for %s: %s", brain_model, e)
             raise HTTPException(status_code=404, detail=f"Model configuration error: {brain_model}")
         except Exception as e:
-            logger.error(f"Unexpected error in chat_message: {str(e)}")
+            logger.error("Unexpected error in chat_message: %s", e)
             raise HTTPException(status_code=500, detail="Internal error processing chat message")
         
         await self.set_session(request=request, variable='chat', data=True)
         logger.info("Chat message processed successfully")
         return reply
+
+    async def chat_message_stream(self, request: Request, brain_model: str, message: str) -> AsyncIterator[str]:
+        """
+        Resolve the brain model and return a token stream for the message.
+
+        Model resolution and session bookkeeping happen before this returns, so
+        errors surface as HTTP errors rather than mid-stream, and the session id
+        cookie is set before the streaming response headers go out.
+        """
+        logger.info("Processing streaming chat message with brain model: %s", brain_model)
+        mid = registry.resolve_mid(brain_model.strip())
+        if mid is None:
+            raise HTTPException(status_code=404, detail=f"Model not found: {brain_model}")
+
+        chat = await self.get_session(request=request, variable="chat")
+        await self.set_session(request=request, variable="chat", data=True)
+        if chat is False:
+            logger.info("Starting new streaming chat session with introduction")
+            return self.chat_stream(request, mid, inputs)
+        context = await self.build_context(request, message)
+        return self.chat_stream(request, mid, message, context=context, semantic=is_standalone(context, inputs))
     
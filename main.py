@@ -1,16 +1,38 @@
 
 from fastapi import FastAPI, HTTPException, Query, Form, Request
-from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse, JSONResponse, StreamingResponse, Response
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
-from mad_scientist import MadScientist, get_avatar_data_url, AI, brain_options, art_options, inputs, SECRET_KEY, GTAG
+from mad_scientist import MadScientist, get_avatar_url, submit_avatar_job, AI, inputs, AVATAR_PREVIEW, SECRET_KEY, GTAG
+from model_registry import registry as model_registry
 from static import css_styles
 from logging_config import setup_logging, get_logger
+from upstream import close_client
+from avatar_cache import avatar_cache, avatar_store, is_avatar_id, load_avatar
+from avatar_jobs import DONE, AvatarJob, avatar_jobs
+from avatar_batch import AvatarBatch, run_batch
+from session_store import session_store
+from response_cache import response_cache
+from semantic_cache import semantic_cache
+from singleflight import avatar_flight, chat_flight
+from scheduler import upstream_scheduler
+from resilience import resilience
+from assets import CachedStaticFiles, asset_url, build_static_assets, build_stylesheet
+from tracing import TracedTemplate, TracingMiddleware, span
+from profiler import ADMIN_TOKEN, PROFILER_MAX_SECONDS, ProfilingMiddleware, collapse, is_admin_token, profile_coordinator
+from metrics import (
+    CONTENT_TYPE_LATEST, SESSION_STORE_SESSIONS, MetricsMiddleware, StatsCollector,
+    monitor_event_loop_lag, register_stats_collector, render_metrics,
+)
 import requests
 import httpx
+import json
+import asyncio
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, select_autoescape
 import logging
 import os
+from typing import Any, Dict, Mapping, Optional, Tuple
 from urllib.parse import quote, urlencode
 
 # Setup logging
@@ -18,14 +40,78 @@ log_level = os.getenv("LOG_LEVEL", "INFO")
 setup_logging(log_level)
 logger = get_logger(__name__)
 
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR", "cache/templates")
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+
 app = FastAPI()
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Compile every template once at startup; bytecode is cached on disk across restarts
+template_env = Environment(
+    loader=FileSystemLoader("templates"),
+    autoescape=select_autoescape(default=True),
+    auto_reload=False,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR) if TEMPLATE_CACHE_DIR else None,
+)
+template_env.template_class = TracedTemplate
+# Fingerprinted, precompressed copies of everything under static/
+build_static_assets()
+template_env.globals["stylesheet_url"] = build_stylesheet(css_styles)
+template_env.globals["asset_url"] = asset_url
+templates = Jinja2Templates(env=template_env)
+for template_name in template_env.list_templates(extensions=["html"]):
+    template_env.get_template(template_name)
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
+app.add_middleware(MetricsMiddleware)
+if ADMIN_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
+# Outermost, so every log line written while serving a request carries its id
+app.add_middleware(TracingMiddleware)
+register_stats_collector(StatsCollector(
+    caches={
+        "avatar_images": avatar_store.stats,
+        "avatar_requests": avatar_cache.stats,
+        "responses": response_cache.stats,
+        "semantic": lambda: semantic_cache.stats() if semantic_cache is not None else None,
+    },
+    flights=[avatar_flight, chat_flight],
+    scheduler=upstream_scheduler.stats,
+    resilience=resilience.stats,
+))
 app_name = "Mad Scientist"
-durl = {}
-responses = {}
-responses['ai'] = []
+DEFAULT_AVATAR_URL = asset_url("avatar-default.png")
+
+# Pages without per-request data are rendered once
+html_content = template_env.get_template("models.html").render(
+    brain_models=model_registry.by_usage("mad-sci-text"),
+    art_models=model_registry.by_usage("art"),
+    avatar_preview=AVATAR_PREVIEW,
+)
+initial_html_content = template_env.get_template("access.html").render()
+
+# Longest a status request may hold on waiting for its avatar job to finish
+AVATAR_JOB_MAX_WAIT = 30
+# Seconds between comments that keep an idle job event stream open through proxies
+AVATAR_JOB_KEEPALIVE = 15
+
+@app.on_event("startup")
+async def startup():
+    """Start the avatar job runners, sampling event-loop lag for /metrics and watching for profile requests."""
+    avatar_jobs.start()
+    app.state.loop_lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+    # Every worker listens for /admin/profile windows, so one call profiles them all
+    app.state.profile_watcher = asyncio.create_task(profile_coordinator.watch()) if ADMIN_TOKEN else None
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop avatar jobs and background cache refreshes and release upstream connections and the session store."""
+    app.state.loop_lag_monitor.cancel()
+    await avatar_jobs.close()
+    if app.state.profile_watcher is not None:
+        app.state.profile_watcher.cancel()
+    await response_cache.close()
+    await close_client()
+    await session_store.close()
 
 @app.get("/models", response_model=list[AI], response_class=PlainTextResponse)
 async def models(request: Request):
@@ -33,10 +119,10 @@ async def models(request: Request):
     try:
         mad_scientist = MadScientist(request)
         models = mad_scientist.get_models()
-        logger.debug(f"Retrieved {len(models) if models else 0} models")
+        logger.debug("Retrieved %s models", len(models) if models else 0)
         return models
     except Exception as e:
-        logger.error(f"Error fetching models: {str(e)}")
+        logger.error("Error fetching models: %s", e)
         raise HTTPException(status_code=500, detail="Failed to fetch models")
 
 @app.get("/models/{model}", response_model=list[AI], response_class=PlainTextResponse)
@@ -57,563 +143,162 @@ async def model_api_name(model: str):
         model_name = mad_scientist.get_model_name_by_model(model=model)
         return model_name
 
-html_content = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Mad Scientist AI - Model Selection</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;500;600;700;800&family=Roboto:wght@300;400;500;700&display=swap" rel="stylesheet">
-    <style>""" + css_styles + """</style>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/animate.css/4.1.1/animate.min.css">
-</head>
-<body>
-    <div class="centered form-containter animate__animated animate__fadeIn">
-        <h1>🧪 <span class="lab-title">Mad Scientist AI</span> 🧪</h1>
-        
-        <form action="/generate-avatar/" method="get" class="model-form">
-            <div class="input-group">
-                <label for="brain_model">Language Model</label>
-                <select class="custom-select input-element" id="brain_model" name="brain_model" required>
-""" + brain_options + """
-                </select>
-            </div>
-            
-            <div class="input-group">
-                <label for="image_model">Image Model</label>
-                <select class="custom-select input-element" id="image_model" name="image_model" required>
-""" + art_options + """
-                </select>
-            </div>
-            
-            <div class="input-group">
-                <label for="prompt">Avatar Prompt</label>
-                <textarea 
-                    class="input-element" 
-                    placeholder="A Mad Scientist" 
-                    name="prompt" 
-                    id="prompt"
-                    rows="4" 
-                    required
-                ></textarea>
-            </div>
-            
-            <button class="submit" type="submit" onclick="this.innerHTML='🧪 Experimenting...'; this.classList.add('loading');">🧪 Start Experiment!</button>
-        </form>
-        
-        <div class="lab-features">
-            <div class="feature-grid">
-                <div class="feature-item">
-                    <span class="feature-icon">🤖</span>
-                    <span>AI Models</span>
-                </div>
-                <div class="feature-item">
-                    <span class="feature-icon">🎨</span>
-                    <span>Custom Avatars</span>
-                </div>
-                <div class="feature-item">
-                    <span class="feature-icon">⚡</span>
-                    <span>Instant Results</span>
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {{
-            const promptInput = document.getElementById('prompt');
-            const submitButton = document.querySelector('.submit');
-            
-            // Auto-focus on prompt input
-            promptInput.focus();
-            
-            // Form validation
-            document.querySelector('.model-form').addEventListener('submit', function(e) {{
-                const brainModel = document.getElementById('brain_model').value;
-                const imageModel = document.getElementById('image_model').value;
-                const prompt = document.getElementById('prompt').value;
-                
-                if (!brainModel || !imageModel || !prompt.trim()) {{
-                    e.preventDefault();
-                    alert('Please fill in all fields before experimenting!');
-                    submitButton.innerHTML = '🧪 Start Experiment!';
-                    submitButton.classList.remove('loading');
-                }}
-            }});
-            
-            // Hover effects
-            document.querySelector('.form-containter').addEventListener('mouseenter', function() {{
-                this.style.transform = 'translate(-50%, -50%) scale(1.02)';
-            }});
-            
-            document.querySelector('.form-containter').addEventListener('mouseleave', function() {{
-                this.style.transform = 'translate(-50%, -50%) scale(1)';
-            }});
-        }});
-    </script>
-    
-    <style>
-        .model-form .input-group {
-            margin-bottom: 1.5rem;
-        }
-        
-        .model-form .input-group label {
-            display: block;
-            margin-bottom: 0.5rem;
-            color: var(--glow-color);
-            font-weight: 500;
-        }
-        
-        .model-form textarea {
-            min-height: 100px;
-            resize: vertical;
-        }
-        
-        .lab-features {
-            margin-top: 2rem;
-            padding-top: 1rem;
-            border-top: 1px solid var(--primary-color);
-        }
-        
-        .feature-grid {
-            display: flex;
-            justify-content: space-around;
-            gap: 1rem;
-        }
-        
-        .feature-item {
-            text-align: center;
-            padding: 0.5rem;
-            transition: transform 0.3s ease;
-        }
-        
-        .feature-item:hover {
-            transform: scale(1.1);
-        }
-        
-        .feature-icon {
-            display: block;
-            font-size: 1.5rem;
-            margin-bottom: 0.5rem;
-        }
-        
-        .form-containter {
-            transition: all 0.3s ease;
-        }
-    </style>
-</body>
-</html>
-"""
-
-initial_html_content = f"""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Mad Scientist AI - Laboratory Access</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;500;600;700;800&family=Roboto:wght@300;400;500;700&display=swap" rel="stylesheet">
-    <style>{css_styles}</style>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/animate.css/4.1.1/animate.min.css">
-</head>
-<body>
-    <div class="centered form-containter">
-        <h1><img src="/static/tube.svg" class="tube-icon" alt="Test Tube"> <span class="lab-title">Mad Scientist AI</span> <img src="/static/tube.svg" class="tube-icon" alt="Test Tube"></h1>
-        
-        <form action="/verify-email/" method="post" class="access-form">
-            <div class="input-group">
-                <label for="email">Email</label>
-                <input 
-                    class="input-element" 
-                    type="email" 
-                    name="email" 
-                    id="email"
-                    placeholder="Email address" 
-                    required
-                    autocomplete="email"
-                >
-            </div>
-            
-            <button 
-                class="submit" 
-                type="submit"
-                onclick="this.innerHTML='Loading...'; this.classList.add('loading');"
-            >
-                Continue
-            </button>
-        </form>
-        
-        <div class="lab-features">
-            <div class="feature-grid">
-                <div class="feature-item">
-                    <span class="feature-icon">🔮</span>
-                    <span>AI Oracle</span>
-                </div>
-                <div class="feature-item">
-                    <span class="feature-icon">✨</span>
-                    <span>Mystical Avatars</span>
-                </div>
-                <div class="feature-item">
-                    <span class="feature-icon">💫</span>
-                    <span>Arcane Magic</span>
-                </div>
-            </div>
-        </div>
-    </div>
-    
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {{
-            const emailInput = document.getElementById('email');
-            const submitButton = document.querySelector('.submit');
-            
-            // Auto-focus on email input
-            emailInput.focus();
-            
-            // Enhanced form validation
-            emailInput.addEventListener('input', function() {{
-                const email = this.value;
-                if (email.includes('@') && email.includes('.')) {{
-                    this.style.borderColor = 'var(--glow-color)';
-                }} else {{
-                    this.style.borderColor = 'var(--primary-color)';
-                }}
-            }});
-            
-            // Add subtle scale effect on hover
-            document.querySelector('.form-containter').addEventListener('mouseenter', function() {{
-                this.style.transform = 'translate(-50%, -50%) scale(1.02)';
-            }});
-            
-            document.querySelector('.form-containter').addEventListener('mouseleave', function() {{
-                this.style.transform = 'translate(-50%, -50%) scale(1)';
-            }});
-        }});
-    </script>
-    
-    <style>
-        .lab-intro {{
-            margin-bottom: 2rem;
-            padding: 1rem;
-            border-radius: 10px;
-            background: linear-gradient(135deg, var(--primary-color), var(--surface-color));
-        }}
-        
-        .input-group {{
-            margin-bottom: 1.5rem;
-        }}
-        
-        .input-group label {{
-            display: block;
-            margin-bottom: 0.5rem;
-            color: var(--glow-color);
-            font-weight: 500;
-        }}
-        
-        .lab-features {{
-            margin-top: 2rem;
-            padding-top: 1rem;
-            border-top: 1px solid var(--primary-color);
-        }}
-        
-        .feature-grid {{
-            display: flex;
-            justify-content: space-around;
-            gap: 1rem;
-        }}
-        
-        .feature-item {{
-            text-align: center;
-            padding: 0.5rem;
-            transition: transform 0.3s ease;
-        }}
-        
-        .feature-item:hover {{
-            transform: scale(1.1);
-        }}
-        
-        .feature-icon {{
-            display: block;
-            font-size: 1.5rem;
-            margin-bottom: 0.5rem;
-        }}
-        
-        .form-containter {{
-            transition: all 0.3s ease;
-        }}
-        
-        .tube-icon {{
-            width: 2rem;
-            height: 2rem;
-            transition: all 0.3s ease;
-            opacity: 0.9;
-            vertical-align: middle;
-            animation: bubbleFloat 3s ease-in-out infinite;
-        }}
-        
-        .form-containter:hover .tube-icon {{
-            transform: scale(1.1);
-            opacity: 1;
-            animation: bubbleShake 0.8s ease-in-out infinite;
-        }}
-        
-        @keyframes bubbleFloat {{
-            0%, 100% {{
-                transform: translateY(0px) rotate(0deg);
-            }}
-            25% {{
-                transform: translateY(-3px) rotate(1deg);
-            }}
-            50% {{
-                transform: translateY(0px) rotate(0deg);
-            }}
-            75% {{
-                transform: translateY(-2px) rotate(-1deg);
-            }}
-        }}
-        
-        @keyframes bubbleShake {{
-            0%, 100% {{
-                transform: scale(1.1) rotate(0deg);
-            }}
-            25% {{
-                transform: scale(1.15) rotate(2deg);
-            }}
-            50% {{
-                transform: scale(1.1) rotate(0deg);
-            }}
-            75% {{
-                transform: scale(1.15) rotate(-2deg);
-            }}
-        }}
-    </style>
-</body>
-</html>
-"""
-
 @app.get("/")
 async def root(request: Request):
     logger.info("Root endpoint accessed")
     try:
         mad_scientist = MadScientist(request)
-        messages = await mad_scientist.set_session(request=request, variable="messages", data='')
-        token = await mad_scientist.set_session(request=request, variable="token", data='')    
+        await mad_scientist.clear_messages(request)
+        await mad_scientist.set_session(request=request, variable="token", data='')
         logger.debug("Session initialized for new user")
         return HTMLResponse(content=initial_html_content, status_code=200)
     except Exception as e:
-        logger.error(f"Error in root endpoint: {str(e)}")
+        logger.error("Error in root endpoint: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+def _requested_params(image_model: Optional[str], values: Mapping[str, Any]) -> Dict[str, Any]:
+    """Pick the generation parameters the image model declares out of query or form values."""
+    ai = model_registry.get_by_model((image_model or "").strip())
+    if ai is None:
+        return {}
+    return {name: values[name] for name in ai.params if values.get(name) not in (None, "")}
+
 @app.get("/generate-avatar/")
-async def generate_avatar(request: Request, brain_model: str = Query(None), image_model: str = Query(None), prompt: str = Query(None)):
-    logger.info(f"Generating avatar with model: {image_model}, prompt: {prompt}")
+async def generate_avatar(
+    request: Request,
+    brain_model: str = Query(None),
+    image_model: str = Query(None),
+    prompt: str = Query(None),
+    regenerate: bool = Query(False),
+    preview: bool = Query(AVATAR_PREVIEW),
+):
+    """
+    Render the avatar page at once; an uncached image is generated by a background job the page follows.
+
+    Generation parameters the image model declares (e.g. ``num_steps``, ``guidance``,
+    ``seed``) are read from the query string. Unless ``preview=false``, the first render
+    is a fast preview, rendered again at full quality when the avatar is saved.
+    """
+    logger.info("Generating avatar with model: %s, prompt: %s, regenerate: %s", image_model, prompt, regenerate)
+    params = _requested_params(image_model, request.query_params)
+    ai = model_registry.get_by_model((image_model or "").strip())
+    preview = preview and ai is not None and ai.has_preview
+    avatar_url = None
+    job_id = None
     try:
         mad_scientist = MadScientist(request)
-        data_url = await get_avatar_data_url(request, img_model=image_model, prompt_text=prompt)
-        durl['data_url'] = data_url
+        result, generation_params = await submit_avatar_job(
+            request, img_model=image_model, prompt_text=prompt, params=params, preview=preview, bypass_cache=regenerate,
+        )
         await mad_scientist.set_session(request=request, variable="chat", data=False)
-        logger.debug("Avatar generated successfully")
+        if isinstance(result, AvatarJob):
+            job_id = result.id
+            logger.debug("Avatar queued as job %s", job_id)
+        else:
+            avatar_url = result
+            await mad_scientist.set_session(request=request, variable="avatar_url", data=avatar_url)
+            logger.debug("Avatar generated successfully")
+    except HTTPException as e:
+        if e.status_code in (422, 429, 503):
+            raise
+        logger.error("Error generating avatar: %s", e.detail)
+        raise HTTPException(status_code=500, detail="Failed to generate avatar")
     except Exception as e:
-        logger.error(f"Error generating avatar: {str(e)}")
+        logger.error("Error generating avatar: %s", e)
         raise HTTPException(status_code=500, detail="Failed to generate avatar")
 
-    avatar_page = f'''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Mad Scientist AI - Avatar Created</title>
-        <link rel="preconnect" href="https://fonts.googleapis.com">
-        <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-        <link href="https://fonts.googleapis.com/css2?family=Poppins:wght@400;500;600;700;800&family=Roboto:wght@300;400;500;700&display=swap" rel="stylesheet">
-        <style>{css_styles}</style>
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/animate.css/4.1.1/animate.min.css">
-    </head>
-    <body>
-        <div class="centered form-containter animate__animated animate__zoomIn">
-            <h1 class="animate__animated animate__pulse animate__infinite">🧪 Mad Scientist AI 🧪</h1>
-            
-            <div class="avatar-showcase animate__animated animate__fadeInDown animate__delay-1s">
-                <div class="avatar-frame">
-                    <img src="{data_url}" alt="Generated Mad Scientist Avatar" class="generated-avatar animate__animated animate__bounceIn animate__delay-2s">
-                </div>
-                <p class="avatar-success animate__animated animate__fadeInUp animate__delay-3s">
-                    🎉 Your Mad Scientist Avatar is Ready! 🎉<br>
-                    <span style="font-size: 0.9rem; color: var(--text-muted);">Prompt: "{prompt}"</span>
-                </p>
-            </div>
-            
-            <div class="avatar-actions animate__animated animate__slideInUp animate__delay-4s">
-                <div class="action-buttons">
-                    <form action='/mad-scientist/' method="get" style="display: inline-block;">
-                        <input type="hidden" name="brain_model" value="{brain_model}">
-                        <input type="hidden" name="image_model" value="{image_model}">
-                        <input type="hidden" name="prompt" value="{prompt}">
-                        <button 
-                            class="submit avatar-button animate__animated animate__pulse animate__infinite" 
-                            type="submit"
-                            style="background: linear-gradient(135deg, var(--secondary-color), var(--glow-color)); margin-right: 1rem;"
-                            onclick="this.innerHTML='🚀 Launching Chat...'; this.classList.add('loading');"
-                        >
-                            ✨ Save & Use Avatar ✨
-                        </button>
-                    </form>
-                    
-                    <form action='/generate-avatar/' method="get" style="display: inline-block;">
-                        <input type="hidden" name="brain_model" value="{brain_model}">
-                        <input type="hidden" name="image_model" value="{image_model}">
-                        <input type="hidden" name="prompt" value="{prompt}">
-                        <button 
-                            class="submit avatar-button" 
-                            type="submit"
-                            style="background: linear-gradient(135deg, var(--primary-color), var(--secondary-color))"
-                            onclick="this.innerHTML='🎲 Generating...'; this.classList.add('loading');"
-                        >
-                            🔄 Try Again
-                        </button>
-                    </form>
-                </div>
-                
-                <div class="model-info animate__animated animate__fadeInUp animate__delay-5s">
-                    <div class="info-grid">
-                        <div class="info-item">
-                            <span class="info-label">🤖 Brain Model:</span>
-                            <span class="info-value">{brain_model}</span>
-                        </div>
-                        <div class="info-item">
-                            <span class="info-label">🎨 Image Model:</span>
-                            <span class="info-value">{image_model}</span>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        
-        <script>
-            document.addEventListener('DOMContentLoaded', function() {{
-                const avatar = document.querySelector('.generated-avatar');
-                
-                avatar.addEventListener('mouseenter', function() {{
-                    this.style.transform = 'scale(1.1) rotate(5deg)';
-                }});
-                
-                avatar.addEventListener('mouseleave', function() {{
-                    this.style.transform = 'scale(1) rotate(0deg)';
-                }});
-                
-                document.querySelectorAll('.avatar-button').forEach(button => {{
-                    button.addEventListener('mouseenter', function() {{
-                        this.style.animation = 'bounce 0.6s ease';
-                    }});
-                }});
-            }});
-        </script>
-        
-        <style>
-            .avatar-showcase {
-                text-align: center;
-                margin: 2rem 0;
-            }
-            
-            .avatar-frame {
-                display: inline-block;
-                padding: 10px;
-                border: 3px solid var(--glow-color);
-                border-radius: 50%;
-                background: linear-gradient(135deg, var(--primary-color), var(--secondary-color));
-                box-shadow: inset 0 0 20px var(--shadow-light);
-                margin-bottom: 1rem;
-            }
-            
-            .generated-avatar {
-                width: 200px;
-                height: 200px;
-                border-radius: 50%;
-                object-fit: cover;
-                transition: all 0.3s ease;
-                cursor: pointer;
-            }
-            
-            .avatar-success {
-                color: var(--glow-color);
-                font-size: 1.2rem;
-                font-weight: 600;
-                text-align: center;
-                margin-bottom: 2rem;
-            }
-            
-            .avatar-actions {
-                text-align: center;
-            }
-            
-            .action-buttons {
-                margin-bottom: 2rem;
-            }
-            
-            .avatar-button {
-                margin: 0.5rem;
-                padding: 15px 25px;
-                font-size: 1rem;
-                min-width: 200px;
-                transition: all 0.3s ease;
-            }
-            
-            .model-info {
-                background: linear-gradient(135deg, var(--primary-color), var(--surface-color));
-                padding: 1rem;
-                border-radius: 10px;
-                border-top: 1px solid var(--glow-color);
-            }
-            
-            .info-grid {
-                display: flex;
-                justify-content: space-around;
-                gap: 1rem;
-            }
-            
-            .info-item {
-                text-align: center;
-            }
-            
-            .info-label {
-                display: block;
-                color: var(--glow-color);
-                font-weight: 500;
-                margin-bottom: 0.5rem;
-            }
-            
-            .info-value {
-                color: var(--text-color);
-                font-size: 0.9rem;
-            }
-            
-            @media (max-width: 768px) {{
-                .action-buttons form {{
-                    display: block !important;
-                    margin: 0.5rem 0;
-                }}
-                
-                .avatar-button {{
-                    width: 100%;
-                    margin: 0.5rem 0;
-                }}
-                
-                .info-grid {{
-                    flex-direction: column;
-                    gap: 0.5rem;
-                }}
-            }}
-        </style>
-    </body>
-    </html>
-    '''
-    return HTMLResponse(content=avatar_page, status_code=200)
+    # The refinement keeps the preview's seed, so it renders the image that was chosen
+    refine_params = dict(params)
+    if "seed" in generation_params:
+        refine_params["seed"] = generation_params["seed"]
+    return templates.TemplateResponse("avatar.html", {
+        "request": request,
+        "avatar_url": avatar_url,
+        "job_id": job_id,
+        "prompt": prompt,
+        "brain_model": brain_model,
+        "image_model": image_model,
+        "preview": preview,
+        "params": params,
+        "refine_params": refine_params,
+        "generation_params": generation_params,
+    })
+
+@app.post("/generate-avatar/refine")
+async def refine_avatar(request: Request, brain_model: str = Form(None), image_model: str = Form(...), prompt: str = Form(...)):
+    """
+    Save the previewed avatar and start rendering it at full quality.
+
+    Redirects straight to the chat, which shows the preview until the full-quality
+    image is ready and then swaps it in.
+    """
+    form = await request.form()
+    mad_scientist = MadScientist(request)
+    try:
+        result, _ = await submit_avatar_job(request, img_model=image_model, prompt_text=prompt, params=_requested_params(image_model, form))
+        if isinstance(result, AvatarJob):
+            await mad_scientist.set_session(request=request, variable="avatar_job", data=result.id)
+        else:
+            await mad_scientist.set_session(request=request, variable="avatar_url", data=result)
+    except HTTPException as e:
+        # The preview stays the avatar
+        logger.warning("Avatar refinement not started: %s", e.detail)
+    query = {"brain_model": brain_model, "image_model": image_model, "prompt": prompt}
+    return RedirectResponse(url=f"/mad-scientist/?{urlencode({k: v for k, v in query.items() if v})}", status_code=303)
 
+async def _use_finished_avatar(request: Request, job: AvatarJob) -> None:
+    # The avatar becomes this session's once its page sees the job finish
+    if job.status == DONE and request.session.get("sid") is not None:
+        await MadScientist(request).set_session(request=request, variable="avatar_url", data=job.to_dict()["avatar_url"])
+
+def _get_avatar_job(job_id: str) -> AvatarJob:
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Avatar job not found")
+    return job
+
+@app.get("/avatar-jobs/{job_id}")
+async def avatar_job_status(request: Request, job_id: str, wait: float = Query(0, ge=0, le=AVATAR_JOB_MAX_WAIT)):
+    """
+    Report an avatar job's status, optionally waiting up to ``wait`` seconds for it to finish.
+
+    Long-polling with ``wait`` is the fallback for browsers without EventSource.
+    """
+    job = _get_avatar_job(job_id)
+    if await job.wait(wait):
+        await _use_finished_avatar(request, job)
+    return job.to_dict()
+
+@app.get("/avatar-jobs/{job_id}/events")
+async def avatar_job_events(request: Request, job_id: str):
+    """Push an avatar job's outcome as a server-sent ``done`` or ``failed`` event."""
+    job = _get_avatar_job(job_id)
+
+    async def event_stream():
+        while not await job.wait(AVATAR_JOB_KEEPALIVE):
+            yield ": keepalive\n\n"
+        await _use_finished_avatar(request, job)
+        yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def _pending_refinement(mad_scientist: MadScientist, request: Request, data_url: str) -> Tuple[str, Optional[str]]:
+    """Return the avatar to show and the id of its full-quality render, if that is still running."""
+    job_id = await mad_scientist.get_session(request=request, variable="avatar_job")
+    if job_id is None:
+        return data_url, None
+    job = avatar_jobs.get(job_id)
+    if job is not None and not job.done:
+        return data_url, job_id
+    if job is not None and job.status == DONE:
+        data_url = job.to_dict()["avatar_url"]
+        await mad_scientist.set_session(request=request, variable="avatar_url", data=data_url)
+    await mad_scientist.set_session(request=request, variable="avatar_job", data=None)
+    return data_url, None
 
 @app.get("/mad-scientist/")
 async def get_chat(request: Request, brain_model: str = Query(None), image_model: str = Query(None), prompt: str = Query(None)):
@@ -621,21 +306,21 @@ async def get_chat(request: Request, brain_model: str = Query(None), image_model
     try:
         mad_scientist = MadScientist(request)
         
-        # Use existing avatar or fallback to placeholder
-        if len(durl) > 0:
-            data_url = durl['data_url']
-        else:
+        # Use this session's avatar or fallback to placeholder
+        data_url = await mad_scientist.get_session(request=request, variable="avatar_url")
+        if data_url is None:
             # Use static avatar image if no image model provided or if avatar generation fails
             if image_model is None:
                 logger.warning("No image model provided, using static avatar")
-                data_url = "/static/avatar-default.png"
+                data_url = DEFAULT_AVATAR_URL
             else:
                 try:
-                    data_url = await get_avatar_data_url(request, img_model=image_model, prompt_text='A Mad Scientist')
+                    data_url = await get_avatar_url(request, img_model=image_model, prompt_text='A Mad Scientist')
                 except Exception as avatar_error:
-                    logger.error(f"Avatar generation failed: {str(avatar_error)}, using static avatar")
-                    data_url = "/static/avatar-default.png"
-            durl['data_url'] = data_url
+                    logger.error("Avatar generation failed: %s, using static avatar", avatar_error)
+                    data_url = DEFAULT_AVATAR_URL
+            await mad_scientist.set_session(request=request, variable="avatar_url", data=data_url)
+        data_url, avatar_job_id = await _pending_refinement(mad_scientist, request, data_url)
             
         chat = await mad_scientist.get_session(request=request, variable="chat")
         if chat is False:
@@ -658,45 +343,45 @@ What aspect interests you most?"""
                 brain_model = "Demo Mode"
             else:
                 try:
-                    ai_intro = await mad_scientist.chat_message(request, brain_model, inputs)
+                    # The intro prompt is the same for every visitor, so its reply is cached
+                    ai_intro = await mad_scientist.chat_message(request, brain_model, inputs, cache=True)
                     # Check it for obvious errors
                     ai_intro = ai_intro.replace("Dr.", "").strip()
                     ai_intro = ai_intro.replace("you are my", "I am your").strip()
                 except Exception as chat_error:
-                    logger.error(f"Chat message failed: {str(chat_error)}, using demo content")
+                    logger.error("Chat message failed: %s, using demo content", chat_error)
                     ai_intro = """Greetings! I'm your Mad Scientist AI assistant ready to help with your experiments and questions!"""
                     brain_model = "Demo Mode"
             
             # Dummy message
             message = 'Hello, Mad Scientist AI. Please introduce yourself.'
-            responses['intro'] = ai_intro
             return templates.TemplateResponse("chat.html", {
                 "request": request,
-                "css_styles": css_styles,
                 "brain_model": brain_model or "Demo Mode",
                 "app_name": app_name,
                 "message": message,
                 "durl": data_url,
-                "response": responses['intro'],
+                "avatar_job_id": avatar_job_id,
+                "response": ai_intro,
             })
         
         else:
+            messages = await mad_scientist.get_messages(request)
             return templates.TemplateResponse("chat.html", {
                 "request": request,
-                "css_styles": css_styles,
                 "brain_model": brain_model or "Demo Mode",
                 "app_name": app_name,
                 "message": prompt or "What can you help me with?",
                 "durl": data_url,
-                "response": responses['ai'][-1] if responses['ai'] else "Hello! I'm ready to help with your scientific questions and experiments.",
+                "avatar_job_id": avatar_job_id,
+                "response": messages[-1]["ai"] if messages else "Hello! I'm ready to help with your scientific questions and experiments.",
             })
     except Exception as e:
-        logger.error(f"Error in mad-scientist route: {str(e)}")
+        logger.error("Error in mad-scientist route: %s", e)
         # Return demo page as fallback
-        placeholder_avatar = "/static/avatar-default.png"
+        placeholder_avatar = DEFAULT_AVATAR_URL
         return templates.TemplateResponse("chat.html", {
             "request": request,
-            "css_styles": css_styles,
             "brain_model": "Demo Mode",
             "app_name": app_name,
             "message": "What are the main applications of quantum computing?",
@@ -707,25 +392,56 @@ What aspect interests you most?"""
 
 @app.post("/mad-scientist/")
 async def post_chat(request: Request, prompt: str = Form(...), brain_model: str = Form(...)):
-    logger.info(f"Chat message received: {prompt[:100]}{'...' if len(prompt) > 100 else ''} using model: {brain_model}")
+    logger.info("Chat message received: %.100s%s using model: %s", prompt, '...' if len(prompt) > 100 else '', brain_model)
     try:
         mad_scientist = MadScientist(request)
-        ai_response = await mad_scientist.chat_message(request, brain_model, prompt)
+        with span("post_chat", **{"chat.prompt_chars": len(prompt)}):
+            ai_response = await mad_scientist.chat_message(request, brain_model, prompt)
         # Redirect back to the GET chat page to display the updated chat history
-        ai = responses['ai']
-        ai.append(ai_response)
-        logger.debug(f"AI response generated, length: {len(ai_response) if ai_response else 0}")
+        logger.debug("AI response generated, length: %s", len(ai_response) if ai_response else 0)
         response = RedirectResponse(
             url=f"/mad-scientist/?brain_model={brain_model}&app_name={app_name}&prompt={prompt}",
             status_code=303
         )
-        response.set_cookie(key="session", value=request.session)  # Ensure the session cookie is updated
         return response
+    except HTTPException as e:
+        if e.status_code in (429, 503):
+            raise
+        logger.error("Error in chat: %s", e.detail)
+        raise HTTPException(status_code=500, detail="Failed to process chat message")
     except Exception as e:
-        logger.error(f"Error in chat: {str(e)}")
+        logger.error("Error in chat: %s", e)
         raise HTTPException(status_code=500, detail="Failed to process chat message")
 
 
+@app.post("/mad-scientist/stream")
+async def post_chat_stream(request: Request, prompt: str = Form(...), brain_model: str = Form(...)):
+    """Relay the model's reply to the browser token by token as server-sent events."""
+    logger.info("Streaming chat message received: %.100s%s using model: %s", prompt, '...' if len(prompt) > 100 else '', brain_model)
+    mad_scientist = MadScientist(request)
+    tokens = await mad_scientist.chat_message_stream(request, brain_model, prompt)
+
+    async def event_stream():
+        try:
+            async for token in tokens:
+                yield f"data: {json.dumps({'token': token})}\n\n"
+        except HTTPException as e:
+            logger.error("Streaming chat failed: %s", e.detail)
+            yield f"event: error\ndata: {json.dumps({'detail': e.detail})}\n\n"
+            return
+        except Exception as e:
+            logger.error("Error in streaming chat: %s", e)
+            yield f"event: error\ndata: {json.dumps({'detail': 'Failed to process chat message'})}\n\n"
+            return
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/verify-email/")
 async def post_email(request: Request, email: str = Form(...)):
     response = RedirectResponse(
@@ -742,12 +458,11 @@ async def demo(request: Request):
     try:
         mad_scientist = MadScientist(request)
         # Use static avatar image instead of generating one
-        static_avatar = "/static/avatar-default.png"
-        durl['data_url'] = static_avatar
+        static_avatar = DEFAULT_AVATAR_URL
+        await mad_scientist.set_session(request=request, variable="avatar_url", data=static_avatar)
         
         return templates.TemplateResponse("chat.html", {
             "request": request,
-            "css_styles": css_styles,
             "brain_model": "Demo Mode",
             "app_name": app_name,
             "message": "What are the main applications of quantum computing?",
@@ -767,9 +482,98 @@ However, they're still experimental - requiring near-absolute zero temperatures
 What aspect interests you most?"""
         })
     except Exception as e:
-        logger.error(f"Error in demo route: {str(e)}")
+        logger.error("Error in demo route: %s", e)
         return HTMLResponse(content=f"<h1>Demo Error: {str(e)}</h1>", status_code=500)
 
+@app.get("/avatars/{avatar_id}.png")
+async def get_avatar_image(request: Request, avatar_id: str):
+    """Serve a generated avatar. Ids are content hashes, so responses never change."""
+    if not is_avatar_id(avatar_id):
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    etag = f'"{avatar_id}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+
+    # The client's copy is necessarily current, so skip loading the image
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+
+    image_data = await load_avatar(avatar_id)
+    if image_data is None:
+        logger.warning("Avatar not found: %s", avatar_id)
+        raise HTTPException(status_code=404, detail="Avatar not found")
+    return Response(content=image_data, media_type="image/png", headers=headers)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rates and sizes of this worker's caches and how many upstream calls were coalesced."""
+    return {
+        "avatar_images": avatar_store.stats(),
+        "avatar_requests": avatar_cache.stats(),
+        "responses": response_cache.stats(),
+        "semantic": semantic_cache.stats() if semantic_cache is not None else None,
+        "coalesced": {"avatar": avatar_flight.stats(), "chat": chat_flight.stats()},
+    }
+
+@app.get("/upstream/stats")
+async def upstream_stats():
+    """Queue depth and wait times, breaker states, retries, hedge win rates and avatar jobs for this worker."""
+    return {"scheduler": upstream_scheduler.stats(), "resilience": resilience.stats(), "avatar_jobs": avatar_jobs.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus metrics for this worker: request, upstream and event-loop latency, cache and queue state."""
+    SESSION_STORE_SESSIONS.set(await session_store.size())
+    return Response(content=render_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+def _require_admin(request: Request) -> None:
+    """Admin endpoints need ``Authorization: Bearer <ADMIN_TOKEN>`` and do not exist without a token."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    if not authorization.startswith("Bearer ") or not is_admin_token(authorization[len("Bearer "):]):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+@app.get("/admin/profile", response_class=PlainTextResponse, include_in_schema=False)
+async def admin_profile(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    include_idle: bool = Query(False),
+):
+    """
+    Sample every worker's event loop for ``seconds`` and return collapsed stacks.
+
+    Feed the output to flamegraph.pl or speedscope. Requires ``Authorization: Bearer <ADMIN_TOKEN>``.
+    """
+    _require_admin(request)
+    logger.info("Profiling all workers for %ss", seconds)
+    try:
+        counts, workers = await profile_coordinator.profile(seconds, include_idle=include_idle)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapse(counts), headers={
+        "X-Profile-Workers": ",".join(workers),
+        "X-Profile-Samples": str(sum(counts.values())),
+    })
+
+@app.post("/admin/avatars/batch", include_in_schema=False)
+async def admin_avatar_batch(request: Request, batch: AvatarBatch):
+    """
+    Pre-render every prompt x model x seed combination into the avatar store.
+
+    Streams one JSON line per item as it finishes (status, avatar URL or error,
+    seconds taken), then a summary line. Requires ``Authorization: Bearer <ADMIN_TOKEN>``.
+    """
+    _require_admin(request)
+    # Check the batch before the response starts, so a bad one gets a proper status
+    batch.items()
+
+    async def lines():
+        async for result in run_batch(batch):
+            yield json.dumps(result) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint for Docker and load balancers."""
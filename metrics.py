@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from dotenv import load_dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from logging_config import LOGGER_NAMESPACE, get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Seconds between event-loop lag samples
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+# Metric names are <namespace>_<subsystem>_<name>, where the subsystem is the module
+# whose logger (<namespace>.<module>) reports on the same events
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "request_duration_seconds", "Time to serve a request, by route template",
+    ["method", "route", "status"], namespace=LOGGER_NAMESPACE, subsystem="http", buckets=LATENCY_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "response_bytes", "Response body size, by route template",
+    ["route"], namespace=LOGGER_NAMESPACE, subsystem="http", buckets=SIZE_BUCKETS,
+)
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "request_duration_seconds", "Duration of each upstream model call, including every retry and hedge",
+    ["mid", "status"], namespace=LOGGER_NAMESPACE, subsystem="upstream", buckets=LATENCY_BUCKETS,
+)
+UPSTREAM_REQUEST_BYTES = Histogram(
+    "request_bytes", "JSON body size sent to an upstream model",
+    ["mid"], namespace=LOGGER_NAMESPACE, subsystem="upstream", buckets=SIZE_BUCKETS,
+)
+UPSTREAM_RESPONSE_BYTES = Histogram(
+    "response_bytes", "Body size received from an upstream model",
+    ["mid"], namespace=LOGGER_NAMESPACE, subsystem="upstream", buckets=SIZE_BUCKETS,
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    "in_flight", "Upstream model calls currently open",
+    ["mid"], namespace=LOGGER_NAMESPACE, subsystem="upstream",
+)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "lag_seconds", "How late the event loop woke a sleeping task",
+    namespace=LOGGER_NAMESPACE, subsystem="event_loop", buckets=LAG_BUCKETS,
+)
+SESSION_STORE_SESSIONS = Gauge(
+    "sessions", "Live sessions in the session store, sampled at scrape time",
+    namespace=LOGGER_NAMESPACE, subsystem="session_store",
+)
+
+
+def _name(subsystem: str, name: str) -> str:
+    return f"{LOGGER_NAMESPACE}_{subsystem}_{name}"
+
+
+# Endpoint -> route template, filled the first time each endpoint is seen
+_route_templates: Dict[Any, str] = {}
+
+
+def route_template(scope: Scope) -> str:
+    """
+    Return the template of the route that served a request, e.g. ``/avatars/{avatar_id}.png``.
+
+    The router leaves the matched endpoint in the scope; it is mapped back to its
+    path template. Paths that matched no route share ``unmatched`` so labels stay bounded.
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    route = _route_templates.get(endpoint)
+    if route is None:
+        for candidate in scope["app"].routes:
+            key = getattr(candidate, "endpoint", None) or getattr(candidate, "app", None)
+            _route_templates.setdefault(key, candidate.path)
+        route = _route_templates.get(endpoint, "unmatched")
+    return route
+
+
+class MetricsMiddleware:
+    """
+    Record latency and response size per request, labelled by route template.
+
+    A plain ASGI middleware, so streaming responses pass through untouched and
+    the cost per request is two clock reads and two histogram updates.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_template(scope)
+            HTTP_REQUEST_SECONDS.labels(scope["method"], route, str(status)).observe(time.perf_counter() - started)
+            HTTP_RESPONSE_BYTES.labels(route).observe(size)
+
+
+class StatsCollector:
+    """
+    Export the ``stats()`` counters the caches, scheduler and breakers already keep.
+
+    Read at scrape time, so serving requests costs nothing extra.
+
+    Args:
+        caches: Cache name to its stats function
+        flights: SingleFlight instances whose coalescing to report
+        scheduler: Function returning UpstreamScheduler.stats()
+        resilience: Function returning Resilience.stats()
+    """
+
+    def __init__(
+        self,
+        caches: Dict[str, Callable[[], Optional[Dict[str, Any]]]],
+        flights: Iterable[Any],
+        scheduler: Callable[[], Dict[str, Any]],
+        resilience: Callable[[], Dict[str, Any]],
+    ):
+        self.caches = caches
+        self.flights = list(flights)
+        self.scheduler = scheduler
+        self.resilience = resilience
+
+    def collect(self) -> Iterator[Metric]:
+        yield from self._caches()
+        yield from self._flights()
+        yield from self._scheduler()
+        yield from self._resilience()
+
+    def _caches(self) -> Iterator[Metric]:
+        hits = CounterMetricFamily(_name("cache", "hits"), "Cache lookups answered from the cache", labels=["cache"])
+        misses = CounterMetricFamily(_name("cache", "misses"), "Cache lookups that fell through", labels=["cache"])
+        ratio = GaugeMetricFamily(_name("cache", "hit_ratio"), "Hits over lookups since start", labels=["cache"])
+        items = GaugeMetricFamily(_name("cache", "items"), "Entries held in memory", labels=["cache"])
+        for name, stats_fn in self.caches.items():
+            stats = stats_fn()
+            if stats is None:
+                continue
+            # Tiered caches split hits by tier and count entries per tier
+            hit_count = stats.get("hits", stats.get("memory_hits", 0) + stats.get("disk_hits", 0))
+            item_count = stats.get("items", stats.get("memory_items", 0))
+            if isinstance(item_count, dict):
+                item_count = sum(item_count.values())
+            lookups = hit_count + stats["misses"]
+            hits.add_metric([name], hit_count)
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], hit_count / lookups if lookups else 0.0)
+            items.add_metric([name], item_count)
+        yield from (hits, misses, ratio, items)
+
+    def _flights(self) -> Iterator[Metric]:
+        calls = CounterMetricFamily(_name("singleflight", "calls"), "Calls made through the coalescer", labels=["flight"])
+        shared = CounterMetricFamily(_name("singleflight", "shared"), "Calls that joined one already in flight", labels=["flight"])
+        for flight in self.flights:
+            stats = flight.stats()
+            calls.add_metric([flight.name], stats["calls"])
+            shared.add_metric([flight.name], stats["shared"])
+        yield from (calls, shared)
+
+    def _scheduler(self) -> Iterator[Metric]:
+        active = GaugeMetricFamily(_name("scheduler", "active"), "Upstream slots held", labels=["mid"])
+        queued = GaugeMetricFamily(_name("scheduler", "queued"), "Calls waiting for a slot", labels=["mid"])
+        admitted = CounterMetricFamily(_name("scheduler", "admitted"), "Calls given a slot", labels=["mid"])
+        rejected = CounterMetricFamily(_name("scheduler", "rejected"), "Calls turned away or timed out", labels=["mid"])
+        wait = GaugeMetricFamily(_name("scheduler", "wait_p95_seconds"), "p95 of recent queue waits", labels=["mid"])
+        for mid, stats in self.scheduler()["models"].items():
+            active.add_metric([mid], stats["active"])
+            queued.add_metric([mid], stats["queued"])
+            admitted.add_metric([mid], stats["admitted"])
+            rejected.add_metric([mid], stats["rejected"])
+            wait.add_metric([mid], stats["wait_p95"])
+        yield from (active, queued, admitted, rejected, wait)
+
+    def _resilience(self) -> Iterator[Metric]:
+        state = GaugeMetricFamily(_name("resilience", "breaker_state"), "1 for the breaker's current state", labels=["mid", "state"])
+        trips = CounterMetricFamily(_name("resilience", "breaker_trips"), "Times the breaker opened", labels=["mid"])
+        retries = CounterMetricFamily(_name("resilience", "retries"), "Upstream calls retried", labels=["mid"])
+        hedges = CounterMetricFamily(_name("resilience", "hedges"), "Hedge requests sent", labels=["mid"])
+        wins = CounterMetricFamily(_name("resilience", "hedge_wins"), "Hedge requests that answered first", labels=["mid"])
+        skipped = CounterMetricFamily(_name("resilience", "hedges_skipped"), "Hedges not sent for lack of a free upstream slot", labels=["mid"])
+        for mid, stats in self.resilience().items():
+            state.add_metric([mid, stats["breaker_state"]], 1)
+            trips.add_metric([mid], stats["breaker_trips"])
+            retries.add_metric([mid], stats["retries"])
+            hedges.add_metric([mid], stats["hedges"])
+            wins.add_metric([mid], stats["hedge_wins"])
+            skipped.add_metric([mid], stats["hedges_skipped"])
+        yield from (state, trips, retries, hedges, wins, skipped)
+
+
+def register_stats_collector(collector: StatsCollector) -> None:
+    REGISTRY.register(collector)
+
+
+def render_metrics() -> bytes:
+    """Serialize every registered metric in the Prometheus text format."""
+    return generate_latest(REGISTRY)
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL) -> None:
+    """
+    Sample event-loop lag until cancelled.
+
+    Sleeps for ``interval`` and records how much later than that it woke up:
+    time the loop spent running other callbacks, i.e. blocking work.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = loop.time() - started - interval
+        EVENT_LOOP_LAG_SECONDS.observe(max(lag, 0.0))
+        if lag > 0.5:
+            logger.warning("Event loop blocked for %.2fs", lag)
+
@@ -0,0 +1,202 @@
+# Local stand-in for the Workers AI ``/run/{mid}`` API, for offline load and latency testing.
+#
+# Start it and point the app at it:
+#
+#     uvicorn mock_upstream:app --port 8787
+#     API_BASE_URL=http://127.0.0.1:8787/run/ uvicorn main:app
+#
+# Text models answer ``{"result": {"response": ...}}``, or server-sent events when
+# the body has ``"stream": true``. Image models answer raw PNG bytes that depend
+# only on the model id and request body. Latency, error rates and payload sizes are
+# read from MOCK_* environment variables and can be changed at runtime through
+# ``/mock/config``.
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import zlib
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Model ids containing any of these are treated as image models
+IMAGE_MODEL_HINTS = ("stable-diffusion", "dreamshaper", "flux", "lcm")
+
+_VOCABULARY = (
+    "hypothesis experiment quantum entropy catalyst molecule particle theory evidence observe "
+    "measure variable control reaction energy photon electron gravity spectrum equation "
+    "precisely indeed however therefore consider remarkable ambiguous definitive rephrase question"
+).split()
+
+app = FastAPI(title="Mock Workers AI")
+
+
+class MockConfig:
+    """Behaviour of the mock, one field per MOCK_* environment variable."""
+
+    def __init__(self):
+        # Median response latency; "fixed", "uniform" (0..2x median) or "lognormal"
+        self.latency_ms = float(os.getenv("MOCK_LATENCY_MS", "300"))
+        self.image_latency_ms = float(os.getenv("MOCK_IMAGE_LATENCY_MS", "1500"))
+        self.latency_distribution = os.getenv("MOCK_LATENCY_DISTRIBUTION", "lognormal")
+        self.latency_sigma = float(os.getenv("MOCK_LATENCY_SIGMA", "0.5"))
+        # Fractions of calls answered with a 500 or a 429
+        self.error_rate = float(os.getenv("MOCK_ERROR_RATE", "0"))
+        self.rate_limit_rate = float(os.getenv("MOCK_RATE_LIMIT_RATE", "0"))
+        # Words per text reply, and delay between streamed words
+        self.response_words = int(os.getenv("MOCK_RESPONSE_WORDS", "120"))
+        self.token_delay_ms = float(os.getenv("MOCK_TOKEN_DELAY_MS", "20"))
+        # Square PNG side in pixels; noise makes the image compress like a real one
+        self.image_size = int(os.getenv("MOCK_IMAGE_SIZE", "512"))
+        self.image_noise = float(os.getenv("MOCK_IMAGE_NOISE", "0.5"))
+        seed = os.getenv("MOCK_SEED")
+        self.random = random.Random(int(seed) if seed else None)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: v for k, v in vars(self).items() if k != "random"}
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for key, value in values.items():
+            current = getattr(self, key, None)
+            if key == "random" or current is None:
+                raise ValueError(f"Unknown mock setting: {key}")
+            setattr(self, key, type(current)(value))
+        _render_png.cache_clear()
+
+
+config = MockConfig()
+
+
+def is_image_model(mid: str) -> bool:
+    return any(hint in mid for hint in IMAGE_MODEL_HINTS)
+
+
+def sample_latency(median_ms: float) -> float:
+    """Draw one response latency in seconds from the configured distribution."""
+    if config.latency_distribution == "fixed":
+        latency = median_ms
+    elif config.latency_distribution == "uniform":
+        latency = config.random.uniform(0, 2 * median_ms)
+    else:
+        latency = median_ms * math.exp(config.random.gauss(0, config.latency_sigma))
+    return max(latency, 0.0) / 1000
+
+
+def _seed(mid: str, body: Dict[str, Any]) -> int:
+    canonical = json.dumps({"mid": mid, "body": body}, sort_keys=True)
+    return int.from_bytes(hashlib.sha256(canonical.encode("utf-8")).digest()[:8], "big")
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+@lru_cache(maxsize=64)
+def _render_png(seed: int, size: int, noise: float) -> bytes:
+    """Render a seeded gradient with seeded noise as an RGB PNG using only the standard library."""
+    rng = random.Random(seed)
+    base = [rng.randrange(256) for _ in range(6)]
+    amplitude = int(255 * noise)
+    rows = []
+    for y in range(size):
+        shade = y / max(size - 1, 1)
+        pixel = bytes(int(base[i] * (1 - shade) + base[i + 3] * shade) for i in range(3))
+        row = bytearray(pixel * size)
+        if amplitude:
+            jitter = rng.randbytes(size * 3)
+            for i in range(0, len(row), 7):
+                row[i] = (row[i] + jitter[i] % (amplitude + 1)) & 0xFF
+        rows.append(b"\x00" + bytes(row))
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", header)
+        + _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 6))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def render_png(mid: str, body: Dict[str, Any]) -> bytes:
+    return _render_png(_seed(mid, body), config.image_size, config.image_noise)
+
+
+def render_text(mid: str, body: Dict[str, Any]) -> str:
+    rng = random.Random(_seed(mid, body))
+    words = [rng.choice(_VOCABULARY) for _ in range(config.response_words)]
+    return "I am the Mad Scientist. " + " ".join(words).capitalize() + "."
+
+
+def _failure() -> Optional[Response]:
+    roll = config.random.random()
+    if roll < config.error_rate:
+        return JSONResponse(
+            {"result": None, "success": False, "errors": [{"code": 3040, "message": "Mock internal error"}], "messages": []},
+            status_code=500,
+        )
+    if roll < config.error_rate + config.rate_limit_rate:
+        return JSONResponse(
+            {"result": None, "success": False, "errors": [{"code": 3036, "message": "Mock rate limit"}], "messages": []},
+            status_code=429,
+            headers={"Retry-After": "1"},
+        )
+    return None
+
+
+@app.post("/run/{mid:path}")
+async def run(mid: str, request: Request):
+    body = await request.json()
+    image = is_image_model(mid)
+    await asyncio.sleep(sample_latency(config.image_latency_ms if image else config.latency_ms))
+    failure = _failure()
+    if failure is not None:
+        return failure
+
+    if image:
+        # Rendering a large image is CPU bound, so keep it off the event loop
+        png = await asyncio.to_thread(render_png, mid, body)
+        return Response(content=png, media_type="image/png")
+
+    text = render_text(mid, {k: v for k, v in body.items() if k != "stream"})
+    if body.get("stream"):
+        async def events():
+            for i, word in enumerate(text.split(" ")):
+                yield f"data: {json.dumps({'response': word if i == 0 else ' ' + word})}\n\n"
+                await asyncio.sleep(config.token_delay_ms / 1000)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    return {"result": {"response": text}, "success": True, "errors": [], "messages": []}
+
+
+@app.get("/mock/config")
+async def get_config():
+    return config.as_dict()
+
+
+@app.post("/mock/config")
+async def set_config(request: Request):
+    """Change mock settings at runtime, e.g. ``{"error_rate": 0.1, "latency_ms": 800}``."""
+    try:
+        config.update(await request.json())
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"detail": str(e)}, status_code=400)
+    logger.info("Mock config updated: %s", config.as_dict())
+    return config.as_dict()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("MOCK_PORT", "8787")))
@@ -0,0 +1,250 @@
+import json
+import os
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+from dotenv import load_dotenv
+from pydantic import BaseModel, ValidationError
+from logging_config import get_logger
+
+try:
+    import yaml
+except ImportError:  # PyYAML is only needed for YAML catalogs
+    yaml = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Optional JSON or YAML file of extra models, loaded on top of the built-in ones
+MODEL_CATALOG_PATH = os.getenv("MODEL_CATALOG_PATH", "")
+
+# Data for AI models
+models = [
+     {
+        "model": "Mad Sci Mistral-7B Instruct",
+        "description": "Mad Sci is a fine-tuned version of the Mistral-7b Instruct generative text model with 7 billion parameters",
+        "mid": "SavantofIllusions/mad_sci_mistral_instruct",
+        "name": "mad_sci_mistral_instruct",
+        "usage": "text"
+    },
+    {
+        "model": "Mistral-7b Instruct",
+        "description": "Instruct fine-tuned version of the Mistral-7b generative text model with 7 billion parameters",
+        "mid": "@cf/mistral/mistral-7b-instruct-v0.1",
+        "name": "mistral_7b_instruct",
+        "usage": "mad-sci-text"
+    },
+    {
+        "model": "Hermes 2 Pro on Mistral 7B",
+        "description": "Hermes 2 Pro on Mistral 7B is the new flagship 7B Hermes! Hermes 2 Pro is an upgraded, retrained version of Nous Hermes 2, consisting of an updated and cleaned version of the OpenHermes 2.5 Dataset, as well as a newly introduced Function Calling and JSON Mode dataset developed in-house",
+        "mid": "@hf/nousresearch/hermes-2-pro-mistral-7b",
+        "name": "hermes_2_pro_on_mistral_7b",
+        "usage": "text"
+    },
+    {
+        "model": "Dreamshaper-8 LCM",
+        "description": "Stable Diffusion model that has been fine-tuned to be better at photorealism without sacrificing range",
+        "mid": "@cf/lykon/dreamshaper-8-lcm",
+        "name": "dreamshaper_8_lcm",
+        "usage": "art",
+        # LCM needs only a few steps for a recognizable image, so previews use 4 at 256px
+        "params": {
+            "num_steps": {"min": 1, "max": 20, "default": 20, "preview": 4, "integer": True},
+            "guidance": {"min": 0, "max": 20, "default": 7.5},
+            "strength": {"min": 0, "max": 1, "default": 1},
+            "width": {"min": 256, "max": 2048, "preview": 256, "integer": True},
+            "height": {"min": 256, "max": 2048, "preview": 256, "integer": True},
+            "seed": {"min": 0, "max": 4294967295, "integer": True},
+        }
+    }
+]
+
+
+class GenerationParam(BaseModel):
+    """A generation parameter an image model accepts, with its bounds, default and preview value."""
+
+    min: float
+    max: float
+    # None: the parameter is only sent when requested, and the model's own default applies
+    default: Optional[float] = None
+    # Used instead of the default for fast previews
+    preview: Optional[float] = None
+    integer: bool = False
+
+    def coerce(self, name: str, value: Any) -> Union[int, float]:
+        """
+        Convert a request value to a number within bounds.
+
+        Raises:
+            ValueError: If the value is not a number, not whole for an integer parameter, or out of bounds
+        """
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} must be a number")
+        if self.integer:
+            if not number.is_integer():
+                raise ValueError(f"{name} must be a whole number")
+            number = int(number)
+        if not self.min <= number <= self.max:
+            raise ValueError(f"{name} must be between {self.min:g} and {self.max:g}")
+        return number
+
+
+class AI(BaseModel):
+    model: str
+    description: str
+    mid: str
+    name: str
+    usage: str
+    params: Dict[str, GenerationParam] = {}
+
+    @property
+    def has_preview(self) -> bool:
+        return any(param.preview is not None for param in self.params.values())
+
+    def generation_params(self, values: Dict[str, Any], preview: bool = False) -> Dict[str, Union[int, float]]:
+        """
+        Resolve requested generation parameters against this model's declared ones.
+
+        Requested values win; otherwise the preview value is used for previews and
+        the default for everything else. Parameters left without a value are not sent.
+
+        Args:
+            values: Requested values by parameter name; None or "" means not requested
+            preview: Resolve for a fast preview rather than full quality
+
+        Returns:
+            The parameters to send to the model
+
+        Raises:
+            ValueError: If a parameter is unknown to the model or its value is invalid
+        """
+        unknown = sorted(name for name, value in values.items() if name not in self.params and value not in (None, ""))
+        if unknown:
+            raise ValueError(f"{self.model} does not accept {', '.join(unknown)}")
+        resolved = {}
+        for name, param in self.params.items():
+            value = values.get(name)
+            if value is None or value == "":
+                value = param.preview if preview and param.preview is not None else param.default
+            if value is not None:
+                resolved[name] = param.coerce(name, value)
+        return resolved
+
+
+class ModelRegistry:
+    """
+    Validated model catalog indexed by display name, short name and model id.
+
+    Entries are validated into ``AI`` instances once, when added, and every lookup
+    is a dict access. Adding a model whose short name is already registered
+    replaces the old entry in all indexes.
+    """
+
+    def __init__(self, entries: Iterable[Union[AI, Dict[str, Any]]] = ()):
+        self._by_model: Dict[str, AI] = {}
+        self._by_name: Dict[str, AI] = {}
+        self._by_mid: Dict[str, AI] = {}
+        for entry in entries:
+            self.add(entry)
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __iter__(self) -> Iterator[AI]:
+        return iter(self._by_name.values())
+
+    def __contains__(self, model: str) -> bool:
+        return model in self._by_model
+
+    def add(self, entry: Union[AI, Dict[str, Any]]) -> AI:
+        """
+        Register a model, replacing any existing model with the same short name.
+
+        Args:
+            entry: An ``AI`` instance or a dict with its fields
+
+        Returns:
+            The validated model
+
+        Raises:
+            ValidationError: If a dict entry is missing fields or has the wrong types
+        """
+        ai = entry if isinstance(entry, AI) else AI(**entry)
+        old = self._by_name.get(ai.name)
+        if old is not None:
+            self._by_model.pop(old.model, None)
+            self._by_mid.pop(old.mid, None)
+        self._by_model[ai.model] = ai
+        self._by_name[ai.name] = ai
+        self._by_mid[ai.mid] = ai
+        return ai
+
+    def load_file(self, path: str) -> int:
+        """
+        Add every model listed in a JSON or YAML catalog file.
+
+        The file holds either a list of model entries or a mapping with a
+        ``models`` list. Invalid entries are logged and skipped.
+
+        Args:
+            path: Path to a .json, .yaml or .yml file
+
+        Returns:
+            The number of models added
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith((".yaml", ".yml")):
+                if yaml is None:
+                    raise RuntimeError(f"PyYAML is required to load {path}")
+                try:
+                    data = yaml.safe_load(f)
+                except yaml.YAMLError as e:
+                    raise ValueError(f"Invalid YAML in {path}: {str(e)}") from e
+            else:
+                data = json.load(f)
+        entries = data.get("models", []) if isinstance(data, dict) else data or []
+        added = 0
+        for entry in entries:
+            try:
+                self.add(entry)
+                added += 1
+            except (ValidationError, TypeError) as e:
+                logger.error("Skipping invalid model entry in %s: %s", path, e)
+        logger.info("Loaded %s models from %s", added, path)
+        return added
+
+    def get_by_model(self, model: str) -> Optional[AI]:
+        """Look up a model by its display name, e.g. "Dreamshaper-8 LCM"."""
+        return self._by_model.get(model)
+
+    def get_by_name(self, name: str) -> Optional[AI]:
+        """Look up a model by its short name, e.g. "dreamshaper_8_lcm"."""
+        return self._by_name.get(name)
+
+    def get_by_mid(self, mid: str) -> Optional[AI]:
+        return self._by_mid.get(mid)
+
+    def resolve_mid(self, model: str) -> Optional[str]:
+        """Resolve a display name straight to the model id sent upstream."""
+        ai = self._by_model.get(model)
+        return ai.mid if ai is not None else None
+
+    def by_usage(self, usage: str) -> List[AI]:
+        return [ai for ai in self._by_name.values() if ai.usage == usage]
+
+
+def _build_registry() -> ModelRegistry:
+    registry = ModelRegistry(models)
+    if MODEL_CATALOG_PATH:
+        try:
+            registry.load_file(MODEL_CATALOG_PATH)
+        except (OSError, ValueError, RuntimeError) as e:
+            logger.error("Failed to load model catalog %s: %s", MODEL_CATALOG_PATH, e)
+    return registry
+
+
+registry = _build_registry()
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Bearer token for /admin endpoints and the X-Profile header; admin features are off when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+# Seconds between stack samples; 0.01 costs well under 1% of one core
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.01"))
+# Single requests last milliseconds, so X-Profile samples much more often
+PROFILER_REQUEST_INTERVAL = float(os.getenv("PROFILER_REQUEST_INTERVAL", "0.001"))
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+# Shared by all workers on a host: profile requests are posted here and results collected
+PROFILER_DIR = os.getenv("PROFILER_DIR", "cache/profiles")
+PROFILER_POLL_INTERVAL = float(os.getenv("PROFILER_POLL_INTERVAL", "1"))
+
+# Samples whose innermost frame is the selector wait are the loop sitting idle
+_IDLE_FRAMES = frozenset({"selectors.py:select"})
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+class StackSampler:
+    """
+    Periodically capture the Python stack of one thread from a background thread.
+
+    Sampling with ``sys._current_frames`` needs no tracing hooks, so the profiled
+    code runs at full speed; the cost is one stack walk per interval. Stacks are
+    counted in collapsed form (``outer;inner;leaf``), ready for flamegraph tools.
+    While the sampled thread is busy, the sampler only runs when it is handed the
+    GIL, so resolution is bounded by ``sys.getswitchinterval()`` (5ms by default).
+
+    Args:
+        thread_id: The thread to sample, normally the one running the event loop
+        interval: Seconds between samples
+        include_idle: Keep samples taken while the event loop waits for I/O
+        loop: With ``task``, only count samples taken while that task is running
+        task: The asyncio task to restrict samples to
+    """
+
+    def __init__(
+        self,
+        thread_id: int,
+        interval: float = PROFILER_INTERVAL,
+        include_idle: bool = False,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        task: Optional["asyncio.Task[Any]"] = None,
+    ):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.include_idle = include_idle
+        self.loop = loop
+        self.task = task
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._labels: Dict[Any, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.counts
+
+    def _label(self, code: Any) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            if self.task is not None and asyncio.current_task(self.loop) is not self.task:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            self.samples += 1
+            if not self.include_idle and stack[0] in _IDLE_FRAMES:
+                continue
+            self.counts[";".join(reversed(stack))] += 1
+
+
+def collapse(counts: Counter) -> str:
+    """Render stack counts in the collapsed format read by flamegraph.pl and speedscope."""
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def parse_collapsed(text: str) -> Counter:
+    counts: Counter = Counter()
+    for line in text.splitlines():
+        stack, _, count = line.rpartition(" ")
+        if stack and count.isdigit():
+            counts[stack] += int(count)
+    return counts
+
+
+def summarize(counts: Counter, top: int = 5) -> List[Tuple[str, int]]:
+    """The ``top`` functions by self samples, i.e. where the CPU time was actually spent."""
+    leaves: Counter = Counter()
+    for stack, count in counts.items():
+        leaves[stack.rpartition(";")[2]] += count
+    return leaves.most_common(top)
+
+
+class ProfileCoordinator:
+    """
+    Run one profiling window in every worker process on the host.
+
+    The worker serving the admin request writes a request file to PROFILER_DIR.
+    Every worker, including that one, polls the directory, samples its own event
+    loop for the window and writes its stacks back; the requesting worker then
+    merges them. Workers that share no filesystem are not reached.
+    """
+
+    def __init__(self, directory: str = PROFILER_DIR, poll_interval: float = PROFILER_POLL_INTERVAL):
+        self.requests_dir = os.path.join(directory, "requests")
+        self.results_dir = os.path.join(directory, "results")
+        self.poll_interval = poll_interval
+        self._seen: Dict[str, float] = {}
+        self._busy = False
+        self._tasks: Set["asyncio.Task[None]"] = set()
+
+    async def watch(self) -> None:
+        """Poll for profile requests until cancelled; started once per worker."""
+        os.makedirs(self.requests_dir, exist_ok=True)
+        os.makedirs(self.results_dir, exist_ok=True)
+        while True:
+            try:
+                for request_id, spec in await asyncio.to_thread(self._pending):
+                    task = asyncio.create_task(self._serve(request_id, spec))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+            except OSError as e:
+                logger.warning("Profile request poll failed: %s", e)
+            await asyncio.sleep(self.poll_interval)
+
+    def _pending(self) -> List[Tuple[str, Dict[str, Any]]]:
+        now = time.time()
+        found = []
+        for name in os.listdir(self.requests_dir):
+            request_id = name[:-5]
+            if not name.endswith(".json") or request_id in self._seen:
+                continue
+            try:
+                with open(os.path.join(self.requests_dir, name)) as f:
+                    spec = json.load(f)
+            except (OSError, ValueError):
+                continue
+            self._seen[request_id] = now
+            # Requests older than their window (e.g. left by a crashed worker) are skipped
+            if now - spec["created"] < spec["seconds"]:
+                found.append((request_id, spec))
+        self._seen = {k: v for k, v in self._seen.items() if now - v < 600}
+        return found
+
+    async def _serve(self, request_id: str, spec: Dict[str, Any]) -> None:
+        remaining = spec["created"] + spec["seconds"] - time.time()
+        sampler = StackSampler(threading.get_ident(), spec["interval"], spec["include_idle"]).start()
+        try:
+            await asyncio.sleep(max(remaining, 0))
+        finally:
+            counts = sampler.stop()
+        path = os.path.join(self.results_dir, f"{request_id}.{os.getpid()}.txt")
+        await asyncio.to_thread(_write, path, collapse(counts))
+        logger.info("Profiled %s samples for request %s", sampler.samples, request_id)
+
+    async def profile(self, seconds: float, interval: float = PROFILER_INTERVAL, include_idle: bool = False) -> Tuple[Counter, List[str]]:
+        """
+        Profile every worker for ``seconds`` and merge their stacks.
+
+        Returns:
+            The merged stack counts and the pids of the workers that reported
+
+        Raises:
+            RuntimeError: If a profile is already being collected by this worker
+        """
+        if self._busy:
+            raise RuntimeError("A profile is already running")
+        self._busy = True
+        try:
+            request_id = uuid.uuid4().hex
+            spec = {"created": time.time(), "seconds": seconds, "interval": interval, "include_idle": include_idle}
+            request_path = os.path.join(self.requests_dir, f"{request_id}.json")
+            await asyncio.to_thread(_write, request_path, json.dumps(spec))
+            # Every worker notices the request within one poll and stops at the window's end
+            await asyncio.sleep(seconds + 2 * self.poll_interval + 0.5)
+            counts, workers = await asyncio.to_thread(self._collect, request_id)
+            await asyncio.to_thread(_remove, request_path)
+            return counts, workers
+        finally:
+            self._busy = False
+
+    def _collect(self, request_id: str) -> Tuple[Counter, List[str]]:
+        counts: Counter = Counter()
+        workers = []
+        for name in os.listdir(self.results_dir):
+            if not (name.startswith(request_id + ".") and name.endswith(".txt")):
+                continue
+            path = os.path.join(self.results_dir, name)
+            with open(path) as f:
+                counts.update(parse_collapsed(f.read()))
+            workers.append(name.split(".")[1])
+            _remove(path)
+        return counts, workers
+
+
+def _write(path: str, data: str) -> None:
+    # Write then rename, so readers never see a partial file
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ProfilingMiddleware:
+    """
+    Profile single requests that send ``X-Profile: <ADMIN_TOKEN>``.
+
+    Only samples taken while the request's own task holds the event loop are
+    counted, so concurrent traffic does not leak into the profile. The summary
+    (on-CPU estimate and hottest functions) is logged when the request finishes,
+    with the collapsed stacks attached as the ``profile`` field for JSON logs.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._active = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or self._active or not is_admin_token(Headers(scope=scope).get("x-profile")):
+            await self.app(scope, receive, send)
+            return
+
+        # One at a time: each profiled request adds a sampling thread
+        self._active = True
+        started = time.perf_counter()
+        sampler = StackSampler(
+            threading.get_ident(), PROFILER_REQUEST_INTERVAL, loop=asyncio.get_running_loop(), task=asyncio.current_task()
+        ).start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            counts = sampler.stop()
+            self._active = False
+            elapsed = time.perf_counter() - started
+            cpu = sum(counts.values()) * sampler.interval
+            hottest = ", ".join(f"{frame} {count}" for frame, count in summarize(counts))
+            logger.info(
+                "Profile of %s %s: %.3fs wall, ~%.3fs on the event loop; hottest: %s",
+                scope["method"], scope["path"], elapsed, cpu, hottest or "no samples",
+                extra={"profile": collapse(counts)},
+            )
+
+
+profile_coordinator = ProfileCoordinator()
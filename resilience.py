@@ -0,0 +1,302 @@
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from logging_config import get_logger
+from scheduler import upstream_scheduler
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Retries after the first attempt, with full-jitter exponential backoff
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_RETRY_BASE_DELAY = float(os.getenv("UPSTREAM_RETRY_BASE_DELAY", "0.25"))
+UPSTREAM_RETRY_MAX_DELAY = float(os.getenv("UPSTREAM_RETRY_MAX_DELAY", "4"))
+# Send a second copy of a slow call once it exceeds the model's recent p95 latency
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "false").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+# Consecutive failures that open a model's circuit, and seconds before it is tried again
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a model whose circuit breaker is open."""
+
+    def __init__(self, mid: str, retry_after: float):
+        super().__init__(f"Circuit open for {mid}, retry in {retry_after:.0f}s")
+        self.mid = mid
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker: opens after ``threshold`` consecutive failures.
+
+    While open, calls fail immediately. After ``cooldown`` seconds one trial call
+    is let through (half open); its success closes the circuit, its failure
+    opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int = BREAKER_FAILURE_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._trial = False
+
+    def retry_after(self) -> float:
+        return max(self.opened_at + self.cooldown - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        if self.state == OPEN and self.retry_after() == 0.0:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial = False
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state != OPEN:
+                self.trips += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        # A trial call that ended without a verdict (e.g. cancelled) frees the next one
+        self._trial = False
+
+
+class _ModelHealth:
+    __slots__ = ("breaker", "latencies", "retries", "hedges", "hedge_wins", "hedges_skipped")
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+
+    def p95(self) -> Optional[float]:
+        if len(self.latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95)]
+
+
+class Resilience:
+    """Retries, hedging and circuit breaking around upstream model calls, tracked per model."""
+
+    def __init__(
+        self,
+        retries: int = UPSTREAM_RETRIES,
+        base_delay: float = UPSTREAM_RETRY_BASE_DELAY,
+        max_delay: float = UPSTREAM_RETRY_MAX_DELAY,
+        hedge: bool = UPSTREAM_HEDGE,
+    ):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge = hedge
+        self._models: Dict[str, _ModelHealth] = {}
+
+    def _health(self, mid: str) -> _ModelHealth:
+        health = self._models.get(mid)
+        if health is None:
+            health = self._models[mid] = _ModelHealth()
+        return health
+
+    def _admit(self, mid: str) -> _ModelHealth:
+        health = self._health(mid)
+        if not health.breaker.allow():
+            raise CircuitOpen(mid, health.breaker.retry_after())
+        return health
+
+    def _backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after and retry_after.isdigit() and float(retry_after) <= self.max_delay:
+            return float(retry_after)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(
+        self,
+        mid: str,
+        fn: Callable[[], Awaitable[httpx.Response]],
+        idempotent: bool = True,
+        hedge: bool = False,
+    ) -> httpx.Response:
+        """
+        Call a model, retrying and hedging where safe.
+
+        Network errors and 429/5xx answers are retried with jittered exponential
+        backoff if the call is idempotent. The last answer is returned as is, so
+        callers keep their own status handling.
+
+        Args:
+            mid: The model id, used for the breaker and latency tracking
+            fn: Coroutine function making one upstream request
+            idempotent: Whether repeating the request is safe
+            hedge: Allow a second concurrent copy once the call exceeds the model's p95;
+                the copy takes its own upstream scheduler slot and is skipped if none is free
+
+        Returns:
+            The upstream response
+
+        Raises:
+            CircuitOpen: If the model's breaker is open
+            httpx.RequestError: If every attempt failed at the network level
+        """
+        health = self._admit(mid)
+        attempts = self.retries + 1 if idempotent else 1
+        response = None
+        error: Optional[Exception] = None
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    health.retries += 1
+                    await asyncio.sleep(self._backoff(attempt - 1, response))
+                    logger.info("Retrying %s (attempt %s of %s)", mid, attempt + 1, attempts)
+                try:
+                    if hedge and self.hedge and idempotent:
+                        response = await self._hedged(mid, health, fn)
+                    else:
+                        response = await self._timed(health, fn)
+                    error = None
+                except httpx.RequestError as e:
+                    logger.warning("Upstream call to %s failed: %s", mid, e)
+                    response, error = None, e
+                    continue
+                if response.status_code not in RETRYABLE_STATUS:
+                    break
+                logger.warning("Upstream call to %s answered %s", mid, response.status_code)
+        finally:
+            health.breaker.release_trial()
+
+        if error is not None or response.status_code >= 500:
+            health.breaker.record_failure()
+            if health.breaker.state == OPEN:
+                logger.error("Circuit for %s is open for %.0fs", mid, health.breaker.cooldown)
+        else:
+            health.breaker.record_success()
+        if error is not None:
+            raise error
+        return response
+
+    @asynccontextmanager
+    async def guard(self, mid: str) -> AsyncIterator[None]:
+        """
+        Apply the circuit breaker to a call that cannot be retried, such as a stream.
+
+        Raises:
+            CircuitOpen: If the model's breaker is open
+        """
+        breaker = self._admit(mid).breaker
+        try:
+            yield
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            raise
+        except httpx.RequestError:
+            breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            breaker.release_trial()
+
+    async def _timed(self, health: _ModelHealth, fn: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        started = time.monotonic()
+        response = await fn()
+        if response.status_code < 400:
+            health.latencies.append(time.monotonic() - started)
+        return response
+
+    async def _hedged(self, mid: str, health: _ModelHealth, fn: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        delay = health.p95()
+        primary = asyncio.ensure_future(self._timed(health, fn))
+        hedge: Optional[asyncio.Future] = None
+        try:
+            if delay is None:
+                return await primary
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            # The caller's slot covers the primary only; a hedge must not push the model past its cap
+            if not upstream_scheduler.try_acquire(mid):
+                health.hedges_skipped += 1
+                return await primary
+            health.hedges += 1
+            hedge = asyncio.ensure_future(self._timed(health, fn))
+            hedge.add_done_callback(lambda _: upstream_scheduler.release(mid))
+            pending = {primary, hedge}
+            result: Optional[asyncio.Future] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # Take the first clean answer; otherwise keep whatever finished last
+                    result = task
+                    if task.exception() is None and task.result().status_code not in RETRYABLE_STATUS:
+                        if task is hedge:
+                            health.hedge_wins += 1
+                        pending = set()
+                        break
+            return result.result()
+        finally:
+            # Also reached when the caller is cancelled mid-wait, so no request outlives it
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            mid: {
+                "breaker_state": health.breaker.state,
+                "consecutive_failures": health.breaker.failures,
+                "breaker_trips": health.breaker.trips,
+                "breaker_rejected": health.breaker.rejected,
+                "retries": health.retries,
+                "hedges": health.hedges,
+                "hedge_wins": health.hedge_wins,
+                "hedge_win_rate": health.hedge_wins / health.hedges if health.hedges else 0.0,
+                "hedges_skipped": health.hedges_skipped,
+                "latency_p95": health.p95(),
+            }
+            for mid, health in self._models.items()
+        }
+
+
+resilience = Resilience()
@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # Seconds since the newest reply
+RESPONSE_CACHE_MAX_ITEMS = int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "1024"))
+# Replies kept per prompt; a random one is served so repeat visitors see some variety
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+RESPONSE_CACHE_REFRESH = os.getenv("RESPONSE_CACHE_REFRESH", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_REFRESH_AFTER = float(os.getenv("RESPONSE_CACHE_REFRESH_AFTER", "600"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Lower-case roles and collapse whitespace, so formatting-only differences share a key."""
+    return [
+        {"role": m.get("role", "user").strip().lower(), "content": _WHITESPACE.sub(" ", m.get("content", "")).strip()}
+        for m in messages
+    ]
+
+
+def response_key(mid: str, messages: List[Dict[str, str]], params: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the cache key for a chat completion.
+
+    Args:
+        mid: The model id
+        messages: The messages sent upstream
+        params: Sampling parameters sent alongside the messages
+
+    Returns:
+        A hex SHA-256 digest of the canonical request
+    """
+    canonical = json.dumps(
+        {"mid": mid, "messages": normalize_messages(messages), "params": params or {}},
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _CachedReplies:
+    __slots__ = ("replies", "updated")
+
+    def __init__(self):
+        self.replies: List[str] = []
+        self.updated = 0.0
+
+
+class ResponseCache:
+    """
+    TTL and LRU bounded cache of chat replies for prompts that do not depend on the session.
+
+    Each key holds up to ``max_variants`` replies. Once a key has been served,
+    ``maybe_refresh`` fetches another reply in the background while the key has
+    fewer than ``max_variants`` replies or its newest is older than ``refresh_after``.
+    Callers never wait on a refresh.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_items: int = RESPONSE_CACHE_MAX_ITEMS,
+        max_variants: int = RESPONSE_CACHE_VARIANTS,
+        refresh: bool = RESPONSE_CACHE_REFRESH,
+        refresh_after: float = RESPONSE_CACHE_REFRESH_AFTER,
+    ):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.max_variants = max(max_variants, 1)
+        self.refresh = refresh
+        self.refresh_after = refresh_after
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._entries: "OrderedDict[str, _CachedReplies]" = OrderedDict()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _entry(self, key: str) -> Optional[_CachedReplies]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.updated > self.ttl:
+            del self._entries[key]
+            entry = None
+        return entry
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entry(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return random.choice(entry.replies)
+
+    def set(self, key: str, reply: str) -> None:
+        entry = self._entry(key)
+        if entry is None:
+            entry = _CachedReplies()
+            self._entries[key] = entry
+        else:
+            self._entries.move_to_end(key)
+        if reply not in entry.replies:
+            entry.replies.append(reply)
+            del entry.replies[:-self.max_variants]
+        entry.updated = time.monotonic()
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def maybe_refresh(self, key: str, fetch: Callable[[], Awaitable[str]]) -> None:
+        """
+        Fetch and add another reply for ``key`` in the background if it is due.
+
+        Args:
+            key: A key that was just served from the cache
+            fetch: Coroutine function returning a fresh reply from the model
+        """
+        entry = self._entry(key)
+        if not self.refresh or entry is None or key in self._refreshing:
+            return
+        stale = time.monotonic() - entry.updated > self.refresh_after
+        if len(entry.replies) >= self.max_variants and not stale:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._refresh(key, fetch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, key: str, fetch: Callable[[], Awaitable[str]]) -> None:
+        try:
+            self.set(key, await fetch())
+            self.refreshes += 1
+            logger.debug("Refreshed cached response %s", key[:12])
+        except Exception as e:
+            logger.warning("Background refresh of cached response failed: %s", e)
+        finally:
+            self._refreshing.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "refreshes": self.refreshes,
+        }
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+response_cache = ResponseCache()
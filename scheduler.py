@@ -0,0 +1,233 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+from tracing import span
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+# Upstream calls in flight across all models, per worker process
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "16"))
+# Default cap per model, and per-model overrides as "mid=limit,mid=limit"
+UPSTREAM_MODEL_CONCURRENCY = int(os.getenv("UPSTREAM_MODEL_CONCURRENCY", "8"))
+UPSTREAM_MODEL_LIMITS = os.getenv("UPSTREAM_MODEL_LIMITS", "")
+# Waiting calls allowed per model before new ones are turned away
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "64"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "30"))
+
+# Lower values are served first
+PRIORITY_CHAT = 0
+PRIORITY_IMAGE = 1
+PRIORITY_BACKGROUND = 2
+_PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_IMAGE: "image", PRIORITY_BACKGROUND: "background"}
+
+
+class SchedulerFull(Exception):
+    """Raised when a call cannot be admitted, or waited longer than the queue timeout."""
+
+    def __init__(self, mid: str, reason: str):
+        super().__init__(f"Upstream queue for {mid} {reason}")
+        self.mid = mid
+        self.reason = reason
+
+
+def parse_model_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        mid, _, limit = item.strip().rpartition("=")
+        if mid and limit.isdigit():
+            limits[mid] = int(limit)
+    return limits
+
+
+class _Waiter:
+    __slots__ = ("mid", "future", "enqueued")
+
+    def __init__(self, mid: str):
+        self.mid = mid
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class _ModelState:
+    __slots__ = ("limit", "active", "queued", "admitted", "rejected", "waits")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.waits: Deque[float] = deque(maxlen=1000)
+
+
+class UpstreamScheduler:
+    """
+    Admission control and ordering for upstream model calls.
+
+    A call holds a slot from ``slot()`` for its whole duration. Slots are limited
+    globally and per model. When none is free the call waits in a bounded per-model
+    queue; a full queue raises SchedulerFull immediately. Free slots go to the
+    lowest priority value first, and within a priority to sessions in round-robin
+    order, so one session's burst cannot crowd out everyone else.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = UPSTREAM_CONCURRENCY,
+        model_concurrency: int = UPSTREAM_MODEL_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None,
+        queue_size: int = UPSTREAM_QUEUE_SIZE,
+        queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT,
+    ):
+        self.concurrency = concurrency
+        self.model_concurrency = model_concurrency
+        self.model_limits = model_limits or {}
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._models: Dict[str, _ModelState] = {}
+        # priority -> session -> waiters, with sessions kept in round-robin order
+        self._queues: Dict[int, "OrderedDict[str, Deque[_Waiter]]"] = {}
+
+    def _model(self, mid: str) -> _ModelState:
+        state = self._models.get(mid)
+        if state is None:
+            state = self._models[mid] = _ModelState(self.model_limits.get(mid, self.model_concurrency))
+        return state
+
+    @asynccontextmanager
+    async def slot(self, mid: str, priority: int = PRIORITY_CHAT, session: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Hold an upstream slot for ``mid`` for the duration of the block.
+
+        Args:
+            mid: The model id being called
+            priority: One of PRIORITY_CHAT, PRIORITY_IMAGE or PRIORITY_BACKGROUND
+            session: Session id used for fair sharing; anonymous calls share one turn
+
+        Raises:
+            SchedulerFull: If the model's queue is full or the wait times out
+        """
+        await self._acquire(mid, priority, session or "anonymous")
+        try:
+            yield
+        finally:
+            self.release(mid)
+
+    async def _acquire(self, mid: str, priority: int, session: str) -> None:
+        state = self._model(mid)
+        if self.active < self.concurrency and state.active < state.limit and not state.queued:
+            self._grant(state)
+            state.waits.append(0.0)
+            return
+        if state.queued >= self.queue_size:
+            state.rejected += 1
+            raise SchedulerFull(mid, "is full")
+
+        waiter = _Waiter(mid)
+        self._queues.setdefault(priority, OrderedDict()).setdefault(session, deque()).append(waiter)
+        state.queued += 1
+        try:
+            with span("upstream.queue", **{"upstream.model": mid, "upstream.priority": _PRIORITY_NAMES.get(priority, priority)}):
+                await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the wait ended; hand the slot back
+                self.release(mid)
+            else:
+                waiter.future.cancel()
+                self._remove(priority, session, waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                state.rejected += 1
+                raise SchedulerFull(mid, f"wait exceeded {self.queue_timeout:.0f}s")
+            raise
+        state.waits.append(time.monotonic() - waiter.enqueued)
+
+    def _grant(self, state: _ModelState) -> None:
+        self.active += 1
+        state.active += 1
+        state.admitted += 1
+
+    def _remove(self, priority: int, session: str, waiter: _Waiter) -> None:
+        sessions = self._queues.get(priority, {})
+        waiters = sessions.get(session)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            self._model(waiter.mid).queued -= 1
+            if not waiters:
+                del sessions[session]
+
+    def try_acquire(self, mid: str) -> bool:
+        """
+        Take a slot for ``mid`` only if one is free now and no call is waiting for it.
+
+        For optional extra work such as hedged requests; a True result must be
+        paired with ``release(mid)``.
+        """
+        state = self._model(mid)
+        if self.active < self.concurrency and state.active < state.limit and not state.queued:
+            self._grant(state)
+            return True
+        return False
+
+    def release(self, mid: str) -> None:
+        self.active -= 1
+        self._model(mid).active -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.active < self.concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            state = self._model(waiter.mid)
+            state.queued -= 1
+            self._grant(state)
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in sorted(self._queues):
+            sessions = self._queues[priority]
+            for session, waiters in list(sessions.items()):
+                for waiter in waiters:
+                    state = self._model(waiter.mid)
+                    if state.active < state.limit:
+                        waiters.remove(waiter)
+                        # Move the session to the back of the rotation
+                        del sessions[session]
+                        if waiters:
+                            sessions[session] = waiters
+                        return waiter
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        models = {}
+        for mid, state in self._models.items():
+            waits = sorted(state.waits)
+            models[mid] = {
+                "limit": state.limit,
+                "active": state.active,
+                "queued": state.queued,
+                "admitted": state.admitted,
+                "rejected": state.rejected,
+                "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+                "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            }
+        queued = {
+            _PRIORITY_NAMES.get(priority, str(priority)): sum(len(w) for w in sessions.values())
+            for priority, sessions in self._queues.items()
+        }
+        return {"concurrency": self.concurrency, "active": self.active, "queued_by_priority": queued, "models": models}
+
+
+upstream_scheduler = UpstreamScheduler(model_limits=parse_model_limits(UPSTREAM_MODEL_LIMITS))
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import os
+import re
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it the semantic cache stays disabled
+    np = None
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Falls back to the hashing vectorizer
+    SentenceTransformer = None
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.85"))  # Cosine similarity
+SEMANTIC_CACHE_MAX_ITEMS = int(os.getenv("SEMANTIC_CACHE_MAX_ITEMS", "2000"))  # Prompts kept per model
+# A sentence-transformers model name; leave empty to always use the hashing vectorizer
+SEMANTIC_CACHE_MODEL = os.getenv("SEMANTIC_CACHE_MODEL", "all-MiniLM-L6-v2")
+HASHING_DIMENSIONS = 2 ** 12
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Function words carry little of a question's meaning and mostly add noise
+_STOP_WORDS = frozenset(
+    "a about an and are be can could do does explain for how i in is it me my of on please so tell the to "
+    "what why would you".split()
+)
+
+
+class HashingVectorizer:
+    """
+    Embed text by hashing word unigrams, word bigrams and character trigrams into a fixed-size vector.
+
+    Needs nothing beyond NumPy, and paraphrases that reuse most of their words
+    still land close together. Vectors are L2 normalized.
+    """
+
+    def __init__(self, dimensions: int = HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[str]:
+        words = [w for w in _WORD.findall(text.lower()) if w not in _STOP_WORDS]
+        features = [f"w:{w}" for w in words]
+        features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+        for word in words:
+            padded = f" {word} "
+            features += [f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+        return features
+
+    def encode(self, text: str) -> "np.ndarray":
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            # The top bit picks the sign, so hash collisions tend to cancel out
+            vector[digest % self.dimensions] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class SentenceEncoder:
+    """Embed text with a small local sentence-transformers model on the CPU."""
+
+    def __init__(self, model_name: str):
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, text: str) -> "np.ndarray":
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+class _PromptIndex:
+    """Ring buffer of prompt embeddings for one model, searched with a single matrix product."""
+
+    def __init__(self, capacity: int, dimensions: int):
+        self.vectors = np.zeros((capacity, dimensions), dtype=np.float32)
+        self.replies: List[Optional[str]] = [None] * capacity
+        self.count = 0
+        self.next = 0
+
+    def add(self, vector: "np.ndarray", reply: str) -> None:
+        self.vectors[self.next] = vector
+        self.replies[self.next] = reply
+        self.next = (self.next + 1) % len(self.replies)
+        self.count = min(self.count + 1, len(self.replies))
+
+    def search(self, vector: "np.ndarray") -> Tuple[Optional[str], float]:
+        if self.count == 0:
+            return None, 0.0
+        scores = self.vectors[:self.count] @ vector
+        best = int(np.argmax(scores))
+        return self.replies[best], float(scores[best])
+
+
+class SemanticCache:
+    """
+    Serve a cached reply when a new prompt is a near duplicate of an earlier one to the same model.
+
+    Prompts are embedded in a worker thread and compared by cosine similarity
+    against the model's recent prompts. Only the prompt text is compared, so use
+    this only where a reply does not depend on earlier turns of the conversation.
+    """
+
+    def __init__(
+        self,
+        encoder: Any,
+        dimensions: int,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_items: int = SEMANTIC_CACHE_MAX_ITEMS,
+    ):
+        self.encoder = encoder
+        self.dimensions = dimensions
+        self.threshold = threshold
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self.scores: deque = deque(maxlen=1000)
+        self._indexes: Dict[str, _PromptIndex] = {}
+        self._recent: Dict[str, "np.ndarray"] = {}
+
+    async def _embed(self, prompt: str) -> "np.ndarray":
+        vector = self._recent.get(prompt)
+        if vector is None:
+            vector = await asyncio.to_thread(self.encoder.encode, prompt)
+            # Keep the last few embeddings so a miss followed by add() embeds once
+            if len(self._recent) >= 64:
+                self._recent.pop(next(iter(self._recent)))
+            self._recent[prompt] = vector
+        return vector
+
+    async def get(self, mid: str, prompt: str) -> Optional[str]:
+        """
+        Look up a reply to a prompt similar to ``prompt``.
+
+        Args:
+            mid: The chat model id
+            prompt: The user's message
+
+        Returns:
+            The cached reply if the closest prompt scores at least ``threshold``, else None
+        """
+        index = self._indexes.get(mid)
+        if index is None or index.count == 0:
+            self.misses += 1
+            return None
+        reply, score = index.search(await self._embed(prompt))
+        self.scores.append(score)
+        if reply is not None and score >= self.threshold:
+            self.hits += 1
+            logger.info("Semantic cache hit for model %s with similarity %.3f", mid, score)
+            return reply
+        self.misses += 1
+        logger.debug("Semantic cache miss for model %s, best similarity %.3f", mid, score)
+        return None
+
+    async def add(self, mid: str, prompt: str, reply: str) -> None:
+        vector = await self._embed(prompt)
+        index = self._indexes.get(mid)
+        if index is None:
+            index = self._indexes[mid] = _PromptIndex(self.max_items, self.dimensions)
+        index.add(vector, reply)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        scores = sorted(self.scores)
+        return {
+            "encoder": type(self.encoder).__name__,
+            "threshold": self.threshold,
+            "items": {mid: index.count for mid, index in self._indexes.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "similarity_p50": scores[len(scores) // 2] if scores else None,
+            "similarity_max": scores[-1] if scores else None,
+            "recent_similarities": [round(s, 4) for s in list(self.scores)[-20:]],
+        }
+
+
+def _build_semantic_cache() -> Optional[SemanticCache]:
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if np is None:
+        logger.warning("SEMANTIC_CACHE_ENABLED is set but NumPy is not installed; semantic cache disabled")
+        return None
+    if SEMANTIC_CACHE_MODEL and SentenceTransformer is not None:
+        try:
+            encoder = SentenceEncoder(SEMANTIC_CACHE_MODEL)
+            dimensions = encoder.model.get_sentence_embedding_dimension()
+            logger.info("Semantic cache using %s embeddings", SEMANTIC_CACHE_MODEL)
+            return SemanticCache(encoder, dimensions)
+        except Exception as e:
+            logger.error("Failed to load embedding model %s: %s", SEMANTIC_CACHE_MODEL, e)
+    logger.info("Semantic cache using the hashing vectorizer")
+    return SemanticCache(HashingVectorizer(), HASHING_DIMENSIONS)
+
+
+# None when disabled
+semantic_cache = _build_semantic_cache()
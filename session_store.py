@@ -0,0 +1,327 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+from logging_config import get_logger
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "cache/sessions.db")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))  # Seconds since last use
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "50"))
+SESSION_MAX_TURN_CHARS = int(os.getenv("SESSION_MAX_TURN_CHARS", "8000"))
+SESSION_MAX_VALUES = int(os.getenv("SESSION_MAX_VALUES", "32"))
+SESSION_MAX_VALUE_BYTES = int(os.getenv("SESSION_MAX_VALUE_BYTES", "16384"))
+
+
+class SessionStore(ABC):
+    """
+    Server-side per-session state and conversation history, keyed by session id.
+
+    Only the session id travels in the signed cookie; everything else lives here.
+    Conversation turns are capped at ``max_turns`` per session, oldest dropped first,
+    and each text field of a turn is cut to ``max_turn_chars``. A session holds at
+    most ``max_values`` values of up to ``max_value_bytes`` each once JSON encoded,
+    so memory per session has a fixed ceiling.
+    """
+
+    def __init__(
+        self,
+        ttl: float = SESSION_TTL,
+        max_turns: int = SESSION_MAX_TURNS,
+        max_turn_chars: int = SESSION_MAX_TURN_CHARS,
+        max_values: int = SESSION_MAX_VALUES,
+        max_value_bytes: int = SESSION_MAX_VALUE_BYTES,
+    ):
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self.max_turn_chars = max_turn_chars
+        self.max_values = max_values
+        self.max_value_bytes = max_value_bytes
+
+    def _encode_value(self, key: str, value: Any) -> str:
+        encoded = json.dumps(value)
+        if len(encoded) > self.max_value_bytes:
+            raise ValueError(f"Session value '{key}' is {len(encoded)} bytes, over the {self.max_value_bytes} byte limit")
+        return encoded
+
+    def _bound_turn(self, turn: Dict[str, Any]) -> Dict[str, Any]:
+        return {k: v[:self.max_turn_chars] if isinstance(v, str) else v for k, v in turn.items()}
+
+    @abstractmethod
+    async def get(self, sid: str, key: str) -> Any:
+        ...
+
+    @abstractmethod
+    async def set(self, sid: str, key: str, value: Any) -> None:
+        ...
+
+    @abstractmethod
+    async def get_turns(self, sid: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def append_turn(self, sid: str, turn: Dict[str, Any]) -> None:
+        ...
+
+    @abstractmethod
+    async def clear_turns(self, sid: str) -> None:
+        ...
+
+    @abstractmethod
+    async def clear(self, sid: str) -> None:
+        ...
+
+    @abstractmethod
+    async def size(self) -> int:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class _SessionRecord:
+    __slots__ = ("values", "turns", "touched")
+
+    def __init__(self, max_turns: int):
+        self.values: Dict[str, Any] = {}
+        self.turns: deque = deque(maxlen=max_turns)
+        self.touched = time.monotonic()
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store with TTL expiry and LRU eviction once ``max_sessions`` is reached."""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions
+        self._records: "OrderedDict[str, _SessionRecord]" = OrderedDict()
+
+    def _record(self, sid: str, create: bool) -> Optional[_SessionRecord]:
+        now = time.monotonic()
+        record = self._records.get(sid)
+        if record is not None and now - record.touched > self.ttl:
+            del self._records[sid]
+            record = None
+        if record is None:
+            if not create:
+                return None
+            record = _SessionRecord(self.max_turns)
+            self._records[sid] = record
+            self._evict(now)
+        else:
+            self._records.move_to_end(sid)
+        record.touched = now
+        return record
+
+    def _evict(self, now: float) -> None:
+        # Expired sessions sit at the front, since access order tracks recency
+        while self._records:
+            sid, oldest = next(iter(self._records.items()))
+            if len(self._records) <= self.max_sessions and now - oldest.touched <= self.ttl:
+                break
+            del self._records[sid]
+
+    async def get(self, sid: str, key: str) -> Any:
+        record = self._record(sid, create=False)
+        return record.values.get(key) if record is not None else None
+
+    async def set(self, sid: str, key: str, value: Any) -> None:
+        self._encode_value(key, value)
+        values = self._record(sid, create=True).values
+        if key not in values and len(values) >= self.max_values:
+            raise ValueError(f"Session already holds {self.max_values} values")
+        values[key] = value
+
+    async def get_turns(self, sid: str) -> List[Dict[str, Any]]:
+        record = self._record(sid, create=False)
+        return list(record.turns) if record is not None else []
+
+    async def append_turn(self, sid: str, turn: Dict[str, Any]) -> None:
+        self._record(sid, create=True).turns.append(self._bound_turn(turn))
+
+    async def clear_turns(self, sid: str) -> None:
+        record = self._record(sid, create=False)
+        if record is not None:
+            record.turns.clear()
+
+    async def clear(self, sid: str) -> None:
+        self._records.pop(sid, None)
+
+    async def size(self) -> int:
+        return len(self._records)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    File-backed store, shared by every worker process on the host.
+
+    Blocking sqlite calls run in a worker thread. Sessions expire ``ttl`` seconds
+    after their last use and are purged every ``purge_interval`` seconds.
+    """
+
+    def __init__(self, path: str = SESSION_DB_PATH, purge_interval: float = 300, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.path = path
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, touched REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS sessions_touched ON sessions (touched);
+            CREATE TABLE IF NOT EXISTS session_values (
+                sid TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (sid, key)
+            );
+            CREATE TABLE IF NOT EXISTS turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sid TEXT NOT NULL, turn TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS turns_sid ON turns (sid, id);
+            """
+        )
+
+    async def _run(self, fn, *args):
+        def locked():
+            with self._lock:
+                return fn(*args)
+        return await asyncio.to_thread(locked)
+
+    def _alive(self, sid: str) -> bool:
+        row = self._conn.execute("SELECT touched FROM sessions WHERE sid = ?", (sid,)).fetchone()
+        return row is not None and time.time() - row[0] <= self.ttl
+
+    def _touch(self, sid: str) -> None:
+        now = time.time()
+        if not self._alive(sid):
+            # An expired session the purge has not reached yet starts over empty
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._clear_state(sid)
+        self._conn.execute(
+            "INSERT INTO sessions (sid, touched) VALUES (?, ?) ON CONFLICT(sid) DO UPDATE SET touched = excluded.touched",
+            (sid, now),
+        )
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            self._purge(now - self.ttl)
+
+    def _purge(self, cutoff: float) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM turns WHERE sid IN (SELECT sid FROM sessions WHERE touched < ?)", (cutoff,))
+            self._conn.execute("DELETE FROM session_values WHERE sid IN (SELECT sid FROM sessions WHERE touched < ?)", (cutoff,))
+            deleted = self._conn.execute("DELETE FROM sessions WHERE touched < ?", (cutoff,)).rowcount
+        if deleted:
+            logger.info("Purged %s expired sessions", deleted)
+
+    def _get(self, sid: str, key: str) -> Any:
+        if not self._alive(sid):
+            return None
+        self._touch(sid)
+        row = self._conn.execute("SELECT value FROM session_values WHERE sid = ? AND key = ?", (sid, key)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def _set(self, sid: str, key: str, value: Any) -> None:
+        encoded = self._encode_value(key, value)
+        self._touch(sid)
+        count = self._conn.execute(
+            "SELECT COUNT(*) FROM session_values WHERE sid = ? AND key != ?", (sid, key)
+        ).fetchone()[0]
+        if count >= self.max_values:
+            raise ValueError(f"Session already holds {self.max_values} values")
+        self._conn.execute(
+            "INSERT INTO session_values (sid, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(sid, key) DO UPDATE SET value = excluded.value",
+            (sid, key, encoded),
+        )
+
+    def _get_turns(self, sid: str) -> List[Dict[str, Any]]:
+        if not self._alive(sid):
+            return []
+        self._touch(sid)
+        rows = self._conn.execute("SELECT turn FROM turns WHERE sid = ? ORDER BY id", (sid,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _append_turn(self, sid: str, turn: Dict[str, Any]) -> None:
+        self._touch(sid)
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("INSERT INTO turns (sid, turn) VALUES (?, ?)", (sid, json.dumps(self._bound_turn(turn))))
+            self._conn.execute(
+                "DELETE FROM turns WHERE sid = ? AND id NOT IN (SELECT id FROM turns WHERE sid = ? ORDER BY id DESC LIMIT ?)",
+                (sid, sid, self.max_turns),
+            )
+
+    def _clear_turns(self, sid: str) -> None:
+        self._conn.execute("DELETE FROM turns WHERE sid = ?", (sid,))
+
+    def _clear_state(self, sid: str) -> None:
+        self._conn.execute("DELETE FROM turns WHERE sid = ?", (sid,))
+        self._conn.execute("DELETE FROM session_values WHERE sid = ?", (sid,))
+
+    def _clear(self, sid: str) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._clear_state(sid)
+            self._conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def _size(self) -> int:
+        cutoff = time.time() - self.ttl
+        return self._conn.execute("SELECT COUNT(*) FROM sessions WHERE touched >= ?", (cutoff,)).fetchone()[0]
+
+    async def get(self, sid: str, key: str) -> Any:
+        return await self._run(self._get, sid, key)
+
+    async def set(self, sid: str, key: str, value: Any) -> None:
+        await self._run(self._set, sid, key, value)
+
+    async def get_turns(self, sid: str) -> List[Dict[str, Any]]:
+        return await self._run(self._get_turns, sid)
+
+    async def append_turn(self, sid: str, turn: Dict[str, Any]) -> None:
+        await self._run(self._append_turn, sid, turn)
+
+    async def clear_turns(self, sid: str) -> None:
+        await self._run(self._clear_turns, sid)
+
+    async def clear(self, sid: str) -> None:
+        await self._run(self._clear, sid)
+
+    async def size(self) -> int:
+        return await self._run(self._size)
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+
+
+def _build_session_store() -> SessionStore:
+    if SESSION_BACKEND == "sqlite":
+        logger.info("Using SQLite session store at %s", SESSION_DB_PATH)
+        return SQLiteSessionStore(SESSION_DB_PATH)
+    if SESSION_BACKEND != "memory":
+        logger.warning("Unknown SESSION_BACKEND '%s', using in-memory session store", SESSION_BACKEND)
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1:
+        logger.warning("In-memory session store is per process; set SESSION_BACKEND=sqlite when running multiple workers")
+    return MemorySessionStore()
+
+
+session_store = _build_session_store()
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from logging_config import get_logger
+
+# Setup logging
+logger = get_logger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the work as its own task; callers that
+    arrive while it is pending await the same task and receive its result or
+    exception. Because the work runs in a separate task, a caller that is
+    cancelled (e.g. its client disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.shared = 0
+        self._pending: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run ``fn`` unless a call with the same key is already in flight, then return its result.
+
+        Args:
+            key: Fingerprint of the request; equal keys must mean interchangeable results
+            fn: Coroutine function performing the work
+
+        Returns:
+            The result of the single execution for this key
+        """
+        self.calls += 1
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._pending[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.shared += 1
+            logger.debug("Joined in-flight %s call %s", self.name, key[:12])
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        # Mark the exception retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._pending)}
+
+
+# Image generations, keyed by avatar_cache.cache_key
+avatar_flight = SingleFlight("avatar")
+# Non-streaming chat completions, keyed by response_cache.response_key
+chat_flight = SingleFlight("chat")
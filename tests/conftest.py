@@ -0,0 +1,38 @@
+import httpx
+import pytest
+
+import mock_upstream
+
+
+@pytest.fixture
+def mock_config():
+    """The mock upstream's settings, made fast and error free, and restored after the test."""
+    saved = mock_upstream.config.as_dict()
+    mock_upstream.config.update({
+        "latency_ms": 20,
+        "latency_distribution": "fixed",
+        "error_rate": 0,
+        "rate_limit_rate": 0,
+        "response_words": 8,
+        "token_delay_ms": 0,
+    })
+    yield mock_upstream.config
+    mock_upstream.config.update(saved)
+
+
+@pytest.fixture
+async def mock_client(mock_config):
+    """An HTTP client wired straight to the mock upstream app, with no network in between."""
+    transport = httpx.ASGITransport(app=mock_upstream.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://mock-upstream") as client:
+        yield client
+
+
+@pytest.fixture
+def run_mock(mock_client):
+    """Coroutine function making one text model call against the mock, like upstream.run_model."""
+
+    async def run(mid: str = "@cf/meta/llama-3-8b-instruct") -> httpx.Response:
+        return await mock_client.post(f"/run/{mid}", json={"messages": [{"role": "user", "content": "hi"}]})
+
+    return run
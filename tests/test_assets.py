@@ -0,0 +1,43 @@
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from assets import CachedStaticFiles, _accepted
+
+
+@pytest.fixture
+async def static_client(tmp_path):
+    """A client for a static mount holding a stylesheet with gzip and Brotli siblings."""
+    for name, data in (("site.css", b"plain"), ("site.css.gz", b"gzipped"), ("site.css.br", b"brotli")):
+        (tmp_path / name).write_bytes(data)
+    app = Starlette(routes=[Mount("/static", CachedStaticFiles(directory=str(tmp_path)))])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+def test_accepted_reads_q_values():
+    assert _accepted("gzip, deflate, br;q=0") == {"gzip": 1.0, "deflate": 1.0, "br": 0.0}
+    assert _accepted("br;q=0.5 , *;q=0") == {"br": 0.5, "*": 0.0}
+    assert _accepted("gzip;q=oops") == {"gzip": 0.0}
+    assert _accepted("") == {}
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding, body",
+    [
+        ("gzip, deflate, br", "br", b"brotli"),
+        ("gzip, br;q=0", "gzip", b"gzipped"),
+        ("br;q=0, gzip;q=0", None, b"plain"),
+        ("*", "br", b"brotli"),
+        ("*;q=0", None, b"plain"),
+        ("identity", None, b"plain"),
+    ],
+)
+async def test_refused_encodings_are_not_served(static_client, accept_encoding, encoding, body):
+    headers = {"Accept-Encoding": accept_encoding}
+    async with static_client.stream("GET", "/static/site.css", headers=headers) as response:
+        # The siblings hold placeholder bytes, so read them undecoded
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    assert response.headers.get("Content-Encoding") == encoding
+    assert raw == body
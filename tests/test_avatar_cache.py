@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+import avatar_cache
+from avatar_cache import DiskCache, MemoryLRU, TieredCache, cache_key
+
+
+@pytest.fixture
+def tiers(monkeypatch, tmp_path):
+    """Fresh avatar and request tiers backed by a temporary directory."""
+    store = TieredCache(MemoryLRU(1024, 4), DiskCache(str(tmp_path / "images"), 1024, suffix=".png"))
+    refs = TieredCache(MemoryLRU(1024, 4), DiskCache(str(tmp_path / "requests"), 1024, suffix=".ref"))
+    monkeypatch.setattr(avatar_cache, "avatar_store", store)
+    monkeypatch.setattr(avatar_cache, "avatar_cache", refs)
+    return store, refs
+
+
+def test_cache_key_ignores_param_order():
+    key = cache_key("@cf/model", "a robot", {"seed": 1, "steps": 4})
+    assert key == cache_key("@cf/model", "a robot", {"steps": 4, "seed": 1})
+    assert key != cache_key("@cf/model", "a robot", {"seed": 2, "steps": 4})
+    assert cache_key("@cf/model", "a robot") == cache_key("@cf/model", "a robot", {})
+
+
+def test_memory_lru_evicts_by_count_and_size():
+    memory = MemoryLRU(max_bytes=10, max_items=2)
+    memory.set("a", b"aaa")
+    memory.set("b", b"bbb")
+    memory.get("a")
+    memory.set("c", b"ccc")
+    assert "b" not in memory
+    assert memory.get("a") == b"aaa"
+
+    memory.set("d", b"dddddddd")
+    assert list(memory._entries) == ["d"]
+    assert memory.size == 8
+
+    # An entry larger than the whole cache is not stored at all
+    memory.set("huge", b"x" * 11)
+    assert "huge" not in memory
+    assert memory.pop("d") == b"dddddddd"
+    assert memory.size == 0
+
+
+def test_disk_cache_evicts_least_recently_used_files(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=10, suffix=".png")
+    disk.set("old", b"1234")
+    disk.set("new", b"5678")
+    os.utime(disk.path("old"), (1, 1))
+    os.utime(disk.path("new"), (2, 2))
+    assert disk.get("missing") is None
+    assert not disk.contains("missing")
+
+    disk.set("newest", b"9012")
+    assert not disk.contains("old")
+    assert disk.get("new") == b"5678"
+    assert disk.size == 8
+
+    # Replacing a blob counts its new size only
+    disk.set("new", b"56")
+    assert disk.size == 6
+    assert DiskCache(str(tmp_path), max_bytes=10, suffix=".png").size == 6
+
+
+async def test_tiered_cache_promotes_disk_hits_to_memory(tmp_path):
+    disk = DiskCache(str(tmp_path), max_bytes=1024)
+    disk.set("key", b"data")
+    cache = TieredCache(MemoryLRU(1024, 4), disk)
+
+    assert await cache.contains("key")
+    assert "key" not in cache.memory
+    assert await cache.get("key") == b"data"
+    assert await cache.get("key") == b"data"
+    assert await cache.get("missing") is None
+    assert not await cache.contains("missing")
+
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["memory_items"] == 1
+
+
+async def test_stored_avatars_are_found_by_request_key(tiers):
+    store, refs = tiers
+    key = cache_key("@cf/model", "a robot")
+    assert await avatar_cache.get_cached_avatar_id(key) is None
+
+    avatar_id = await avatar_cache.store_avatar(b"png bytes")
+    assert avatar_cache.is_avatar_id(avatar_id)
+    assert await avatar_cache.store_avatar(b"png bytes") == avatar_id
+    await avatar_cache.cache_avatar_id(key, avatar_id)
+    assert await avatar_cache.get_cached_avatar_id(key) == avatar_id
+    assert await avatar_cache.load_avatar(avatar_id) == b"png bytes"
+    assert await avatar_cache.load_avatar("../../etc/passwd") is None
+
+    # A request whose avatar has been evicted from both tiers is a miss
+    store.memory.pop(avatar_id)
+    os.remove(store.disk.path(avatar_id))
+    assert await avatar_cache.get_cached_avatar_id(key) is None
@@ -0,0 +1,103 @@
+from context_builder import (
+    approx_tokens,
+    build_context,
+    is_standalone,
+    message_tokens,
+    summarize_turns,
+)
+
+SYSTEM = {"role": "system", "content": "You are a meticulous scientist."}
+INTRO = {"role": "user", "content": "Introduce yourself."}
+BASE = [SYSTEM, INTRO]
+
+
+def turn(n: int, words: int = 5) -> dict:
+    return {"user": f"Question {n}. " + "word " * words, "ai": f"Answer {n}. " + "word " * words}
+
+
+def total_tokens(messages) -> int:
+    return sum(message_tokens(m) for m in messages)
+
+
+def test_approx_tokens_counts_long_words_and_punctuation():
+    assert approx_tokens("") == 0
+    assert approx_tokens("a bb ccc dddd") == 4
+    assert approx_tokens("electroencephalography") == 6
+    assert approx_tokens("Why?!") == 3
+
+
+def test_everything_fits_under_a_large_budget():
+    turns = [turn(n) for n in range(3)]
+    context = build_context(BASE, turns, "And now?", budget=10_000)
+
+    # Only the system prompt is taken from the base messages
+    assert context[0] == SYSTEM
+    assert INTRO not in context
+    assert [m["role"] for m in context[1:]] == ["user", "assistant"] * 3 + ["user"]
+    assert context[-1] == {"role": "user", "content": "And now?"}
+
+
+def test_intro_turn_is_sent_as_its_user_message():
+    intro_turn = {"user": BASE, "ai": "I am the Mad Scientist."}
+    context = build_context(BASE, [intro_turn], "Hello", budget=10_000)
+    assert context[1:3] == [INTRO, {"role": "assistant", "content": "I am the Mad Scientist."}]
+
+
+def test_oldest_turns_are_dropped_to_fit_the_budget():
+    turns = [turn(n, words=40) for n in range(10)]
+    budget = 200
+    context = build_context(BASE, turns, "Latest question", budget=budget, summarize=False)
+
+    assert total_tokens(context) <= budget
+    kept = [m["content"] for m in context if m["role"] == "user"][:-1]
+    assert kept and kept[-1].startswith("Question 9.")
+    assert not any(content.startswith("Question 0.") for content in kept)
+
+
+def test_dropped_turns_are_summarized_when_room_remains():
+    turns = [turn(n, words=40) for n in range(10)]
+    budget = 300
+    context = build_context(BASE, turns, "Latest question", budget=budget, summarize=True)
+
+    assert total_tokens(context) <= budget
+    assert context[1]["role"] == "system"
+    assert context[1]["content"].startswith("Summary of earlier conversation:")
+    assert "User asked: Question 0." in context[1]["content"]
+
+
+def test_oversized_message_is_truncated_to_the_budget():
+    message = "word " * 1000
+    context = build_context(BASE, [turn(0)], message, budget=100)
+
+    assert context[0] == SYSTEM
+    assert len(context) == 2
+    assert total_tokens(context) <= 100
+    assert context[-1]["content"]
+
+
+def test_summarize_turns_keeps_first_sentences():
+    summary = summarize_turns([{"user": "What is light? Tell me more.", "ai": "A wave. And a particle."}], limit=120)
+    assert summary == "Summary of earlier conversation:\n- User asked: What is light?\n  You answered: A wave."
+
+
+def test_is_standalone_accepts_only_the_base_exchange():
+    intro_reply = {"role": "assistant", "content": "Greetings, I am the Mad Scientist."}
+    question = {"role": "user", "content": "What is entropy?"}
+
+    assert is_standalone([SYSTEM, question], BASE)
+    assert is_standalone([question], BASE)
+    assert is_standalone([SYSTEM, INTRO, intro_reply, question], BASE)
+
+    earlier = {"role": "user", "content": "Tell me about black holes"}
+    earlier_reply = {"role": "assistant", "content": "They are dense."}
+    assert not is_standalone([SYSTEM, INTRO, intro_reply, earlier, earlier_reply, question], BASE)
+    assert not is_standalone([SYSTEM, earlier_reply, question], BASE)
+
+    summary = {"role": "system", "content": "Summary of earlier conversation:\n- User asked: Why?"}
+    assert not is_standalone([SYSTEM, summary, question], BASE)
+
+
+def test_built_context_after_the_intro_is_standalone():
+    intro_turn = {"user": BASE, "ai": "I am the Mad Scientist."}
+    assert is_standalone(build_context(BASE, [intro_turn], "What is entropy?"), BASE)
+    assert not is_standalone(build_context(BASE, [intro_turn, turn(1)], "Why?"), BASE)
@@ -0,0 +1,264 @@
+import asyncio
+
+import httpx
+import pytest
+
+import resilience as resilience_module
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, Resilience
+from scheduler import UpstreamScheduler
+
+MID = "@cf/meta/llama-3-8b-instruct"
+COOLDOWN = 0.05
+
+
+class Counted:
+    """Wraps an upstream call and counts how often it was actually made."""
+
+    def __init__(self, run):
+        self.run = run
+        self.calls = 0
+
+    async def __call__(self) -> httpx.Response:
+        self.calls += 1
+        return await self.run(MID)
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A fresh scheduler that hedged calls take their slots from."""
+    scheduler = UpstreamScheduler(concurrency=8, model_limits={MID: 2})
+    monkeypatch.setattr(resilience_module, "upstream_scheduler", scheduler)
+    return scheduler
+
+
+def make_resilience(retries: int = 0, hedge: bool = False, threshold: int = 2) -> Resilience:
+    layer = Resilience(retries=retries, base_delay=0.001, max_delay=0.01, hedge=hedge)
+    layer._health(MID).breaker = CircuitBreaker(threshold=threshold, cooldown=COOLDOWN)
+    return layer
+
+
+def test_breaker_closed_open_half_open_closed():
+    breaker = CircuitBreaker(threshold=3, cooldown=COOLDOWN)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+    breaker.opened_at -= COOLDOWN
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only one trial call at a time while half open
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(threshold=3, cooldown=COOLDOWN)
+    for _ in range(3):
+        breaker.record_failure()
+    breaker.opened_at -= COOLDOWN
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    assert breaker.retry_after() > 0
+    assert not breaker.allow()
+
+
+def test_released_trial_lets_the_next_call_through():
+    breaker = CircuitBreaker(threshold=1, cooldown=COOLDOWN)
+    breaker.record_failure()
+    breaker.opened_at -= COOLDOWN
+    assert breaker.allow()
+    breaker.release_trial()
+    assert breaker.allow()
+
+
+async def test_breaker_opens_on_upstream_errors_and_recovers(run_mock, mock_config):
+    layer = make_resilience(threshold=2)
+    call = Counted(run_mock)
+    mock_config.update({"error_rate": 1})
+
+    for _ in range(2):
+        assert (await layer.call(MID, call)).status_code == 500
+    assert layer.stats()[MID]["breaker_state"] == OPEN
+
+    with pytest.raises(CircuitOpen):
+        await layer.call(MID, call)
+    assert call.calls == 2
+
+    mock_config.update({"error_rate": 0})
+    await asyncio.sleep(COOLDOWN)
+    assert (await layer.call(MID, call)).status_code == 200
+    assert layer.stats()[MID]["breaker_state"] == CLOSED
+    assert call.calls == 3
+
+
+async def test_client_errors_do_not_trip_the_breaker():
+    layer = make_resilience(threshold=1)
+
+    async def bad_request():
+        return httpx.Response(400)
+
+    for _ in range(3):
+        assert (await layer.call(MID, bad_request)).status_code == 400
+    assert layer.stats()[MID]["breaker_state"] == CLOSED
+
+
+async def test_retries_idempotent_calls_until_they_succeed(run_mock, mock_config):
+    layer = make_resilience(retries=2, threshold=10)
+    mock_config.update({"error_rate": 1})
+    failing = Counted(run_mock)
+    assert (await layer.call(MID, failing)).status_code == 500
+    assert failing.calls == 3
+    assert layer.stats()[MID]["retries"] == 2
+
+    answers = iter([httpx.Response(503), httpx.Response(200)])
+
+    async def flaky():
+        return next(answers)
+
+    assert (await layer.call(MID, flaky)).status_code == 200
+    assert layer.stats()[MID]["consecutive_failures"] == 0
+
+
+async def test_non_idempotent_calls_are_not_retried(run_mock, mock_config):
+    layer = make_resilience(retries=2, threshold=10)
+    mock_config.update({"error_rate": 1})
+    call = Counted(run_mock)
+    assert (await layer.call(MID, call, idempotent=False)).status_code == 500
+    assert call.calls == 1
+
+
+async def test_network_errors_are_retried_then_raised():
+    layer = make_resilience(retries=1, threshold=1)
+    calls = 0
+
+    async def unreachable():
+        nonlocal calls
+        calls += 1
+        raise httpx.ConnectError("connection refused")
+
+    with pytest.raises(httpx.ConnectError):
+        await layer.call(MID, unreachable)
+    assert calls == 2
+    assert layer.stats()[MID]["breaker_state"] == OPEN
+
+
+def test_backoff_uses_full_jitter_and_honours_retry_after():
+    layer = Resilience(base_delay=0.25, max_delay=4)
+    for attempt in range(6):
+        delays = [layer._backoff(attempt, None) for _ in range(200)]
+        assert all(0 <= d <= min(4, 0.25 * 2 ** attempt) for d in delays)
+        # Full jitter spreads retries over the whole window
+        assert len(set(delays)) > 100
+
+    assert layer._backoff(0, httpx.Response(429, headers={"Retry-After": "2"})) == 2
+    # A Retry-After longer than the maximum delay falls back to jitter
+    assert layer._backoff(0, httpx.Response(429, headers={"Retry-After": "60"})) <= 0.25
+
+
+async def test_hedge_wins_and_cancels_the_slow_primary(scheduler):
+    layer = make_resilience(hedge=True)
+    layer._health(MID).latencies.extend([0.01] * 30)
+    primary_cancelled = asyncio.Event()
+    calls = 0
+
+    async def first_call_stalls():
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                primary_cancelled.set()
+                raise
+        return httpx.Response(200)
+
+    async with scheduler.slot(MID):
+        response = await asyncio.wait_for(layer.call(MID, first_call_stalls, hedge=True), 1)
+        await asyncio.sleep(0)
+        assert scheduler.active == 1
+
+    assert response.status_code == 200
+    assert primary_cancelled.is_set()
+    stats = layer.stats()[MID]
+    assert stats["hedges"] == 1
+    assert stats["hedge_wins"] == 1
+    assert scheduler.active == 0
+
+
+async def test_cancelling_the_caller_cancels_the_primary(scheduler):
+    layer = make_resilience(hedge=True)
+    layer._health(MID).latencies.extend([5.0] * 30)
+    started, primary_cancelled = asyncio.Event(), asyncio.Event()
+
+    async def stalls():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            primary_cancelled.set()
+            raise
+        return httpx.Response(200)
+
+    # The caller gives up while still waiting out the p95 before hedging
+    caller = asyncio.create_task(layer.call(MID, stalls, hedge=True))
+    await started.wait()
+    caller.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await caller
+    await asyncio.sleep(0)
+
+    assert primary_cancelled.is_set()
+    assert layer.stats()[MID]["hedges"] == 0
+
+
+async def test_hedge_is_skipped_without_a_free_slot(scheduler, run_mock):
+    layer = make_resilience(hedge=True)
+    layer._health(MID).latencies.extend([0.001] * 30)
+    call = Counted(run_mock)
+    peak = 0
+
+    async def measured():
+        nonlocal peak
+        peak = max(peak, scheduler.stats()["models"][MID]["active"])
+        return await call()
+
+    async with scheduler.slot(MID), scheduler.slot(MID):
+        assert (await layer.call(MID, measured, hedge=True)).status_code == 200
+
+    assert call.calls == 1
+    assert peak == 2
+    assert layer.stats()[MID]["hedges"] == 0
+    assert layer.stats()[MID]["hedges_skipped"] == 1
+
+
+async def test_guard_records_stream_outcomes():
+    layer = make_resilience(threshold=1)
+    request = httpx.Request("POST", "http://mock-upstream/run")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        async with layer.guard(MID):
+            raise httpx.HTTPStatusError("boom", request=request, response=httpx.Response(502, request=request))
+    assert layer.stats()[MID]["breaker_state"] == OPEN
+
+    with pytest.raises(CircuitOpen):
+        async with layer.guard(MID):
+            pass
+
+    await asyncio.sleep(COOLDOWN)
+    async with layer.guard(MID):
+        pass
+    assert layer.stats()[MID]["breaker_state"] == CLOSED
@@ -0,0 +1,118 @@
+import asyncio
+
+from response_cache import ResponseCache, response_key
+
+MID = "@cf/meta/llama-3-8b-instruct"
+INTRO = [{"role": "system", "content": "You are a scientist."}, {"role": "user", "content": "Introduce yourself."}]
+
+
+def test_formatting_only_differences_share_a_key():
+    reformatted = [
+        {"role": "System", "content": "  You are   a scientist. "},
+        {"role": "user", "content": "Introduce\nyourself."},
+    ]
+    assert response_key(MID, INTRO) == response_key(MID, reformatted)
+    assert response_key(MID, INTRO) != response_key("@cf/other/model", INTRO)
+    assert response_key(MID, INTRO) != response_key(MID, INTRO, {"temperature": 0.2})
+    assert response_key(MID, INTRO) != response_key(MID, INTRO[:1])
+
+
+def test_keeps_the_newest_max_variants_replies():
+    cache = ResponseCache(max_variants=2, refresh=False)
+    key = response_key(MID, INTRO)
+    assert cache.get(key) is None
+
+    for reply in ("one", "two", "two", "three"):
+        cache.set(key, reply)
+    served = {cache.get(key) for _ in range(50)}
+    assert served == {"two", "three"}
+    assert cache.stats()["hits"] == 50
+    assert cache.stats()["misses"] == 1
+
+
+def test_entries_are_evicted_least_recently_used():
+    cache = ResponseCache(max_items=2, refresh=False)
+    cache.set("a", "A")
+    cache.set("b", "B")
+    cache.get("a")
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.get("a") == "A"
+    assert len(cache) == 2
+
+    cache.set("fresh", "F")
+    assert cache.get("fresh") == "F"
+
+
+async def test_entries_expire_after_ttl():
+    cache = ResponseCache(ttl=0.05, refresh=False)
+    cache.set("a", "A")
+    await asyncio.sleep(0.08)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+async def test_maybe_refresh_adds_variants_in_the_background():
+    cache = ResponseCache(max_variants=3, refresh=True, refresh_after=60)
+    cache.set("a", "first")
+    fetched = asyncio.Event()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await fetched.wait()
+        return f"variant {calls}"
+
+    cache.maybe_refresh("a", fetch)
+    # Only one refresh per key runs at a time
+    cache.maybe_refresh("a", fetch)
+    await asyncio.sleep(0)
+    assert calls == 1
+    fetched.set()
+    await asyncio.gather(*cache._tasks)
+
+    assert cache.stats()["refreshes"] == 1
+    assert {cache.get("a") for _ in range(50)} == {"first", "variant 1"}
+
+
+async def test_maybe_refresh_stops_once_variants_are_full_and_fresh():
+    cache = ResponseCache(max_variants=2, refresh=True, refresh_after=0.05)
+    cache.set("a", "one")
+    cache.set("a", "two")
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        return "three"
+
+    cache.maybe_refresh("a", fetch)
+    cache.maybe_refresh("missing", fetch)
+    await asyncio.sleep(0)
+    assert calls == 0
+
+    # A stale entry is refreshed even when it is full
+    await asyncio.sleep(0.08)
+    cache.maybe_refresh("a", fetch)
+    await asyncio.gather(*cache._tasks)
+    assert calls == 1
+    assert {cache.get("a") for _ in range(50)} == {"two", "three"}
+
+
+async def test_failed_refresh_keeps_the_cached_replies():
+    cache = ResponseCache(max_variants=3, refresh=True)
+    cache.set("a", "kept")
+
+    async def fetch():
+        raise RuntimeError("upstream down")
+
+    cache.maybe_refresh("a", fetch)
+    await asyncio.gather(*cache._tasks)
+    assert cache.get("a") == "kept"
+    assert cache.stats()["refreshes"] == 0
+
+    # The key can be refreshed again after a failure
+    cache.maybe_refresh("a", fetch)
+    assert len(cache._tasks) == 1
+    await cache.close()
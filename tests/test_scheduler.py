@@ -0,0 +1,209 @@
+import asyncio
+
+import pytest
+
+from scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_CHAT,
+    PRIORITY_IMAGE,
+    SchedulerFull,
+    UpstreamScheduler,
+    parse_model_limits,
+)
+
+MID = "@cf/meta/llama-3-8b-instruct"
+OTHER_MID = "@cf/mistral/mistral-7b-instruct-v0.1"
+
+
+async def settle() -> None:
+    # Let every runnable task reach its next await, e.g. join the scheduler queue
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class InFlight:
+    """Counts calls in flight per model and remembers the most seen at once."""
+
+    def __init__(self):
+        self.current = {}
+        self.peak = {}
+
+    async def call(self, scheduler, run, mid, priority=PRIORITY_CHAT, session=None):
+        async with scheduler.slot(mid, priority, session):
+            self.current[mid] = self.current.get(mid, 0) + 1
+            self.peak[mid] = max(self.peak.get(mid, 0), self.current[mid])
+            try:
+                return await run(mid)
+            finally:
+                self.current[mid] -= 1
+
+
+async def test_model_cap_limits_calls_in_flight(run_mock):
+    scheduler = UpstreamScheduler(concurrency=16, model_limits={MID: 2})
+    flight = InFlight()
+
+    responses = await asyncio.gather(*(flight.call(scheduler, run_mock, MID) for _ in range(8)))
+
+    assert [r.status_code for r in responses] == [200] * 8
+    assert flight.peak[MID] == 2
+    stats = scheduler.stats()
+    assert stats["active"] == 0
+    assert stats["models"][MID]["admitted"] == 8
+    assert stats["models"][MID]["queued"] == 0
+
+
+async def test_global_cap_is_never_exceeded(mock_client):
+    scheduler = UpstreamScheduler(concurrency=3, model_concurrency=3)
+    in_flight = 0
+    peak = 0
+
+    async def call(mid):
+        nonlocal in_flight, peak
+        async with scheduler.slot(mid):
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                await mock_client.post(f"/run/{mid}", json={"messages": []})
+            finally:
+                in_flight -= 1
+
+    await asyncio.gather(*(call(mid) for mid in (MID, OTHER_MID) * 5))
+
+    assert peak == 3
+
+
+async def test_full_queue_is_rejected_at_once():
+    scheduler = UpstreamScheduler(model_limits={MID: 1}, queue_size=1)
+    async with scheduler.slot(MID):
+        waiter = asyncio.create_task(scheduler.slot(MID).__aenter__())  # Cancelled before it is granted
+        await settle()
+
+        with pytest.raises(SchedulerFull, match="is full"):
+            async with scheduler.slot(MID):
+                pass
+
+        assert scheduler.stats()["models"][MID]["rejected"] == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+    assert scheduler.stats()["models"][MID]["queued"] == 0
+    assert scheduler.active == 0
+
+
+async def test_queue_wait_times_out():
+    scheduler = UpstreamScheduler(model_limits={MID: 1}, queue_timeout=0.05)
+    async with scheduler.slot(MID):
+        with pytest.raises(SchedulerFull, match="wait exceeded"):
+            async with scheduler.slot(MID):
+                pass
+    stats = scheduler.stats()["models"][MID]
+    assert stats["queued"] == 0
+    assert stats["active"] == 0
+
+
+async def test_cancelled_waiter_leaves_the_queue():
+    scheduler = UpstreamScheduler(model_limits={MID: 1})
+    order = []
+
+    async def call(name):
+        async with scheduler.slot(MID):
+            order.append(name)
+
+    async with scheduler.slot(MID):
+        first = asyncio.create_task(call("first"))
+        second = asyncio.create_task(call("second"))
+        await settle()
+        first.cancel()
+        await settle()
+        assert scheduler.stats()["models"][MID]["queued"] == 1
+
+    await second
+    assert order == ["second"]
+    assert scheduler.active == 0
+
+
+async def test_lower_priority_values_are_served_first():
+    scheduler = UpstreamScheduler(model_limits={MID: 1})
+    order = []
+
+    async def call(name, priority):
+        async with scheduler.slot(MID, priority):
+            order.append(name)
+
+    async with scheduler.slot(MID):
+        tasks = [
+            asyncio.create_task(call("background", PRIORITY_BACKGROUND)),
+            asyncio.create_task(call("image", PRIORITY_IMAGE)),
+            asyncio.create_task(call("chat", PRIORITY_CHAT)),
+        ]
+        await settle()
+        assert scheduler.stats()["queued_by_priority"] == {"background": 1, "image": 1, "chat": 1}
+
+    await asyncio.gather(*tasks)
+    assert order == ["chat", "image", "background"]
+
+
+async def test_sessions_share_slots_round_robin():
+    scheduler = UpstreamScheduler(model_limits={MID: 1})
+    order = []
+
+    async def call(session, n):
+        async with scheduler.slot(MID, PRIORITY_CHAT, session):
+            order.append(f"{session}{n}")
+
+    async with scheduler.slot(MID):
+        # One session's burst arrives before the others' single calls
+        tasks = [asyncio.create_task(call("a", n)) for n in range(3)]
+        tasks += [asyncio.create_task(call("b", 0)), asyncio.create_task(call("c", 0))]
+        await settle()
+
+    await asyncio.gather(*tasks)
+    assert order == ["a0", "b0", "c0", "a1", "a2"]
+
+
+async def test_saturated_model_does_not_block_others():
+    scheduler = UpstreamScheduler(concurrency=4, model_limits={MID: 1})
+    order = []
+
+    async def call(mid):
+        async with scheduler.slot(mid):
+            order.append(mid)
+
+    async with scheduler.slot(MID):
+        blocked = asyncio.create_task(call(MID))
+        await settle()
+        # Another model still has room, so it skips past the queued call
+        await asyncio.wait_for(call(OTHER_MID), 1)
+        assert order == [OTHER_MID]
+    await blocked
+    assert order == [OTHER_MID, MID]
+
+
+async def test_try_acquire_respects_cap_and_queue():
+    scheduler = UpstreamScheduler(model_limits={MID: 2})
+    granted = asyncio.Event()
+    finish = asyncio.Event()
+
+    async def queued_call():
+        async with scheduler.slot(MID):
+            granted.set()
+            await finish.wait()
+
+    async with scheduler.slot(MID):
+        assert scheduler.try_acquire(MID)
+        assert not scheduler.try_acquire(MID)
+        waiter = asyncio.create_task(queued_call())
+        await settle()
+        scheduler.release(MID)
+        await asyncio.wait_for(granted.wait(), 1)
+        # The freed slot went to the queued call, not to a later try_acquire
+        assert not scheduler.try_acquire(MID)
+        finish.set()
+        await waiter
+        assert scheduler.try_acquire(MID)
+        scheduler.release(MID)
+    assert scheduler.active == 0
+
+
+def test_parse_model_limits():
+    assert parse_model_limits("@cf/a/b=2, @cf/c/d=5,broken,=3") == {"@cf/a/b": 2, "@cf/c/d": 5}
+    assert parse_model_limits("") == {}
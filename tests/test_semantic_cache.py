@@ -0,0 +1,110 @@
+import pytest
+from starlette.requests import Request
+
+import mad_scientist
+from mad_scientist import MadScientist
+from semantic_cache import HASHING_DIMENSIONS, HashingVectorizer, SemanticCache
+from session_store import MemorySessionStore
+
+BRAIN_MODEL = "Mistral-7b Instruct"
+
+
+@pytest.fixture
+def chat_env(monkeypatch, mock_client):
+    """Route chat calls to the mock upstream with a fresh session store and semantic cache."""
+    calls = []
+
+    async def run_model(mid, payload, timeout=None):
+        calls.append(payload["messages"][-1]["content"])
+        return await mock_client.post(f"/run/{mid}", json=payload)
+
+    cache = SemanticCache(HashingVectorizer(), HASHING_DIMENSIONS)
+    monkeypatch.setattr(mad_scientist, "run_model", run_model)
+    monkeypatch.setattr(mad_scientist, "session_store", MemorySessionStore())
+    monkeypatch.setattr(mad_scientist, "semantic_cache", cache)
+    return cache, calls
+
+
+async def new_visitor() -> MadScientist:
+    """A visitor who has made an avatar, so their first chat message gets the introduction."""
+    visitor = MadScientist(Request({"type": "http", "session": {}}))
+    await visitor.set_session(visitor.request, "chat", False)
+    return visitor
+
+
+async def test_chat_message_after_the_intro_uses_the_semantic_cache(chat_env):
+    cache, calls = chat_env
+    first, second = await new_visitor(), await new_visitor()
+    for visitor in (first, second):
+        await visitor.chat_message(visitor.request, BRAIN_MODEL, "Introduce yourself")
+
+    reply = await first.chat_message(first.request, BRAIN_MODEL, "What is quantum entanglement?")
+    assert cache.stats()["items"] == {mad_scientist.registry.resolve_mid(BRAIN_MODEL): 1}
+
+    paraphrased = await second.chat_message(second.request, BRAIN_MODEL, "Please explain quantum entanglement")
+    assert paraphrased == reply
+    assert cache.hits == 1
+    # Two introductions and the first question; the paraphrase never reached the model
+    assert len(calls) == 3
+    turns = await second.get_messages(second.request)
+    assert turns[-1] == {"user": "Please explain quantum entanglement", "ai": reply}
+
+
+async def test_follow_ups_are_not_served_from_other_sessions(chat_env):
+    cache, calls = chat_env
+    first, second = await new_visitor(), await new_visitor()
+    for visitor, topic in ((first, "black holes"), (second, "photosynthesis")):
+        await visitor.chat_message(visitor.request, BRAIN_MODEL, "Introduce yourself")
+        await visitor.chat_message(visitor.request, BRAIN_MODEL, f"Tell me about {topic}")
+
+    # Both sessions now carry their own history, so "why?" must reach the model each time
+    await first.chat_message(first.request, BRAIN_MODEL, "why?")
+    await second.chat_message(second.request, BRAIN_MODEL, "why?")
+    assert cache.hits == 0
+    assert calls[-2:] == ["why?", "why?"]
+
+
+def test_hashing_vectorizer_is_normalized_and_ignores_function_words():
+    encoder = HashingVectorizer()
+    vector = encoder.encode("What is quantum entanglement?")
+    assert vector.shape == (HASHING_DIMENSIONS,)
+    assert vector @ vector == pytest.approx(1.0)
+
+    paraphrase = encoder.encode("Please explain quantum entanglement")
+    unrelated = encoder.encode("How do volcanoes erupt?")
+    assert vector @ paraphrase == pytest.approx(1.0)
+    assert vector @ unrelated < 0.5
+    assert not encoder.encode("what is it").any()
+
+
+async def test_lookups_below_the_threshold_miss():
+    cache = SemanticCache(HashingVectorizer(), HASHING_DIMENSIONS, threshold=0.85)
+    assert await cache.get("model", "What is quantum entanglement?") is None
+
+    await cache.add("model", "What is quantum entanglement?", "Spooky action")
+    assert await cache.get("model", "Tell me about quantum entanglement") == "Spooky action"
+    assert await cache.get("model", "How do volcanoes erupt?") is None
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 2)
+    assert stats["hit_rate"] == pytest.approx(1 / 3)
+    assert stats["similarity_max"] == pytest.approx(1.0)
+
+
+async def test_replies_are_kept_per_model():
+    cache = SemanticCache(HashingVectorizer(), HASHING_DIMENSIONS)
+    await cache.add("brain", "What is entropy?", "Disorder")
+    assert await cache.get("other", "What is entropy?") is None
+    assert await cache.get("brain", "What is entropy?") == "Disorder"
+    assert cache.stats()["items"] == {"brain": 1}
+
+
+async def test_oldest_prompts_are_overwritten_at_capacity():
+    cache = SemanticCache(HashingVectorizer(), HASHING_DIMENSIONS, max_items=2)
+    for topic in ("black holes", "photosynthesis", "volcanoes"):
+        await cache.add("brain", f"Tell me about {topic}", topic)
+
+    assert cache.stats()["items"] == {"brain": 2}
+    assert await cache.get("brain", "Tell me about black holes") is None
+    assert await cache.get("brain", "Tell me about volcanoes") == "volcanoes"
+    assert await cache.get("brain", "Tell me about photosynthesis") == "photosynthesis"
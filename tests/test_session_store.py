@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+TTL = 0.2
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+async def store(request, tmp_path):
+    """Each test runs against both backends, with a short TTL."""
+    if request.param == "memory":
+        store = MemorySessionStore(ttl=TTL, max_sessions=3, max_turns=3, max_values=3, max_value_bytes=64)
+    else:
+        store = SQLiteSessionStore(
+            str(tmp_path / "sessions.db"), ttl=TTL, max_turns=3, max_values=3, max_value_bytes=64
+        )
+    yield store
+    await store.close()
+
+
+async def test_writing_to_an_expired_session_starts_it_over(store):
+    await store.set("sid", "avatar", "old")
+    await store.append_turn("sid", {"user": "hi", "ai": "hello"})
+    await asyncio.sleep(TTL + 0.05)
+
+    await store.set("sid", "chat", True)
+    assert await store.get("sid", "avatar") is None
+    assert await store.get("sid", "chat") is True
+
+    await asyncio.sleep(TTL + 0.05)
+    await store.append_turn("sid", {"user": "back again", "ai": "welcome"})
+    assert await store.get_turns("sid") == [{"user": "back again", "ai": "welcome"}]
+    assert await store.get("sid", "chat") is None
+
+
+async def test_values_round_trip_per_session(store):
+    await store.set("a", "avatar", {"url": "/avatars/1.png"})
+    await store.set("a", "chat", False)
+    await store.set("b", "chat", True)
+
+    assert await store.get("a", "avatar") == {"url": "/avatars/1.png"}
+    assert await store.get("a", "chat") is False
+    assert await store.get("b", "chat") is True
+    assert await store.get("a", "missing") is None
+    assert await store.get("unknown", "chat") is None
+    assert await store.size() == 2
+
+
+async def test_value_count_and_size_are_bounded(store):
+    for key in ("a", "b", "c"):
+        await store.set("sid", key, 1)
+    with pytest.raises(ValueError, match="already holds 3 values"):
+        await store.set("sid", "d", 1)
+    # Replacing an existing value is still allowed
+    await store.set("sid", "a", 2)
+    assert await store.get("sid", "a") == 2
+
+    with pytest.raises(ValueError, match="byte limit"):
+        await store.set("sid", "a", "x" * 100)
+    assert await store.get("sid", "a") == 2
+
+
+async def test_turns_keep_the_newest_and_are_cut_to_size(store):
+    store.max_turn_chars = 10
+    for n in range(5):
+        await store.append_turn("sid", {"user": f"question {n}", "ai": f"answer number {n}"})
+
+    turns = await store.get_turns("sid")
+    assert [t["user"] for t in turns] == ["question 2", "question 3", "question 4"]
+    assert turns[-1]["ai"] == "answer num"
+    assert await store.get_turns("unknown") == []
+
+
+async def test_clear_turns_keeps_values_and_clear_drops_everything(store):
+    await store.set("sid", "chat", True)
+    await store.append_turn("sid", {"user": "hi", "ai": "hello"})
+
+    await store.clear_turns("sid")
+    assert await store.get_turns("sid") == []
+    assert await store.get("sid", "chat") is True
+
+    await store.append_turn("sid", {"user": "hi", "ai": "hello"})
+    await store.clear("sid")
+    assert await store.get("sid", "chat") is None
+    assert await store.get_turns("sid") == []
+    assert await store.size() == 0
+
+
+async def test_sessions_expire_unless_used(store):
+    await store.set("idle", "chat", True)
+    await store.set("busy", "chat", True)
+    await store.append_turn("busy", {"user": "hi", "ai": "hello"})
+    for _ in range(4):
+        await asyncio.sleep(TTL / 2)
+        # Reads alone keep a session alive
+        assert await store.get("busy", "chat") is True
+        assert len(await store.get_turns("busy")) == 1
+
+    assert await store.get("idle", "chat") is None
+    assert await store.get_turns("idle") == []
+    assert await store.size() == 1
+
+
+async def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(max_sessions=2)
+    await store.set("a", "chat", True)
+    await store.set("b", "chat", True)
+    await store.get("a", "chat")
+    await store.set("c", "chat", True)
+
+    assert await store.get("b", "chat") is None
+    assert await store.get("a", "chat") is True
+    assert await store.size() == 2
+
+
+async def test_sqlite_store_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    writer, reader = SQLiteSessionStore(path), SQLiteSessionStore(path)
+    try:
+        await writer.set("sid", "chat", True)
+        await writer.append_turn("sid", {"user": "hi", "ai": "hello"})
+        assert await reader.get("sid", "chat") is True
+        assert await reader.get_turns("sid") == [{"user": "hi", "ai": "hello"}]
+    finally:
+        await writer.close()
+        await reader.close()
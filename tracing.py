@@ -0,0 +1,295 @@
+import atexit
+import functools
+import json
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+from jinja2 import Template
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from logging_config import get_logger, request_id_var
+from metrics import route_template
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+# "file" writes JSON lines to TRACING_FILE, "console" writes them to stderr
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")
+TRACING_FILE = os.getenv("TRACING_FILE", "logs/traces.jsonl")
+# Fraction of new traces recorded; incoming traceparent headers keep their own decision
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "1.0"))
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "mad-scientist")
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class Span:
+    """
+    One timed operation, shaped like an OpenTelemetry span.
+
+    Exported with OpenTelemetry field names (hex trace and span ids, unix-nano
+    timestamps, attributes, status, events), so the JSON lines can be loaded by
+    any tool that reads OTel spans.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "start", "end", "attributes", "events", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.start = time.time_ns()
+        self.end = 0
+        self.attributes = attributes
+        self.events: List[Dict[str, Any]] = []
+        self.status = "UNSET"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def add_event(self, name: str, **attributes: Any) -> None:
+        self.events.append({"name": name, "time_unix_nano": time.time_ns(), "attributes": attributes})
+
+    def record_exception(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(error).__name__}: {error}"
+        self.add_event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)})
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "start_time_unix_nano": self.start,
+            "end_time_unix_nano": self.end,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": {"code": self.status, "message": self.error} if self.error else {"code": self.status},
+            "resource": {"service.name": TRACING_SERVICE_NAME},
+        }
+
+
+class SpanExporter:
+    """
+    Write finished spans as JSON lines from a background thread.
+
+    Like the logging pipeline, ending a span only enqueues it, so exporting never
+    blocks the event loop.
+    """
+
+    def __init__(self, exporter: str = TRACING_EXPORTER, path: str = TRACING_FILE):
+        self.exporter = exporter
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def _run(self) -> None:
+        if self.exporter == "console":
+            out = sys.stderr
+        else:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            out = open(self.path, "a", buffering=1)
+        while True:
+            span = self._queue.get()
+            if span is None:
+                break
+            out.write(json.dumps(span.to_dict(), default=str) + "\n")
+        out.flush()
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+_exporter: Optional[SpanExporter] = SpanExporter() if TRACING_ENABLED else None
+if _exporter is not None:
+    atexit.register(_exporter.shutdown)
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Time the block as a child of the current span, or as a new trace if there is none.
+
+    Yields None when tracing is disabled or the trace is not sampled, so callers
+    setting attributes should check the span first. Exceptions leaving the block
+    mark the span as failed and are re-raised.
+
+    Args:
+        name: Span name, e.g. "chat_message"
+        **attributes: Initial span attributes
+    """
+    parent = _current_span.get()
+    if _exporter is None or (parent is not None and not parent.sampled):
+        yield None
+        return
+    if parent is None:
+        current = Span(name, uuid.uuid4().hex, None, random.random() < TRACING_SAMPLE_RATE, attributes)
+    else:
+        current = Span(name, parent.trace_id, parent.span_id, True, attributes)
+    if not current.sampled:
+        # Keep the decision in context so children of an unsampled root are skipped too
+        token = _current_span.set(current)
+        try:
+            yield None
+        finally:
+            _current_span.reset(token)
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end = time.time_ns()
+        if current.status == "UNSET":
+            current.status = "OK"
+        _exporter.export(current)
+
+
+def traced(name: str) -> Callable[[F], F]:
+    """
+    Run each call of an async function inside a span named ``name``.
+
+    When tracing is disabled the function is returned undecorated, so it costs nothing.
+    """
+    def decorator(fn: F) -> F:
+        if _exporter is None:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorator
+
+
+def annotate(**attributes: Any) -> None:
+    """Set attributes on the current span, if one is being recorded."""
+    current = _current_span.get()
+    if current is not None and current.sampled:
+        current.attributes.update(attributes)
+
+
+def _parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    match = _TRACEPARENT.match(value or "")
+    if match is None or match.group(1) == "0" * 32:
+        return None
+    return match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1
+
+
+class TracingMiddleware:
+    """
+    Give every request an id and, when tracing is on, a root span.
+
+    The id comes from a valid X-Request-ID header or is generated, is echoed in
+    the response, and is set in ``logging_config.request_id_var`` so every log
+    record written while serving the request carries it. A W3C ``traceparent``
+    header continues the caller's trace.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        request_id = headers.get("x-request-id", "")
+        if not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        id_token = request_id_var.set(request_id)
+        span_token = None
+        root = None
+        if _exporter is not None:
+            incoming = _parse_traceparent(headers.get("traceparent"))
+            if incoming is not None:
+                trace_id, parent_id, sampled = incoming
+            else:
+                trace_id, parent_id, sampled = uuid.uuid4().hex, None, random.random() < TRACING_SAMPLE_RATE
+            root = Span(f"{scope['method']} {scope['path']}", trace_id, parent_id, sampled, {
+                "http.request.method": scope["method"],
+                "url.path": scope["path"],
+                "request.id": request_id,
+            })
+            span_token = _current_span.set(root)
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            if root is not None:
+                root.record_exception(e)
+            raise
+        finally:
+            if root is not None:
+                _current_span.reset(span_token)
+                if root.sampled:
+                    route = route_template(scope)
+                    root.name = f"{scope['method']} {route}"
+                    root.attributes["http.route"] = route
+                    root.attributes["http.response.status_code"] = status
+                    root.end = time.time_ns()
+                    if root.status == "UNSET":
+                        root.status = "ERROR" if status >= 500 else "OK"
+                    _exporter.export(root)
+            request_id_var.reset(id_token)
+
+
+class TracedTemplate(Template):
+    """Jinja template whose render time is recorded as a ``template.render`` span."""
+
+    def render(self, *args: Any, **kwargs: Any) -> str:
+        with span("template.render", **{"template.name": self.name}):
+            return super().render(*args, **kwargs)
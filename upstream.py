@@ -0,0 +1,173 @@
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from logging_config import get_logger
+from tracing import span
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_REQUEST_BYTES, UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSE_BYTES
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Setup logging
+logger = get_logger(__name__)
+
+API_BASE_URL = os.getenv("API_BASE_URL")
+AUTH_TOKEN = os.getenv("AUTH_TOKEN")
+
+# Connection pool and timeout configuration for Workers AI calls
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "60"))
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Return the process-wide pooled HTTP client, creating it on first use.
+
+    Returns:
+        The shared httpx.AsyncClient used for all Workers AI calls
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        limits = httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        timeout = httpx.Timeout(UPSTREAM_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT)
+        _client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {AUTH_TOKEN}"},
+            limits=limits,
+            timeout=timeout,
+        )
+        logger.info("Upstream client created (max_connections=%s, keepalive=%s)", UPSTREAM_MAX_CONNECTIONS, UPSTREAM_MAX_KEEPALIVE)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared HTTP client and release its pooled connections."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+        logger.info("Upstream client closed")
+    _client = None
+
+
+def model_url(mid: str) -> str:
+    """Build the Workers AI run URL for a model id."""
+    return f"{API_BASE_URL}{mid}"
+
+
+def _timeout_kwargs(timeout: Optional[float]) -> Dict[str, Any]:
+    if timeout is None:
+        return {}
+    return {"timeout": httpx.Timeout(timeout, connect=UPSTREAM_CONNECT_TIMEOUT)}
+
+
+def _encode(mid: str, payload: Dict[str, Any]) -> bytes:
+    # Serialized here rather than by httpx so the request size is known for free
+    body = json.dumps(payload).encode("utf-8")
+    UPSTREAM_REQUEST_BYTES.labels(mid).observe(len(body))
+    return body
+
+
+def _observe(mid: str, status: str, started: float, received: int) -> None:
+    UPSTREAM_REQUEST_SECONDS.labels(mid, status).observe(time.perf_counter() - started)
+    UPSTREAM_RESPONSE_BYTES.labels(mid).observe(received)
+
+
+async def run_model(mid: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+    """
+    Run a Workers AI model without blocking the event loop.
+
+    Args:
+        mid: The model id, appended to API_BASE_URL
+        payload: The JSON body for the model's input schema
+        timeout: Optional per-call timeout in seconds, overriding UPSTREAM_TIMEOUT
+
+    Returns:
+        The upstream httpx.Response (status is not checked here)
+    """
+    url = model_url(mid)
+    logger.debug("Making API call to: %s", url)
+    body = _encode(mid, payload)
+    in_flight = UPSTREAM_IN_FLIGHT.labels(mid)
+    in_flight.inc()
+    started = time.perf_counter()
+    status = "error"
+    received = 0
+    try:
+        with span("upstream.run", **{"upstream.model": mid, "upstream.request_bytes": len(body)}) as current:
+            response = await get_client().post(url, content=body, headers=_JSON_HEADERS, **_timeout_kwargs(timeout))
+            status = str(response.status_code)
+            received = len(response.content)
+            if current is not None:
+                current.set_attribute("http.response.status_code", response.status_code)
+                current.set_attribute("upstream.response_bytes", received)
+        return response
+    finally:
+        in_flight.dec()
+        _observe(mid, status, started, received)
+
+
+async def stream_model(mid: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> AsyncIterator[str]:
+    """
+    Run a text model with ``stream: true`` and yield tokens as they arrive.
+
+    Workers AI answers streaming requests with server-sent events of the form
+    ``data: {"response": "..."}`` terminated by ``data: [DONE]``.
+
+    Args:
+        mid: The model id, appended to API_BASE_URL
+        payload: The JSON body for the model's input schema
+        timeout: Optional per-call timeout in seconds, overriding UPSTREAM_TIMEOUT
+
+    Yields:
+        Response tokens in arrival order
+
+    Raises:
+        httpx.HTTPStatusError: If the upstream answers with a non-200 status
+    """
+    url = model_url(mid)
+    logger.debug("Making streaming API call to: %s", url)
+    body = _encode(mid, dict(payload, stream=True))
+    in_flight = UPSTREAM_IN_FLIGHT.labels(mid)
+    in_flight.inc()
+    started = time.perf_counter()
+    status = "error"
+    received = 0
+    try:
+        async with get_client().stream("POST", url, content=body, headers=_JSON_HEADERS, **_timeout_kwargs(timeout)) as response:
+            status = str(response.status_code)
+            if response.status_code != 200:
+                received = len(await response.aread())
+                response.raise_for_status()
+            async for line in response.aiter_lines():
+                received += len(line) + 1
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    event = json.loads(data)
+                except ValueError:
+                    logger.warning("Skipping malformed stream event: %s", data[:100])
+                    continue
+                token = event.get("response")
+                if token:
+                    yield token
+    finally:
+        in_flight.dec()
+        # Streams are timed to the last token, or to the point the reader stopped
+        _observe(mid, status, started, received)